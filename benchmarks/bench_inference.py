@@ -0,0 +1,50 @@
+"""
+Benchmark of the compiled GaussianNB kernel against sklearn's predict on a float32 matrix.
+
+    $ python ./benchmarks/bench_inference.py --rows 10000000
+"""
+import argparse
+import time
+import numpy as np
+from src.model.classifiers import GaussianNBModel
+
+
+def timeit(function, repeat: int) -> float:
+    """
+    Best wall time of the function over the repeats.
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the compiled GaussianNB kernel.')
+    parser.add_argument('--rows', type=int, default=5_000_000)
+    parser.add_argument('--features', type=int, default=14)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(42)
+    X = (rng.normal(size=(args.rows, args.features)) * rng.uniform(1, 1000, args.features)).astype(np.float32)
+    Y = X[:, 0] + rng.normal(scale=300, size=args.rows) > 0
+
+    model = GaussianNBModel()
+    model.fit(X[:1_000_000], Y[:1_000_000])
+    kernel = model.compile()
+
+    sklearn = timeit(lambda: model.predict(X), args.repeat)
+    compiled = timeit(lambda: kernel.predict(X), args.repeat)
+    same = np.array_equal(model.predict(X), kernel.predict(X))
+
+    print(f'rows: {args.rows:,} x {args.features} float32')
+    print(f'sklearn predict:  {sklearn:8.3f}s')
+    print(f'compiled predict: {compiled:8.3f}s  identical predictions: {same}')
+    print(f'speedup: {sklearn / compiled:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""
+Benchmark of remove_out_of_range_data against the previous implementation that compared the dropoff time as strings.
+
+    $ python ./benchmarks/bench_out_of_range.py --rows 10000000
+"""
+import argparse
+import calendar
+import time
+import numpy as np
+import pandas as pd
+from src.feature.preprocessing import remove_out_of_range_data
+
+
+def remove_out_of_range_data_str(df: pd.DataFrame, year: str = None, month: str = None) -> pd.DataFrame:
+    """
+    The previous implementation, kept here as the baseline.
+    """
+    start, end = calendar.monthrange(int(year), int(month))
+    start_day = f'{year}-{month}-{start:02d}'
+    end_day = f'{year}-{month}-{end:02d}'
+
+    df = df[df['tpep_dropoff_datetime'].astype('str') >= start_day]
+    df = df[df['tpep_dropoff_datetime'].astype('str') <= end_day]
+
+    return df
+
+
+def get_trips(rows: int, year: str, month: str) -> pd.DataFrame:
+    """
+    Random trips around the month, with a few trips of the previous and the next month.
+    """
+    rng = np.random.default_rng(42)
+    start = pd.Timestamp(f'{year}-{month}-01') - pd.Timedelta(days=2)
+    pickup = start + pd.to_timedelta(rng.integers(0, 35 * 86400, rows), unit='s')
+    dropoff = pickup + pd.to_timedelta(rng.integers(60, 3600, rows), unit='s')
+
+    return pd.DataFrame({'tpep_pickup_datetime': pickup, 'tpep_dropoff_datetime': dropoff})
+
+
+def timeit(function, repeat: int) -> float:
+    """
+    Best wall time of the function over the repeats.
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the datetime range filter.')
+    parser.add_argument('--rows', type=int, default=5_000_000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--year', default='2020')
+    parser.add_argument('--month', default='01')
+    args = parser.parse_args()
+
+    df = get_trips(args.rows, args.year, args.month)
+
+    baseline = timeit(lambda: remove_out_of_range_data_str(df, args.year, args.month), args.repeat)
+    dropoff = timeit(lambda: remove_out_of_range_data(df, args.year, args.month), args.repeat)
+    both = timeit(lambda: remove_out_of_range_data(df, args.year, args.month, ['tpep_pickup_datetime', 'tpep_dropoff_datetime']),
+                  args.repeat)
+
+    print(f'rows: {args.rows:,}')
+    print(f'string comparison (dropoff):     {baseline:8.3f}s  {len(remove_out_of_range_data_str(df, args.year, args.month)):,} rows kept')
+    print(f'int64 comparison (dropoff):      {dropoff:8.3f}s  {len(remove_out_of_range_data(df, args.year, args.month)):,} rows kept')
+    print(f'int64 comparison (pickup, drop): {both:8.3f}s')
+    print(f'speedup: {baseline / dropoff:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+"""
+Load generator for the scoring server. A model is trained on random trips, served in-process on a free port, and
+concurrent keep-alive clients send one trip per request. The run is repeated without batching (max batch size 1) as
+the baseline.
+
+    $ python ./benchmarks/bench_scoring_service.py --clients 64 --requests 200 --max-batch-size 64 --max-wait-ms 2
+"""
+import argparse
+import asyncio
+import json
+import time
+import numpy as np
+import pandas as pd
+from src.feature import feature_selection
+from src.feature.executor import FeatureExecutor
+from src.model.classifiers import GaussianNBModel
+from src.serving.scorer import TripScorer
+from src.serving.server import ScoringServer
+
+FEATURES = [
+    feature_selection.TripFeature(),
+    feature_selection.TimeFeature(),
+    feature_selection.MeterFeature(),
+    feature_selection.TipFeature()
+]
+
+
+def get_trips(rows: int, seed: int = 42) -> pd.DataFrame:
+    """
+    Random raw trips of January 2020.
+    """
+    rng = np.random.default_rng(seed)
+    pickup = pd.Timestamp('2020-01-01') + pd.to_timedelta(rng.integers(0, 31 * 86400, rows), unit='s')
+    fare = rng.uniform(3, 60, rows).round(2)
+
+    return pd.DataFrame({
+        'tpep_pickup_datetime' : pickup,
+        'tpep_dropoff_datetime': pickup + pd.to_timedelta(rng.integers(60, 3600, rows), unit='s'),
+        'trip_distance'        : rng.uniform(0.1, 20, rows).round(2),
+        'tolls_amount'         : np.where(rng.random(rows) < 0.05, 6.12, 0.0),
+        'PULocationID'         : pd.array(rng.integers(1, 266, rows), dtype='Int32'),
+        'DOLocationID'         : pd.array(rng.integers(1, 266, rows), dtype='Int32'),
+        'fare_amount'          : fare,
+        'tip_amount'           : (fare * rng.uniform(0, 0.4, rows)).round(2)
+    })
+
+
+def train_model(rows: int) -> GaussianNBModel:
+    """
+    Train the classifier on the features of random trips.
+    """
+    features = FeatureExecutor(FEATURES).run(get_trips(rows))
+    label = 'big_tip'
+    model = GaussianNBModel(features=[column for column in features.columns if column != label], label=label)
+    model.fit(*model.preprocess(features))
+    return model
+
+
+def to_records(df: pd.DataFrame) -> list:
+    """
+    The trips as JSON records, as a client would send them.
+    """
+    df = df.astype({column: str for column in ['tpep_pickup_datetime', 'tpep_dropoff_datetime']})
+    return json.loads(df.to_json(orient='records'))
+
+
+async def client(port: int, records: list, latencies: list):
+    """
+    Send the records one request at a time over a keep-alive connection.
+    """
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+
+    for record in records:
+        body = json.dumps(record).encode('utf-8')
+        start = time.perf_counter()
+        writer.write(b'POST /score HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\n'
+                     + f'Content-Length: {len(body)}\r\n\r\n'.encode('latin-1') + body)
+        await writer.drain()
+
+        length = 0
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b''):
+                break
+            if line.lower().startswith(b'content-length:'):
+                length = int(line.split(b':')[1])
+        await reader.readexactly(length)
+        latencies.append(time.perf_counter() - start)
+
+    writer.close()
+
+
+async def run(scorer: TripScorer, records: list, clients: int, max_batch_size: int, max_wait: float) -> dict:
+    """
+    Serve the scorer and run the clients, returns the client side latencies and throughput.
+    """
+    server = ScoringServer(scorer, port=0, max_batch_size=max_batch_size, max_wait=max_wait)
+    await server.start()
+
+    latencies = []
+    per_client = len(records) // clients
+    start = time.perf_counter()
+    await asyncio.gather(*[client(server.port, records[i * per_client:(i + 1) * per_client], latencies) for i in range(clients)])
+    elapsed = time.perf_counter() - start
+
+    stats = server.stats.report()
+    await server.stop()
+
+    return {
+        'p50_ms'         : np.percentile(latencies, 50) * 1000,
+        'p99_ms'         : np.percentile(latencies, 99) * 1000,
+        'requests_per_s' : len(latencies) / elapsed,
+        'mean_batch_size': stats['mean_batch_size']
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the scoring server.')
+    parser.add_argument('--clients', type=int, default=64)
+    parser.add_argument('--requests', type=int, default=100, help='Requests per client')
+    parser.add_argument('--max-batch-size', type=int, default=64)
+    parser.add_argument('--max-wait-ms', type=float, default=2.0)
+    parser.add_argument('--train-rows', type=int, default=100_000)
+    args = parser.parse_args()
+
+    scorer = TripScorer(train_model(args.train_rows), FEATURES)
+    records = to_records(get_trips(args.clients * args.requests, seed=7))
+
+    for name, max_batch_size in [('no batching', 1), (f'max batch {args.max_batch_size}', args.max_batch_size)]:
+        result = asyncio.run(run(scorer, records, args.clients, max_batch_size, args.max_wait_ms / 1000))
+        print(f"{name:>14}: p50 {result['p50_ms']:7.2f} ms  p99 {result['p99_ms']:7.2f} ms  "
+              f"{result['requests_per_s']:8.0f} req/s  mean batch {result['mean_batch_size']:.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,5 @@
 import logging
+import logging.config
 import sys
 from pathlib import Path
 from rich.logging import RichHandler
@@ -39,6 +40,22 @@ logging_config = {
             "formatter"  : "detailed",
             "level"      : logging.ERROR,
         },
+        "profile": {
+            "class"      : "logging.handlers.RotatingFileHandler",
+            "filename"   : Path(LOGS_DIR, "profile.jsonl"),
+            "maxBytes"   : 10485760,
+            "backupCount": 10,
+            "formatter"  : "minimal",
+            "level"      : logging.INFO,
+        },
+    },
+    "loggers"                 : {
+        # one JSON record per pipeline stage, see src/monitoring/profiler.py
+        "pipeline.profile": {
+            "handlers" : ["profile"],
+            "level"    : logging.INFO,
+            "propagate": False,
+        },
     },
     "root"                    : {
         "handlers" : ["console", "info", "error"],
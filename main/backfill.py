@@ -0,0 +1,69 @@
+from src.dataset.backfill import month_range, run_backfill
+from src.dataset.create_dataset import CHUNK_SIZE
+from rich.console import Console
+from rich.table import Table
+import argparse
+import sys
+
+START = '2014-01'
+END = '2022-12'
+
+
+def main():
+    """
+    This function cleans every month between --start and --end on a pool of processes
+
+    Months that were cleaned by a previous run are skipped unless --force is given, so an interrupted backfill
+    can be resumed by running the same command again.
+
+    Args:
+        None
+    Returns:
+        None
+    """
+    parser = argparse.ArgumentParser(description='Clean the raw trip data of many months in parallel.')
+    parser.add_argument('--start', default=START, help='First month to clean (e.g. 2014-01)')
+    parser.add_argument('--end', default=END, help='Last month to clean (e.g. 2022-12)')
+    parser.add_argument('--workers', type=int, default=None, help='Number of processes (default: number of cores)')
+    parser.add_argument('--retries', type=int, default=3, help='Number of retries of a failed month')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='Number of rows per chunk')
+    parser.add_argument('--force', action='store_true', help='Clean the months that were already cleaned')
+    args = parser.parse_args()
+
+    console = Console()
+
+    def report(summary: dict):
+        status = 'failed' if 'error' in summary else 'done'
+        console.print(f"{summary['year']}-{summary['month']}: {status}")
+
+    summaries = run_backfill(month_range(args.start, args.end), workers=args.workers, chunk_size=args.chunk_size,
+                             retries=args.retries, force=args.force, callback=report)
+
+    # Print the per-month timing summary
+    table = Table(title='Backfill summary')
+    for column in ['Month', 'Status', 'Attempts', 'Rows in', 'Rows out', 'Seconds']:
+        table.add_column(column, justify='right')
+
+    for summary in summaries:
+        if 'error' in summary:
+            status = f"[red]failed[/red] {summary['error']}"
+        elif summary.get('skipped'):
+            status = 'skipped'
+        elif summary.get('empty'):
+            status = '[yellow]empty[/yellow]'
+        else:
+            status = '[green]done[/green]'
+
+        table.add_row(f"{summary['year']}-{summary['month']}", status, str(summary.get('attempts', '-')),
+                      f"{summary.get('rows_in', 0):,}", f"{summary.get('rows_out', 0):,}", f"{summary.get('seconds', 0):.1f}")
+
+    console.print(table)
+
+    failed = [summary for summary in summaries if 'error' in summary]
+    if failed:
+        console.print(f'{len(failed)} month(s) failed, run the same command again to retry them.')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
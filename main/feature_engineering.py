@@ -1,47 +1,136 @@
 from src.feature import feature_selection
-from src.dataset.create_dataset import write_output_data
-import pandas as pd
+from src.feature.incremental import IncrementalFeatureStore
+from src.feature.rolling import RollingFeature
+from src.feature.spatial import MonthlyZoneAggregates, ZoneFeature
+from src.dataset.query import CLEAN_TABLE, TableQuery, get_query_backend
+from src.dataset.warehouse import feature_dtypes, load_dataframe
+from src.monitoring.profiler import PROFILER
+from google.api_core.exceptions import NotFound
 from google.cloud import bigquery
+import config  # logging, the stage records go to logs/profile.jsonl
+import pandas as pd
 import os
 
+SOURCE_TABLE = CLEAN_TABLE
+FEATURE_TABLE = 'new_york_trips.features'
+
 token = os.environ['GOOGLE_APPLICATION_CREDENTIALS']
 client = bigquery.Client.from_service_account_json(token)
 
 
-def main():
+def get_partition_range(partition: str) -> tuple:
     """
-    This function reads the cleaned data from the bucket and generates the features
+    This function returns the first day of the partition (e.g. '2020-01') and the first day of the next one
     """
-    df = client.query('''
+    start = pd.Period(partition, freq='M')
+    return start.start_time.date(), (start + 1).start_time.date()
+
+
+def get_source_fingerprints(columns: list) -> dict:
+    """
+    This function returns the fingerprint of the source columns of every (year, month) partition of the cleaned data
+    """
+    fingerprints = client.query(f'''
       SELECT
-        *
-      FROM `public-data-359023.new_york_trips.trips_clean`''').to_dataframe()
+        FORMAT_DATE('%Y-%m', DATE(tpep_pickup_datetime)) AS partition_month,
+        COUNT(*) AS row_count,
+        BIT_XOR(FARM_FINGERPRINT(TO_JSON_STRING(STRUCT({', '.join(columns)})))) AS fingerprint
+      FROM `{SOURCE_TABLE}`
+      GROUP BY partition_month''').to_dataframe()
 
-    # Generate the feature
-    trip_features = feature_selection.TripFeature().generate_feature(df)
+    return {row.partition_month: f'{row.row_count}:{row.fingerprint}' for row in fingerprints.itertuples()}
 
-    time_features = feature_selection.TimeFeature().generate_feature(df)
 
-    meter_features = feature_selection.MeterFeature().generate_feature(df)
+def load_partition(partition: str, columns: list) -> pd.DataFrame:
+    """
+    This function reads the source columns of one partition of the cleaned data
+    """
+    start, end = get_partition_range(partition)
+
+    # Only the columns and the partitions of the month are scanned
+    return get_query_backend().read(TableQuery(SOURCE_TABLE, columns, start, end))
+
+
+def load_range(start: pd.Timestamp, end: pd.Timestamp, columns: list) -> pd.DataFrame:
+    """
+    This function reads the source columns of the trips of the cleaned data picked up in [start, end)
+    """
+    return get_query_backend().read(TableQuery(SOURCE_TABLE, columns, start, end))
 
-    tip_features = feature_selection.TipFeature().generate_feature(df)
 
-    df = pd.concat([trip_features, time_features, meter_features, tip_features, df['tpep_pickup_datetime'].to_frame(),
-                    df['tpep_dropoff_datetime'].to_frame()], axis=1)
+def replace_partition(df: pd.DataFrame, partition: str, dtypes: dict):
+    """
+    This function replaces the rows of one partition in the feature table, with the schema of the declared dtypes
+    """
+    start, end = get_partition_range(partition)
 
-    # Write to bigquery table
-    job_config = bigquery.LoadJobConfig(schema=[
-        bigquery.SchemaField("my_string", "STRING"),
+    job_config = bigquery.QueryJobConfig(query_parameters=[
+        bigquery.ScalarQueryParameter('start', 'DATE', start),
+        bigquery.ScalarQueryParameter('end', 'DATE', end),
     ])
 
-    job = client.load_table_from_dataframe(
-        df, 'new_york_trips.features', job_config=job_config
-    )
+    try:
+        client.query(f'''
+          DELETE FROM `{FEATURE_TABLE}`
+          WHERE DATE(tpep_pickup_datetime) >= @start AND DATE(tpep_pickup_datetime) < @end''', job_config=job_config).result()
+    except NotFound:
+        pass
+
+    load_dataframe(client, df, FEATURE_TABLE, dtypes)
+
+
+def main():
+    """
+    This function generates the features of the partitions of the cleaned data that changed since the last run
+
+    A partition is computed again when its source columns, the code of one of the features or the zone aggregates of
+    the previous months changed, so adding one month of data only computes that month.
+    """
+    # The zone features of a month are encoded with the aggregates of the months before it
+    zones = MonthlyZoneAggregates()
+    rolling_columns = RollingFeature().column_name
+
+    features = [
+        feature_selection.TripFeature(),
+        feature_selection.TimeFeature(),
+        feature_selection.MeterFeature(),
+        feature_selection.TipFeature(),
+        ZoneFeature(zones),
+        # The windows of the first trips of a month see the last trips of the previous month
+        RollingFeature(lookback=lambda start, end: load_range(start, end, rolling_columns))
+    ]
+    passthrough = ['tpep_pickup_datetime', 'tpep_dropoff_datetime']
+    store = IncrementalFeatureStore(features, passthrough=passthrough)
+
+    # The schema of the feature table follows the feature_dtype() of every feature
+    dtypes = feature_dtypes(features, passthrough)
+
+    fingerprints = get_source_fingerprints(store.source_columns)
+
+    # Aggregate the months that changed first, a change also computes the zone features of the following months again
+    aggregated = zones.refresh(fingerprints, load_partition)
+    print(f'{len(aggregated)} of {len(fingerprints)} partitions to aggregate: {aggregated}')
+
+    partitions = store.plan(fingerprints)
+
+    print(f'{len(partitions)} of {len(fingerprints)} partitions to compute: {partitions}')
+
+    for partition in partitions:
+        # Only load the columns the features are generated from
+        df = load_partition(partition, store.source_columns)
+
+        # Generate the features of the partition, independent features run concurrently
+        df, entry = store.compute(partition, df, fingerprints[partition])
+
+        for feature_name, report in store.executor.memory_report.items():
+            print(f"{partition} {feature_name}: {report['bytes_before'] / 2 ** 20:.1f} MiB -> {report['bytes_after'] / 2 ** 20:.1f} MiB")
 
-    job.result()
+        # Write to bigquery table, the partition is only marked as computed once it is loaded
+        replace_partition(df, partition, dtypes)
+        store.commit(partition, entry)
 
-    # Or write the feature to the bucket
-    # write_output_data(df, 'features/2014-2022', version='yes')
+    # Print the time, memory and rows of every stage
+    PROFILER.report()
 
 
 if __name__ == '__main__':
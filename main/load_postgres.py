@@ -0,0 +1,70 @@
+from src.dataset.postgres import PG_DSN_ENV, load_files
+from rich.console import Console
+from rich.table import Table
+import argparse
+import glob
+import sys
+
+
+def main():
+    """
+    This function loads the raw csv files into the trips table of the Postgres database on a pool of processes
+
+    The database is given by the PG_DSN environment variable or --dsn. Files that were loaded by a previous run are
+    skipped, so an interrupted load can be resumed by running the same command again.
+
+    Args:
+        None
+    Returns:
+        None
+    """
+    parser = argparse.ArgumentParser(description='Load the raw trip csv files into Postgres in parallel.')
+    parser.add_argument('files', nargs='+', help='csv files or glob patterns (e.g. "data/20*/Yellow/yellow_tripdata_*.csv")')
+    parser.add_argument('--dsn', default=None, help=f'Connection string of the database (default: ${PG_DSN_ENV})')
+    parser.add_argument('--workers', type=int, default=None, help='Number of processes (default: number of cores)')
+    parser.add_argument('--create-schema', action='store_true', help='Create the tables of schema/create_database_schema.sql')
+    args = parser.parse_args()
+
+    console = Console()
+
+    # Patterns without any file are skipped (e.g. no green files for the years of the data directory)
+    paths = set()
+    for pattern in args.files:
+        matches = glob.glob(pattern)
+        if not matches:
+            console.print(f'[yellow]warning[/yellow] no file matches {pattern}, skipped')
+        paths.update(matches)
+    paths = sorted(paths)
+
+    def report(summary: dict):
+        status = 'failed' if 'error' in summary else 'done'
+        console.print(f"{summary['path']}: {status}")
+
+    summaries = load_files(paths, dsn=args.dsn, workers=args.workers, create=args.create_schema, callback=report)
+
+    # Print the per-file summary
+    table = Table(title='Load summary')
+    for column in ['File', 'Status', 'Rows', 'Blank lines', 'Fixed integers', 'Seconds']:
+        table.add_column(column, justify='right')
+
+    for summary in summaries:
+        if 'error' in summary:
+            status = f"[red]failed[/red] {summary['error']}"
+        elif summary.get('skipped'):
+            status = 'skipped'
+        else:
+            status = '[green]done[/green]'
+
+        table.add_row(summary['path'], status, f"{summary.get('rows') or 0:,}", f"{summary.get('blank_lines', 0):,}",
+                      f"{summary.get('fixed_integers', 0):,}", f"{summary.get('seconds') or 0:.1f}")
+
+    console.print(table)
+
+    failed = [summary for summary in summaries if 'error' in summary]
+    if failed:
+        console.print(f'{len(failed)} file(s) failed, run the same command again to retry them.')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,13 @@
 from src.dataset.create_dataset import write_output_data
-from src.feature.preprocessing import remove_rows_with_missing_values, remove_fare_amount_with_zero_values, \
-    remove_trip_distance_with_zero_values, remove_out_of_range_data
+from src.dataset.query import TRIPS_TABLE, TableQuery, get_query_backend
+from src.dataset.warehouse import load_dataframe, trip_dtypes
+from src.feature.encoding import encode_categories
+from src.feature.preprocessing import get_cleaning_pipeline
+from src.monitoring.profiler import PROFILER
 from google.cloud import bigquery
+import config  # logging, the stage records go to logs/profile.jsonl
 import os
+import pandas as pd
 
 YEAR = '2014'
 MONTH = '01'
@@ -19,34 +24,25 @@ def main():
     Returns:
         None
     """
-    # Read the table from the bigquery
-    df = client.query('''
-      SELECT
-        *
-      FROM `public-data-359023.new_york_trips.trips`''').to_dataframe()
+    # Read the month from the bigquery table, starting one day earlier for the trips dropped off in the month
+    df = get_query_backend().read(TableQuery(TRIPS_TABLE).month(YEAR, MONTH, lookback=pd.Timedelta(days=1)))
 
-    # Remove rows with missing values in the data
-    df = remove_rows_with_missing_values(df)
+    # Map the categorical columns to the category dictionary, persisting the categories the month adds to it
+    df = encode_categories(df, save=True)
 
-    # Remove rows with zero values in the fare_amount column
-    df = remove_fare_amount_with_zero_values(df)
+    # Remove rows with missing values, zero fare_amount or trip_distance and values out of date range in one pass
+    df, report = get_cleaning_pipeline(YEAR, MONTH).apply(df)
 
-    # Remove rows with zero values in the trip_distance column
-    df = remove_trip_distance_with_zero_values(df)
+    print(f"Kept {report['rows_out']} of {report['rows_in']} rows")
+    for rule, rejected in report['rejected'].items():
+        print(f'Rejected by {rule}: {rejected}')
 
-    # Remove rows with values out of date range (workdays only)
-    df = remove_out_of_range_data(df, YEAR, MONTH)
+    # Write to bigquery table with the schema of the trip columns, in concurrent Parquet load jobs
+    rows = load_dataframe(client, df, 'new_york_trips.trips_clean', trip_dtypes(list(df.columns)))
+    print(f'Loaded {rows} rows')
 
-    # Write to bigquery table
-    job_config = bigquery.LoadJobConfig(schema=[
-        bigquery.SchemaField("my_string", "STRING"),
-    ])
-
-    job = client.load_table_from_dataframe(
-        df, 'new_york_trips.trips_clean', job_config=job_config
-    )
-
-    job.result()
+    # Print the time, memory and rows of every stage
+    PROFILER.report()
 
     # Or write the cleaned data to the bucket
     # write_output_data(df, 'clean/2014-2022', version='yes')
@@ -0,0 +1,38 @@
+from src.model.registry import get_registry
+from src.serving.scorer import TripScorer, serving_features
+from src.serving.server import ScoringServer
+import argparse
+import asyncio
+
+def main():
+    """
+    This function serves the big tip probability of live trips over HTTP
+
+    Concurrent requests are scored together, a batch is scored when it holds --max-batch-size records or
+    --max-wait-ms after its first request.
+
+    Args:
+        None
+    Returns:
+        None
+    """
+    parser = argparse.ArgumentParser(description='Serve the big tip classifier over HTTP.')
+    parser.add_argument('--version', default=None, help='Version of the model saved by train_model.py (default: latest)')
+    parser.add_argument('--host', default='127.0.0.1', help='Address to listen on')
+    parser.add_argument('--port', type=int, default=8080, help='Port to listen on')
+    parser.add_argument('--max-batch-size', type=int, default=64, help='Maximum number of records scored together')
+    parser.add_argument('--max-wait-ms', type=float, default=2.0, help='Maximum time a request waits for other requests')
+    args = parser.parse_args()
+
+    model = get_registry().load(args.version)
+    print(f'Serving model {model.version}')
+
+    # The features the model was trained on, applied to the raw trip records
+    scorer = TripScorer(model, serving_features(model.features))
+
+    server = ScoringServer(scorer, args.host, args.port, args.max_batch_size, args.max_wait_ms / 1000)
+    asyncio.run(server.serve_forever())
+
+
+if __name__ == '__main__':
+    main()
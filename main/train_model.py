@@ -1,5 +1,14 @@
+from src.dataset.query import FEATURE_TABLE, TableQuery, get_query_backend
 from src.model import classifiers
+from src.model.feature_cache import FeatureMatrixCache
+from src.model.inference import CHUNK_SIZE
+from src.model.metrics import split_chunks
+from src.model.registry import data_fingerprint, get_registry
+from src.monitoring.profiler import PROFILER
+from src.serving.scorer import serving_features
 from google.cloud import bigquery
+import config  # logging, the stage records go to logs/profile.jsonl
+import argparse
 import os
 from sklearn.model_selection import train_test_split
 
@@ -7,22 +16,38 @@ token = os.environ['GOOGLE_APPLICATION_CREDENTIALS']
 client = bigquery.Client.from_service_account_json(token)
 
 
-def main():
-    # e.g. load final train dataframes from cloud
-    df = client.query('''
-          SELECT
-            *
-          FROM `public-data-359023.new_york_trips.features`''').to_dataframe()
+def choose_features(table: bigquery.Table, label: str) -> list:
+    """
+    This function returns the columns of the feature table the model is trained on: the columns the scoring server
+    generates from a single trip record. The rolling window columns depend on the trips before a record and are left out.
+    """
+    served = {column for feature in serving_features() for column in feature.feature_dtype()}
+    return [field.name for field in table.schema if field.name in served and field.name != label]
+
+
+def train_in_memory(use_cache: bool = True):
+    # The last modification time of the table identifies the version of the features
+    table = client.get_table(FEATURE_TABLE)
 
     # Choose the features and the label
     label = 'big_tip'
-    features = list(df.columns.drop([label, 'tpep_pickup_datetime', 'tpep_dropoff_datetime']))
+    features = choose_features(table, label)
 
     # Initialize the model
     model = classifiers.GaussianNBModel(features=features, label=label)
 
-    # get labels and features
-    X, Y = model.preprocess(df)
+    def build():
+        # e.g. load final train dataframes from cloud, only the columns of the model are read
+        df = get_query_backend().read(TableQuery.for_model(FEATURE_TABLE, model))
+
+        # get labels and features
+        return model.preprocess(df)
+
+    # get labels and features, from the local cache when the table did not change since they were built
+    if use_cache:
+        X, Y = FeatureMatrixCache().get_or_build(table.modified.isoformat(), features, label, build)
+    else:
+        X, Y = build()
 
     # Split the data into train and test
     x_train, x_test, y_train, y_test = train_test_split(X, Y, test_size=0.2, random_state=42)
@@ -30,8 +55,65 @@ def main():
     # Fit the model
     model.fit(x_train, y_train)
 
+    # Evaluate the model in one pass over the test set
+    metrics = model.evaluate_stream(split_chunks(x_test, y_test, CHUNK_SIZE))
+    print(metrics.report())
+
     # Plot the confusion matrix (normalized
-    model.plot_confusion_matrix(x_test, y_test, normalize='true')
+    model.plot_confusion_matrix(normalize='true', metrics=metrics)
+
+    # Save a new version of the model along with its evaluation and the fingerprint of its training data
+    dtypes = {field.name: field.field_type for field in table.schema if field.name in features}
+    return get_registry().save(model, metrics=metrics.report(),
+                               fingerprint=data_fingerprint(X, Y), dtypes=dtypes)
+
+
+def train_streaming(batch_size: int, holdout_size: int):
+    # The last modification time of the table identifies the version of the features
+    table = client.get_table(FEATURE_TABLE)
+
+    # Choose the features and the label
+    label = 'big_tip'
+    features = choose_features(table, label)
+
+    # Initialize the model
+    model = classifiers.GaussianNBModel(features=features, label=label)
+
+    # Stream the columns of the model in batches instead of loading the table at once
+    batches = get_query_backend().read_batches(TableQuery.for_model(FEATURE_TABLE, model), batch_size=batch_size)
+
+    # Fit the model batch by batch, holding out a uniform sample of the rows for evaluation
+    summary = model.fit_stream(batches, classes=[False, True], holdout_size=holdout_size, random_state=42)
+    print(f"Trained on {summary['trained_rows']} rows, F1 score on {summary['holdout_rows']} held out rows: {summary['holdout_score']}")
+
+    # Plot the confusion matrix of the held out rows (normalized)
+    x_test, y_test = model.holdout
+    metrics = model.evaluate_stream(split_chunks(x_test, y_test, CHUNK_SIZE))
+    model.plot_confusion_matrix(normalize='true', metrics=metrics)
+
+    # Save a new version of the model, the stream is identified by the version of the table
+    dtypes = {field.name: field.field_type for field in table.schema if field.name in features}
+    return get_registry().save(model, metrics={**metrics.report(), 'trained_rows': summary['trained_rows']},
+                               fingerprint=f'{FEATURE_TABLE}@{table.modified.isoformat()}', dtypes=dtypes)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Train the big tip classifier.')
+    parser.add_argument('--stream', action='store_true', help='Train batch by batch with bounded memory')
+    parser.add_argument('--batch-size', type=int, default=1_000_000, help='Number of rows per batch when streaming')
+    parser.add_argument('--holdout-size', type=int, default=1_000_000, help='Number of held out rows when streaming')
+    parser.add_argument('--no-cache', action='store_true', help='Rebuild the feature matrix instead of using the local cache')
+    args = parser.parse_args()
+
+    if args.stream:
+        version = train_streaming(args.batch_size, args.holdout_size)
+    else:
+        version = train_in_memory(use_cache=not args.no_cache)
+
+    print(f'Saved model {version}')
+
+    # Print the time, memory and rows of every stage
+    PROFILER.report()
 
 
 if __name__ == '__main__':
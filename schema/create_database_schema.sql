@@ -1,76 +1,23 @@
-CREATE EXTENSION postgis;
-
-CREATE TABLE green_tripdata_staging (
-  vendor_id text,
-  pickup_datetime text,
-  dropoff_datetime text,
-  store_and_fwd_flag text,
-  rate_code text,
-  pickup_location numeric,
-  dropoff_location numeric,
-  passenger_count text,
-  trip_distance text,
-  fare_amount text,
-  extra text,
-  mta_tax text,
-  tip_amount text,
-  tolls_amount text,
-  ehail_fee text,
-  improvement_surcharge text,
-  total_amount text,
-  payment_type text,
-  trip_type text,
-  congestion_surcharge text
-)
-WITH (
-  autovacuum_enabled = false,
-  toast.autovacuum_enabled = false
+CREATE TABLE IF NOT EXISTS cab_types (
+  id integer primary key,
+  type text unique not null
 );
 
+INSERT INTO cab_types (id, type) VALUES (1, 'yellow'), (2, 'green') ON CONFLICT DO NOTHING;
 
-CREATE TABLE yellow_tripdata_staging (
-  vendor_id text,
-  pickup_datetime text,
-  dropoff_datetime text,
-  passenger_count text,
-  trip_distance text,
-  rate_code text,
-  store_and_fwd_flag text,
-  pickup_location numeric,
-  dropoff_location numeric,
-  payment_type text,
-  fare_amount text,
-  extra text,
-  mta_tax text,
-  tip_amount text,
-  tolls_amount text,
-  improvement_surcharge text,
-  total_amount text,
-  congestion_surcharge text,
-  airport_fee text
-)
-WITH (
-  autovacuum_enabled = false,
-  toast.autovacuum_enabled = false
-);
-
-CREATE TABLE cab_types (
-  id serial primary key,
-  type text
-);
-
-INSERT INTO cab_types (type) VALUES ('yellow'), ('green');
-
-CREATE TABLE trips (
-  id bigserial primary key,
+-- The yellow and the green trips, told apart by cab_type_id. ehail_fee and trip_type only exist in the green files.
+-- Trips are partitioned by month on the pickup time, the loader creates the partition of every loaded month.
+-- Trips outside of every month partition (e.g. wrong dates in the files) go to trips_default.
+CREATE TABLE IF NOT EXISTS trips (
+  id bigserial,
   cab_type_id integer,
   vendor_id text,
-  pickup_datetime timestamp without time zone,
+  pickup_datetime timestamp without time zone not null,
   dropoff_datetime timestamp without time zone,
   store_and_fwd_flag text,
   rate_code integer,
-  pickup_location numeric,
-  dropoff_location numeric,
+  pickup_location integer,
+  dropoff_location integer,
   passenger_count integer,
   trip_distance numeric,
   fare_amount numeric,
@@ -84,5 +31,17 @@ CREATE TABLE trips (
   total_amount numeric,
   payment_type text,
   trip_type integer,
-  airport_fee numeric
+  airport_fee numeric,
+  primary key (id, pickup_datetime)
+) PARTITION BY RANGE (pickup_datetime);
+
+CREATE TABLE IF NOT EXISTS trips_default PARTITION OF trips DEFAULT;
+
+-- One row per loaded csv file, written in the transaction of its COPY, so a file is loaded exactly once.
+CREATE TABLE IF NOT EXISTS trip_files (
+  filename text primary key,
+  cab_type_id integer,
+  rows bigint,
+  seconds double precision,
+  loaded_at timestamp without time zone default now()
 );
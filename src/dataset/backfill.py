@@ -0,0 +1,223 @@
+"""
+Backfill.py
+Contains the functions to clean many months of raw trip data in parallel.
+"""
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Callable, List, Tuple
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from src.dataset.catalog import DATA_DIR
+from src.dataset.columnar import COMPRESSION
+from src.dataset.create_dataset import CHUNK_SIZE, read_data_chunks
+from src.dataset.storage import Storage, get_storage
+from src.dataset.warehouse import TRIP_DTYPES, arrow_type
+from src.feature.encoding import CATEGORICAL_COLUMNS, save_dictionary
+from src.feature.preprocessing import get_cleaning_pipeline
+
+STAGE = 'clean/monthly'
+
+
+def month_range(start: str, end: str) -> List[Tuple[str, str]]:
+    """
+    Returns the (year, month) pairs between two months, both included.
+
+    Args:
+        start: The first month (e.g. '2014-01').
+        end: The last month (e.g. '2022-12').
+
+    Returns:
+        The list of (year, month) pairs.
+    """
+
+    months = pd.period_range(start, end, freq='M')
+
+    return [(f'{month.year:04d}', f'{month.month:02d}') for month in months]
+
+
+def get_month_path(year: str, month: str) -> str:
+    """
+    Returns the path of the cleaned data of a month.
+    """
+    return f'{DATA_DIR}/{STAGE}/{year}-{month}.parquet'
+
+
+def get_marker_path(year: str, month: str) -> str:
+    """
+    Returns the path of the marker written once the month is completely cleaned.
+    """
+    return f'{DATA_DIR}/{STAGE}/{year}-{month}.json'
+
+
+def get_arrow_schema(columns: List[str]) -> pa.Schema:
+    """
+    Returns the declared Arrow schema of the cleaned trip columns: the Arrow type of their dtype in TRIP_DTYPES, and
+    int32 dictionary indices for the categorical columns. The schema does not depend on the values of a chunk, so every
+    chunk of a month has it (e.g. a column that is null in the first chunk, or a category added by a later chunk).
+
+    Args:
+        columns: The columns of the cleaned trips.
+
+    Returns:
+        The schema of the Parquet file of a month.
+    """
+
+    fields = []
+    for column in columns:
+        if column in CATEGORICAL_COLUMNS:
+            kind, _ = CATEGORICAL_COLUMNS[column]
+            fields.append((column, pa.dictionary(pa.int32(), pa.string() if kind == 'str' else pa.int64())))
+        else:
+            fields.append((column, arrow_type(TRIP_DTYPES[column])))
+
+    return pa.schema(fields)
+
+
+def clean_month(year: str, month: str, chunk_size: int = CHUNK_SIZE, storage: Storage = None) -> dict:
+    """
+    Reads, cleans and writes one month. The chunks are streamed into a Parquet file, one row group per chunk,
+    so a worker only holds one chunk in memory.
+
+    Args:
+        year: The year to clean.
+        month: The month to clean.
+        chunk_size: The number of rows per chunk.
+        storage: The storage backend, defaults to get_storage().
+
+    Returns:
+        The summary of the month (rows read and written, rows rejected by each cleaning rule, seconds), empty and
+        without path if the month had no data.
+    """
+
+    storage = storage or get_storage()
+    path = get_month_path(year, month)
+
+    # a marker left by a previous run would make a failure of this run look complete
+    storage.delete(get_marker_path(year, month))
+
+    start = time.perf_counter()
+    rows_in, rows_out = 0, 0
+    rejected = {}
+
+    pipeline = get_cleaning_pipeline(year, month)
+
+    with storage.open(path, 'wb') as file:
+        writer = None
+        try:
+            for chunk in read_data_chunks(year, month, chunk_size, storage):
+                chunk, report = pipeline.apply(chunk)
+                rows_in += report['rows_in']
+                rows_out += report['rows_out']
+                for rule, count in report['rejected'].items():
+                    rejected[rule] = rejected.get(rule, 0) + count
+
+                if writer is None:
+                    schema = get_arrow_schema(list(chunk.columns))
+                    writer = pq.ParquetWriter(file, schema, compression=COMPRESSION)
+                writer.write_table(pa.Table.from_pandas(chunk[schema.names], schema=schema, preserve_index=False))
+        finally:
+            if writer is not None:
+                writer.close()
+
+    summary = {
+        'year'    : year,
+        'month'   : month,
+        'path'    : path,
+        'rows_in' : rows_in,
+        'rows_out': rows_out,
+        'rejected': rejected,
+        'seconds' : round(time.perf_counter() - start, 3)
+    }
+
+    # without any chunk there is no schema to write a valid Parquet file with: the empty file is removed and the month
+    # has no marker, so it is cleaned again by the next run (e.g. a month that is not published yet)
+    if writer is None:
+        storage.delete(path)
+        summary.update(path=None, empty=True)
+        return summary
+
+    # the categories the month added to the dictionary are persisted with the cleaned data, before the marker
+    save_dictionary(storage)
+
+    # the marker is written last, so a month without marker is incomplete and cleaned again on resume
+    storage.write_bytes(get_marker_path(year, month), json.dumps(summary).encode('utf-8'), content_type='application/json')
+
+    return summary
+
+
+def clean_month_with_retries(year: str, month: str, chunk_size: int = CHUNK_SIZE, retries: int = 3,
+                             backoff: float = 5.0, storage: Storage = None) -> dict:
+    """
+    Cleans one month, retrying with an exponential backoff if it fails.
+
+    Returns:
+        The summary of the month, with the number of attempts and the error if every attempt failed.
+    """
+
+    error = None
+
+    for attempt in range(1, retries + 2):
+        try:
+            summary = clean_month(year, month, chunk_size, storage)
+            summary['attempts'] = attempt
+            return summary
+        except Exception as exception:
+            error = f'{type(exception).__name__}: {exception}'
+            if attempt <= retries:
+                time.sleep(backoff * 2 ** (attempt - 1))
+
+    return {'year': year, 'month': month, 'attempts': retries + 1, 'error': error}
+
+
+def run_backfill(months: List[Tuple[str, str]], workers: int = None, chunk_size: int = CHUNK_SIZE, retries: int = 3,
+                 force: bool = False, storage: Storage = None, callback: Callable[[dict], None] = None) -> List[dict]:
+    """
+    Cleans the given months on a pool of processes.
+
+    Args:
+        months: The (year, month) pairs to clean.
+        workers: The number of processes, defaults to the number of cores.
+        chunk_size: The number of rows per chunk.
+        retries: The number of retries of a failed month.
+        force: Clean the months that were already cleaned by a previous run.
+        storage: The storage backend, defaults to get_storage().
+        callback: Called with the summary of every month as soon as it is done.
+
+    Returns:
+        The summaries of the months, in the order of the given months.
+    """
+
+    storage = storage or get_storage()
+    workers = workers or os.cpu_count()
+
+    summaries = {}
+    pending = []
+
+    for year, month in months:
+        if not force and storage.exists(get_marker_path(year, month)):
+            summary = json.loads(storage.read_bytes(get_marker_path(year, month)))
+            summary['skipped'] = True
+            summaries[(year, month)] = summary
+        else:
+            pending.append((year, month))
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(clean_month_with_retries, year, month, chunk_size, retries, storage=storage): (year, month)
+            for year, month in pending
+        }
+        for future in as_completed(futures):
+            year, month = futures[future]
+            try:
+                summary = future.result()
+            except Exception as exception:
+                # e.g. BrokenProcessPool when a worker is killed, the other months keep their summaries
+                summary = {'year': year, 'month': month, 'attempts': 0, 'error': f'{type(exception).__name__}: {exception}'}
+            summaries[futures[future]] = summary
+            if callback is not None:
+                callback(summary)
+
+    return [summaries[month] for month in months]
@@ -0,0 +1,234 @@
+"""
+Catalog.py
+Contains the version catalog of the stage outputs: one manifest per stage that records every written version.
+"""
+import json
+import threading
+import time
+from datetime import datetime
+from functools import lru_cache
+from typing import Optional
+from src.dataset.storage import Storage, PreconditionFailed
+
+# Directory of the stage outputs in the bucket
+DATA_DIR = 'data'
+CATALOG_NAME = '_catalog.json'
+
+# Seconds a catalog is served from the in-process cache before it is read again
+CATALOG_TTL = 60.0
+
+# Attempts to update a catalog that is concurrently updated by another writer
+MAX_ATTEMPTS = 10
+
+TIME_STAMP_FORMAT = '%Y%m%d-%H%M%S'
+
+# File extension of every supported stage output format
+OUTPUT_FORMATS = {'csv': '.csv', 'parquet': '.parquet'}
+
+# Path of the file of a version in its stage directory, for every format recorded in the catalogs, so a rebuilt catalog
+# has every format: the stage outputs and the model artifacts of src.model.registry, a directory per version that is
+# complete once its meta.json is written
+CATALOG_FORMATS = {
+    **{format: '{version}' + extension for format, extension in OUTPUT_FORMATS.items()},
+    'model': '{version}/meta.json'
+}
+
+
+class VersionCatalog:
+    """
+    The catalog of a stage lives at data/<stage>/_catalog.json and looks like
+
+        {
+            "stage": "clean",
+            "latest": {"csv": "20220820-101010", "parquet": "20220821-101010"},
+            "files": {"data/clean/20220820-101010.csv": {"version": "20220820-101010", "format": "csv"}, ...}
+        }
+
+    so that the latest version of a format and the existence of a file are dictionary lookups.
+    Updates are compare-and-swap on the generation of the catalog file, so concurrent writers never lose a version.
+    """
+
+    def __init__(self, storage: Storage, ttl: float = CATALOG_TTL):
+        """
+        Initialize the catalog.
+
+        Args:
+            storage (Storage): The storage backend holding the stage outputs.
+            ttl (float): Seconds a catalog is cached in-process.
+        """
+        self.storage = storage
+        self.ttl = ttl
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def catalog_path(stage: str) -> str:
+        return f'{DATA_DIR}/{stage}/{CATALOG_NAME}'
+
+    def load(self, stage: str, refresh: bool = False) -> dict:
+        """
+        Returns the catalog of the stage, from the in-process cache unless it expired.
+
+        Args:
+            stage: The stage of the catalog.
+            refresh: Ignore the cached catalog.
+
+        Returns:
+            The catalog of the stage.
+        """
+
+        with self._lock:
+            cached = self._cache.get(stage)
+            if not refresh and cached is not None and cached[0] > time.monotonic():
+                return cached[1]
+
+        data, _ = self.storage.read_versioned(self.catalog_path(stage))
+        catalog = json.loads(data) if data is not None else self.rebuild(stage)
+
+        self._set_cache(stage, catalog)
+
+        return catalog
+
+    def latest(self, stage: str, format: str) -> Optional[str]:
+        """
+        Returns the latest version of the stage written in the given format, None if there is none.
+        """
+
+        latest = self.load(stage)['latest'].get(format)
+
+        if latest is None:
+            # another process may have written the first version since the catalog was cached
+            latest = self.load(stage, refresh=True)['latest'].get(format)
+
+        return latest
+
+    def exists(self, stage: str, path: str) -> bool:
+        """
+        Check if the given file of the stage was written.
+        """
+
+        if path in self.load(stage)['files']:
+            return True
+
+        return path in self.load(stage, refresh=True)['files']
+
+    def register(self, stage: str, version: str, path: str, format: str, **metadata) -> dict:
+        """
+        Adds a written file to the catalog of the stage.
+
+        Args:
+            stage: The stage of the file.
+            version: The version of the file.
+            path: The path of the file.
+            format: The format of the file.
+            metadata: Any additional JSON serializable information to store with the file.
+
+        Returns:
+            The updated catalog.
+        """
+
+        catalog_path = self.catalog_path(stage)
+
+        for _ in range(MAX_ATTEMPTS):
+            data, generation = self.storage.read_versioned(catalog_path)
+            catalog = json.loads(data) if data is not None else self.rebuild(stage, persist=False)
+
+            catalog['files'][path] = {'version': version, 'format': format, **metadata}
+            if catalog['latest'].get(format) is None or version >= catalog['latest'][format]:
+                catalog['latest'][format] = version
+
+            try:
+                self.storage.write_if_generation(catalog_path, _to_bytes(catalog), generation, content_type='application/json')
+            except PreconditionFailed:
+                continue
+
+            self._set_cache(stage, catalog)
+            return catalog
+
+        raise RuntimeError(f'Could not update the catalog of stage {stage} after {MAX_ATTEMPTS} attempts.')
+
+    def rebuild(self, stage: str, persist: bool = True) -> dict:
+        """
+        Builds the catalog of a stage from a listing of its files. Only needed once for stages written before the catalog.
+
+        Args:
+            stage: The stage to index.
+            persist: Write the rebuilt catalog to the storage.
+
+        Returns:
+            The catalog of the stage.
+        """
+
+        catalog = {'stage': stage, 'latest': {}, 'files': {}}
+
+        prefix = f'{DATA_DIR}/{stage}/'
+
+        for path in self.storage.list_files(prefix):
+            name = path[len(prefix):]
+            for format, layout in CATALOG_FORMATS.items():
+                head, tail = layout.split('{version}')
+                if not name.startswith(head) or not name.endswith(tail):
+                    continue
+
+                version = name[len(head):len(name) - len(tail)]
+                if not is_version(version):
+                    continue
+
+                catalog['files'][path] = {'version': version, 'format': format}
+                if catalog['latest'].get(format) is None or version > catalog['latest'][format]:
+                    catalog['latest'][format] = version
+
+        if persist:
+            try:
+                self.storage.write_if_generation(self.catalog_path(stage), _to_bytes(catalog), 0, content_type='application/json')
+            except PreconditionFailed:
+                # a writer created the catalog in the meantime, which is at least as recent as the listing
+                data, _ = self.storage.read_versioned(self.catalog_path(stage))
+                catalog = json.loads(data)
+
+        return catalog
+
+    def invalidate(self, stage: str = None):
+        """
+        Drops the cached catalog of the stage, or of every stage.
+        """
+
+        with self._lock:
+            if stage is None:
+                self._cache.clear()
+            else:
+                self._cache.pop(stage, None)
+
+    def _set_cache(self, stage: str, catalog: dict):
+        with self._lock:
+            self._cache[stage] = (time.monotonic() + self.ttl, catalog)
+
+
+def is_version(version: str) -> bool:
+    """
+    Check if a name is a version: a time stamp, followed by a counter for the versions written in the same second
+    (e.g. 20220820-101010-1).
+    """
+
+    stamp, counter = version[:15], version[15:]
+    if counter and not (counter[0] == '-' and counter[1:].isdigit()):
+        return False
+
+    try:
+        datetime.strptime(stamp, TIME_STAMP_FORMAT)
+    except ValueError:
+        return False
+
+    return True
+
+
+def _to_bytes(catalog: dict) -> bytes:
+    return json.dumps(catalog, indent=2, sort_keys=True).encode('utf-8')
+
+
+@lru_cache(maxsize=None)
+def get_catalog(storage: Storage) -> VersionCatalog:
+    """
+    Returns the version catalog of the storage backend, one per backend so that the cache is shared.
+    """
+    return VersionCatalog(storage)
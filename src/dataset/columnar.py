@@ -0,0 +1,176 @@
+"""
+Columnar.py
+Contains functions for storing stage outputs as Parquet and reading them back with column projection and row group pruning.
+"""
+import json
+from datetime import datetime
+from typing import Any, List, Optional, Tuple
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+COMPRESSION = 'snappy'
+ROW_GROUP_SIZE = 1_000_000
+
+# Column whose row group min/max statistics are used to skip row groups
+PRUNE_COLUMN = 'tpep_pickup_datetime'
+
+
+def to_parquet_bytes(df: pd.DataFrame, compression: str = COMPRESSION, row_group_size: int = ROW_GROUP_SIZE,
+                     sort_by: str = None) -> Tuple[bytes, dict]:
+    """
+    Encodes the dataframe as a Parquet file.
+
+    Args:
+        df: The data to encode.
+        compression: The compression codec (e.g. 'snappy', 'zstd', 'gzip').
+        row_group_size: The maximum number of rows per row group.
+        sort_by: Optional column to sort by before writing, which keeps the row group statistics of that column disjoint.
+
+    Returns:
+        The encoded file and its manifest.
+    """
+
+    assert row_group_size > 0, 'Row group size must be a positive number of rows.'
+
+    if sort_by is not None and not df[sort_by].is_monotonic_increasing:
+        df = df.sort_values(sort_by, kind='stable')
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+
+    sink = pa.BufferOutputStream()
+    pq.write_table(table, sink, compression=compression, row_group_size=row_group_size, write_statistics=True)
+    buffer = sink.getvalue()
+
+    manifest = get_manifest(pq.ParquetFile(pa.BufferReader(buffer)), compression)
+
+    return buffer.to_pybytes(), manifest
+
+
+def get_manifest(parquet_file: pq.ParquetFile, compression: str = COMPRESSION) -> dict:
+    """
+    Builds the manifest of a Parquet file: schema, row counts and the statistics of the prune column per row group.
+
+    Args:
+        parquet_file: The Parquet file to describe.
+        compression: The compression codec used to write the file.
+
+    Returns:
+        The manifest as a JSON serializable dictionary.
+    """
+
+    metadata = parquet_file.metadata
+
+    row_groups = []
+    for index in range(metadata.num_row_groups):
+        start, end = get_row_group_range(metadata, index)
+        row_groups.append({
+            'num_rows': metadata.row_group(index).num_rows,
+            'min'     : None if start is None else pd.Timestamp(start).isoformat(),
+            'max'     : None if end is None else pd.Timestamp(end).isoformat()
+        })
+
+    return {
+        'format'      : 'parquet',
+        'compression' : compression,
+        'num_rows'    : metadata.num_rows,
+        'schema'      : {field.name: str(field.type) for field in parquet_file.schema_arrow},
+        'prune_column': PRUNE_COLUMN,
+        'row_groups'  : row_groups
+    }
+
+
+def manifest_to_bytes(manifest: dict) -> bytes:
+    """
+    Serializes the manifest.
+    """
+    return json.dumps(manifest, indent=2).encode('utf-8')
+
+
+def get_row_group_range(metadata: pq.FileMetaData, index: int, column: str = PRUNE_COLUMN) -> Tuple[Any, Any]:
+    """
+    Returns the min/max statistics of a column in a row group, (None, None) if they are not available.
+    """
+
+    row_group = metadata.row_group(index)
+
+    for position in range(row_group.num_columns):
+        chunk = row_group.column(position)
+        if chunk.path_in_schema == column and chunk.statistics is not None and chunk.statistics.has_min_max:
+            return chunk.statistics.min, chunk.statistics.max
+
+    return None, None
+
+
+def select_row_groups(metadata: pq.FileMetaData, start: Optional[datetime] = None, end: Optional[datetime] = None,
+                      column: str = PRUNE_COLUMN) -> List[int]:
+    """
+    Selects the row groups that can contain rows with start <= column < end.
+
+    Row groups without statistics are always selected.
+
+    Args:
+        metadata: The metadata of the Parquet file.
+        start: Inclusive lower bound, None for no bound.
+        end: Exclusive upper bound, None for no bound.
+        column: The column to prune on.
+
+    Returns:
+        The indices of the row groups to read.
+    """
+
+    selected = []
+
+    for index in range(metadata.num_row_groups):
+        low, high = get_row_group_range(metadata, index, column)
+
+        if low is not None and end is not None and pd.Timestamp(low) >= pd.Timestamp(end):
+            continue
+        if high is not None and start is not None and pd.Timestamp(high) < pd.Timestamp(start):
+            continue
+
+        selected.append(index)
+
+    return selected
+
+
+def read_parquet(source: Any, columns: List[str] = None, pickup_range: Tuple[Any, Any] = None) -> pd.DataFrame:
+    """
+    Reads a Parquet file, only decoding the requested columns and the row groups that overlap the pickup range.
+
+    Args:
+        source: A path or a readable file object.
+        columns: The columns to read, None for all of them (e.g. feature_selection.TipFeature().column_name).
+        pickup_range: Optional (start, end) bounds on the pickup time, start inclusive and end exclusive.
+
+    Returns:
+        The data of the file.
+    """
+
+    parquet_file = pq.ParquetFile(source)
+
+    if pickup_range is None:
+        return parquet_file.read(columns=columns).to_pandas()
+
+    start, end = pickup_range
+
+    read_columns = columns
+    if columns is not None and PRUNE_COLUMN not in columns:
+        read_columns = list(columns) + [PRUNE_COLUMN]
+
+    row_groups = select_row_groups(parquet_file.metadata, start, end)
+    df = parquet_file.read_row_groups(row_groups, columns=read_columns).to_pandas()
+
+    # the selected row groups can still contain rows outside the range
+    mask = pd.Series(True, index=df.index)
+    if start is not None:
+        mask &= df[PRUNE_COLUMN] >= pd.Timestamp(start)
+    if end is not None:
+        mask &= df[PRUNE_COLUMN] < pd.Timestamp(end)
+
+    df = df.loc[mask]
+
+    if read_columns is not columns:
+        df = df.drop(columns=PRUNE_COLUMN)
+
+    return df.reset_index(drop=True)
@@ -4,56 +4,120 @@ Contains functions for importing and exporting data.
 """
 import os
 from datetime import datetime
+from typing import Any, Iterator, List, Tuple
 import pandas as pd
-from google.cloud import storage
+from src.dataset.catalog import DATA_DIR, OUTPUT_FORMATS, get_catalog
+from src.dataset.columnar import PRUNE_COLUMN, to_parquet_bytes, manifest_to_bytes, read_parquet
+from src.dataset.storage import Storage, get_storage
+from src.feature.encoding import encode_categories, get_dictionary
+from src.monitoring.profiler import iterate, profile
+
+# Number of rows per chunk returned by read_data_chunks
+CHUNK_SIZE = 500_000
+
+# Timestamp columns of the yellow trip files (schema: pickup_datetime / dropoff_datetime timestamp)
+YELLOW_TRIP_DATE_COLUMNS = ['tpep_pickup_datetime', 'tpep_dropoff_datetime']
+
+# Column dtypes of the yellow trip files, following the `trips` table in schema/create_database_schema.sql
+# (text -> string, integer -> nullable Int32, numeric -> float64).
+YELLOW_TRIP_DTYPES = {
+    'VendorID'             : 'string',
+    'passenger_count'      : 'Int32',
+    'trip_distance'        : 'float64',
+    'RatecodeID'           : 'Int32',
+    'store_and_fwd_flag'   : 'string',
+    'PULocationID'         : 'Int32',
+    'DOLocationID'         : 'Int32',
+    'payment_type'         : 'string',
+    'fare_amount'          : 'float64',
+    'extra'                : 'float64',
+    'mta_tax'              : 'float64',
+    'tip_amount'           : 'float64',
+    'tolls_amount'         : 'float64',
+    'improvement_surcharge': 'float64',
+    'total_amount'         : 'float64',
+    'congestion_surcharge' : 'float64',
+    'airport_fee'          : 'float64'
+}
+
+
+@profile('dataset.read_data')
+def read_data(year: str, month: str, storage: Storage = None) -> pd.DataFrame:
+    """
+    Reads the data for a given year and month.
 
-BUCKET_NAME = 'yellow_taxi_vineet'
-token = os.environ['GOOGLE_APPLICATION_CREDENTIALS']
+    Args:
+        year: The year to read.
+        month: The month to read.
+        storage: The storage backend to read from, defaults to get_storage().
 
+    Returns:
+        The data for the given year and month.
+    """
 
-def read_data(year: str, month: str) -> pd.DataFrame:
+    storage = storage or get_storage()
+    file_path = get_raw_data_path(year, month, storage)
+
+    # the low-cardinality columns are read as categories and mapped to the persisted category dictionary
+    df = pd.read_csv(file_path, dtype=get_dictionary(storage).read_dtypes(YELLOW_TRIP_DTYPES), parse_dates=YELLOW_TRIP_DATE_COLUMNS,
+                     infer_datetime_format=True, storage_options=storage.storage_options)
+
+    return encode_categories(df, storage)
+
+
+def read_data_chunks(year: str, month: str, chunk_size: int = CHUNK_SIZE, storage: Storage = None) -> Iterator[pd.DataFrame]:
     """
-    Reads the data for a given year and month.
+    Streams the data for a given year and month in typed chunks of at most `chunk_size` rows.
+
+    Only one chunk is held in memory at a time, so the peak memory does not depend on the size of the month.
+    Every chunk has the dtypes of YELLOW_TRIP_DTYPES, the categorical columns encoded with the category dictionary,
+    and can be passed directly to the preprocessing functions.
 
     Args:
         year: The year to read.
         month: The month to read.
+        chunk_size: The maximum number of rows per chunk.
+        storage: The storage backend to read from, defaults to get_storage().
 
     Returns:
-        The data for the given year and month.
+        An iterator over the chunks of the given year and month.
     """
 
-    file_path = get_raw_data_path(year, month)
+    assert chunk_size > 0, 'Chunk size must be a positive number of rows.'
 
-    df = pd.read_csv(file_path, parse_dates=['tpep_pickup_datetime', 'tpep_dropoff_datetime'], infer_datetime_format=True, low_memory=False,
-                     storage_options={'token': token})
+    storage = storage or get_storage()
+    file_path = get_raw_data_path(year, month, storage)
 
-    return df
+    with pd.read_csv(file_path, dtype=get_dictionary(storage).read_dtypes(YELLOW_TRIP_DTYPES), parse_dates=YELLOW_TRIP_DATE_COLUMNS,
+                     infer_datetime_format=True, chunksize=chunk_size, storage_options=storage.storage_options) as reader:
+        for chunk in iterate('dataset.read_chunk', reader):
+            yield encode_categories(chunk, storage)
 
 
-def get_raw_data_path(year: str, month: str) -> str:
+def get_raw_data_path(year: str, month: str, storage: Storage = None) -> str:
     """
     Gets the file path for the given year and month.
 
     Args:
         year: The year to read.
         month: The month to read.
+        storage: The storage backend holding the raw data, defaults to get_storage().
 
     Returns:
         The file path for the given year and month.
     """
 
-    assert "2020" <= year <= "2022", 'No data for year {} available. Please select a year between 2021 and 2022.'.format(year)
+    assert "2014" <= year <= "2022", 'No data for year {} available. Please select a year between 2014 and 2022.'.format(year)
     assert isinstance(year, str), 'Year must be an string.'
     assert isinstance(month, str), 'Month must be an string.'
 
-    url = f'gs://{BUCKET_NAME}/tripdata/'
-    file_path = f'{url}yellow_tripdata_{year}-{month}.csv'
+    storage = storage or get_storage()
+    file_path = storage.uri(f'tripdata/yellow_tripdata_{year}-{month}.csv')
 
     return file_path
 
 
-def write_data(df: pd.DataFrame, suffix: str, scratch: bool = True) -> str:
+def write_data(df: pd.DataFrame, suffix: str, scratch: bool = True, storage: Storage = None) -> str:
     """
     This function writes the dataframe to a csv file in the bucket
 
@@ -61,6 +125,7 @@ def write_data(df: pd.DataFrame, suffix: str, scratch: bool = True) -> str:
         df: The data to write.
         suffix: The suffix to add to the file name.
         scratch: Write the file with the suffix
+        storage: The storage backend to write to, defaults to get_storage().
 
     Returns:
         None
@@ -75,23 +140,21 @@ def write_data(df: pd.DataFrame, suffix: str, scratch: bool = True) -> str:
 
     path = os.path.join(path, suffix).replace('\\', '/')
 
-    client = storage.Client()
-    bucket = client.get_bucket(BUCKET_NAME)
-    blob = bucket.blob(path)
-    blob.chunk_size = 262144
-
-    blob.upload_from_string(df.to_csv(index=False, encoding='utf-8'))
+    storage = storage or get_storage()
+    storage.write_bytes(path, df.to_csv(index=False, encoding='utf-8').encode('utf-8'), content_type='text/csv')
 
     return path
 
 
-def get_output_path(stage: str, version: str = None) -> str:
+def get_output_path(stage: str, version: str = None, format: str = 'csv', storage: Storage = None) -> str:
     """
     This function returns the output file path for the given stage and version.
 
     Args:
         stage: The stage to write to.
         version: The version of the stage to write to.
+        format: The format of the stage output (e.g. 'csv', 'parquet').
+        storage: The storage backend, defaults to get_storage().
 
     Returns:
         The file path for the given stage and version.
@@ -102,71 +165,115 @@ def get_output_path(stage: str, version: str = None) -> str:
     if version is not None:
         version = get_time_stamp()
     else:
-        version = get_latest_time_stamp(list_files(output_path))
+        version = get_catalog(storage or get_storage()).latest(stage, format)
+        assert version is not None, 'No {} output found for stage {}'.format(format, stage)
 
     path = os.path.join(output_path, version).replace('\\', '/')
 
     return path
 
 
-def write_output_data(df: pd.DataFrame, stage: str, version: str = None, overwrite: bool = False) -> str:
+def write_output_data(df: pd.DataFrame, stage: str, version: str = None, overwrite: bool = False, format: str = 'csv',
+                      storage: Storage = None) -> str:
     """
-    This function writes the dataframe to a csv file in the bucket
+    This function writes the dataframe to a csv or parquet file in the bucket
+
+    Parquet outputs keep their schema, are compressed in row groups and get a `<version>.manifest.json` next to them
+    with the schema, the row counts and the pickup time range of every row group.
 
     Args:
         df: The data to write.
         stage: The stage to write to (e.g. 'clean', 'preprocess').
         version: The version of the stage to write to.
         overwrite: Check if the file already exists
+        format: The format of the output (e.g. 'csv', 'parquet').
+        storage: The storage backend to write to, defaults to get_storage().
 
     Returns:
-        None
+        The path of the written file.
     """
 
     assert len(stage) > 0, 'Please provide a stage name to write to. (e.g. "clean", "preprocess")'
+    assert format in OUTPUT_FORMATS, 'Format must be one of {}'.format(list(OUTPUT_FORMATS))
 
-    output_path = f'data/{get_output_path(stage, version)}'
-    path = os.path.join(output_path + '.csv').replace('\\', '/')
+    storage = storage or get_storage()
+
+    catalog = get_catalog(storage)
+
+    output_path = f'{DATA_DIR}/{get_output_path(stage, version, format, storage)}'
+    path = os.path.join(output_path + OUTPUT_FORMATS[format]).replace('\\', '/')
 
     if overwrite is False:
-        assert path not in list_files('data'), 'File already exists'
+        assert not catalog.exists(stage, path), 'File already exists'
 
-    client = storage.Client()
-    bucket = client.get_bucket(BUCKET_NAME)
-    blob = bucket.blob(path)
-    blob.chunk_size = 262144
+    if format == 'parquet':
+        # sorted on the pickup time, the row groups cover disjoint pickup ranges and get_output_data can skip them
+        data, manifest = to_parquet_bytes(df, sort_by=PRUNE_COLUMN if PRUNE_COLUMN in df.columns else None)
+        storage.write_bytes(path, data)
+        storage.write_bytes(output_path + '.manifest.json', manifest_to_bytes(manifest), content_type='application/json')
+    else:
+        storage.write_bytes(path, df.to_csv(index=False, encoding='utf-8').encode('utf-8'), content_type='text/csv')
 
-    blob.upload_from_string(df.to_csv(index=False, encoding='utf-8'))
+    catalog.register(stage, output_path.split('/')[-1], path, format, num_rows=len(df))
 
     return path
 
 
-def get_output_data(stage: str, version: str = None) -> pd.DataFrame:
+def get_output_data(stage: str, version: str = None, format: str = 'csv', columns: List[str] = None,
+                    pickup_range: Tuple[Any, Any] = None, storage: Storage = None) -> pd.DataFrame:
     """
     This function returns the dataframe for the given stage and version.
 
+    Parquet outputs only decode the requested columns and skip the row groups whose pickup time statistics
+    fall outside of the pickup range.
+
     Args:
         stage: The stage to read from.
         version: The version of the stage to read from.
+        format: The format of the output (e.g. 'csv', 'parquet').
+        columns: The columns to read, None for all of them (e.g. feature_selection.TipFeature().column_name).
+        pickup_range: Optional (start, end) bounds on the pickup time, start inclusive and end exclusive.
+        storage: The storage backend to read from, defaults to get_storage().
 
     Returns:
         The dataframe for the given stage and version.
     """
 
     assert len(stage) > 0, 'Please provide a stage name to read from. (e.g. "clean", "preprocess")'
+    assert format in OUTPUT_FORMATS, 'Format must be one of {}'.format(list(OUTPUT_FORMATS))
+
+    storage = storage or get_storage()
 
     if version is None:
-        version = get_latest_time_stamp(list_files(stage))
+        version = get_catalog(storage).latest(stage, format)
+        assert version is not None, 'No {} output found for stage {}'.format(format, stage)
 
-    output_path = f'gs://{BUCKET_NAME}/{stage}/{version}'
-    path = os.path.join(output_path + '.csv').replace('\\', '/')
+    output_path = f'{DATA_DIR}/{stage}/{version}'
+    path = os.path.join(output_path + OUTPUT_FORMATS[format]).replace('\\', '/')
 
     print(f'Current version: {version}')
 
-    df = pd.read_csv(path, parse_dates=['tpep_pickup_datetime', 'tpep_dropoff_datetime'], infer_datetime_format=True, low_memory=False,
-                     storage_options={'token': token})
+    if format == 'parquet':
+        with storage.open(path, 'rb') as file:
+            return read_parquet(file, columns=columns, pickup_range=pickup_range)
+
+    read_columns = columns
+    if columns is not None and pickup_range is not None and 'tpep_pickup_datetime' not in columns:
+        read_columns = list(columns) + ['tpep_pickup_datetime']
+
+    parse_dates = [column for column in YELLOW_TRIP_DATE_COLUMNS if read_columns is None or column in read_columns]
+
+    df = pd.read_csv(storage.uri(path), usecols=read_columns, parse_dates=parse_dates, infer_datetime_format=True, low_memory=False,
+                     storage_options=storage.storage_options)
 
-    return df
+    if pickup_range is not None:
+        start, end = pickup_range
+        if start is not None:
+            df = df[df['tpep_pickup_datetime'] >= pd.Timestamp(start)]
+        if end is not None:
+            df = df[df['tpep_pickup_datetime'] < pd.Timestamp(end)]
+
+    return df[columns] if read_columns is not columns else df
 
 
 def get_time_stamp() -> str:
@@ -182,10 +289,14 @@ def get_time_stamp() -> str:
     return time_stamp
 
 
-def get_latest_time_stamp(files: list) -> datetime:
+def get_latest_time_stamp(files: list, extension: str = '.csv') -> datetime:
     """
     This function returns the time stamp for the latest file.
 
+    Args:
+        files: The files to search.
+        extension: Only consider files with this extension (e.g. '.csv', '.parquet').
+
     Returns:
         The time stamp for the latest file.
     """
@@ -194,7 +305,7 @@ def get_latest_time_stamp(files: list) -> datetime:
     timestamps = []
 
     for file in files:
-        if file.endswith('.csv'):
+        if file.endswith(extension):
             suffix = file.split('/')[-1].split('.')[0]
             datetime.strptime(suffix, format)
             timestamps.append(suffix)
@@ -202,19 +313,18 @@ def get_latest_time_stamp(files: list) -> datetime:
     return max(timestamps)
 
 
-def list_files(dictionary: str) -> list:
+def list_files(dictionary: str, storage: Storage = None) -> list:
     """
     This function returns a list of files in the given path.
 
     Args:
         dictionary: The dictionary to search
+        storage: The storage backend to search, defaults to get_storage().
 
     Returns:
         The list of files in the given dictionary.
     """
 
-    client = storage.Client()
-    bucket = client.get_bucket(BUCKET_NAME)
-    blobs = bucket.list_blobs(prefix=dictionary)
+    storage = storage or get_storage()
 
-    return [blob.name for blob in blobs]
+    return storage.list_files(dictionary)
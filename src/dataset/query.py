@@ -0,0 +1,330 @@
+"""
+Query.py
+Contains the query builder that reads only the columns and the date range a stage needs, and the backends running it:
+BigQuery through the Storage Read API, or DuckDB over local Parquet files.
+"""
+import os
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from functools import lru_cache
+from typing import Iterator, List, Tuple
+import pandas as pd
+import pyarrow as pa
+import pyarrow.ipc
+from src.dataset.storage import Storage
+from src.feature.encoding import CATEGORICAL_COLUMNS, encode_categories
+from src.monitoring.profiler import profile
+
+PROJECT = 'public-data-359023'
+TRIPS_TABLE = f'{PROJECT}.new_york_trips.trips'
+CLEAN_TABLE = f'{PROJECT}.new_york_trips.trips_clean'
+FEATURE_TABLE = f'{PROJECT}.new_york_trips.features'
+
+# The tables are partitioned on the pickup time, range predicates on it only scan the matching partitions
+PARTITION_COLUMN = 'tpep_pickup_datetime'
+
+# Environment variables used by get_query_backend to pick the backend
+QUERY_BACKEND_ENV = 'PIPELINE_QUERY'
+QUERY_ROOT_ENV = 'PIPELINE_QUERY_ROOT'
+
+
+class TableQuery:
+    """
+    A projection of a table on a range of its partition column,
+
+        SELECT <columns> FROM <table> WHERE <partition_column> >= <start> AND <partition_column> < <end>
+
+    Build it from the consumer of the rows, so only what the consumer reads is scanned:
+
+        TableQuery.for_features(CLEAN_TABLE, features).month('2020', '01')
+        TableQuery.for_model(FEATURE_TABLE, model)
+    """
+
+    def __init__(self, table: str, columns: List[str] = None, start: datetime = None, end: datetime = None,
+                 partition_column: str = PARTITION_COLUMN):
+        """
+        Initialize the query.
+
+        Args:
+            table (str): The fully qualified table (project.dataset.table).
+            columns (List[str]): The columns to read, every column if None.
+            start (datetime): The first time of the range (inclusive), unbounded if None.
+            end (datetime): The end of the range (exclusive), unbounded if None.
+            partition_column (str): The column the range applies to.
+        """
+        assert columns is None or len(columns) > 0, 'Please select at least one column.'
+        self.table = table
+        self.columns = None if columns is None else list(dict.fromkeys(columns))
+        self.start = None if start is None else pd.Timestamp(start).to_pydatetime()
+        self.end = None if end is None else pd.Timestamp(end).to_pydatetime()
+        self.partition_column = partition_column
+
+    @classmethod
+    def for_features(cls, table: str, features: list, passthrough: List[str] = None, start: datetime = None,
+                     end: datetime = None) -> 'TableQuery':
+        """
+        The source columns of the given FeatureEngineer, plus the passthrough columns.
+        """
+        columns = []
+        produced = {column for feature in features for column in feature.feature_dtype()}
+        for column in [column for feature in features for column in feature.column_name] + (passthrough or []):
+            if column not in produced:
+                columns.append(column)
+        return cls(table, columns, start, end)
+
+    @classmethod
+    def for_model(cls, table: str, model, start: datetime = None, end: datetime = None) -> 'TableQuery':
+        """
+        The features and the label of the given model.
+        """
+        return cls(table, list(model.features) + [model.label], start, end)
+
+    def between(self, start: datetime, end: datetime) -> 'TableQuery':
+        """
+        The same query on the range [start, end).
+        """
+        return TableQuery(self.table, self.columns, start, end, self.partition_column)
+
+    def month(self, year: str, month: str, lookback: pd.Timedelta = None) -> 'TableQuery':
+        """
+        The same query on one month, optionally starting `lookback` earlier (e.g. trips picked up the previous day
+        and dropped off in the month).
+        """
+        start = pd.Timestamp(f'{year}-{month}-01')
+        end = start + pd.offsets.MonthBegin(1)
+        return self.between(start - lookback if lookback is not None else start, end)
+
+    @property
+    def table_name(self) -> str:
+        return self.table.split('.')[-1]
+
+    def predicates(self) -> List[Tuple[str, str, datetime]]:
+        """
+        The range predicates as (column, operator, value).
+        """
+        predicates = []
+        if self.start is not None:
+            predicates.append((self.partition_column, '>=', self.start))
+        if self.end is not None:
+            predicates.append((self.partition_column, '<', self.end))
+        return predicates
+
+    def row_restriction(self) -> str:
+        """
+        The range as a BigQuery row restriction (a WHERE clause without parameters).
+        """
+        return ' AND '.join(f"{column} {operator} '{value.isoformat(sep=' ')}'" for column, operator, value in self.predicates())
+
+    def to_sql(self, source: str = None, placeholder: str = '?') -> Tuple[str, list]:
+        """
+        Returns the SQL of the query and the values of its placeholders.
+
+        Args:
+            source (str): The FROM clause, defaults to the quoted table.
+            placeholder (str): The placeholder of the values.
+        """
+        columns = '*' if self.columns is None else ', '.join(self.columns)
+        sql = f'SELECT {columns} FROM {source or f"`{self.table}`"}'
+
+        predicates = self.predicates()
+        if predicates:
+            sql += ' WHERE ' + ' AND '.join(f'{column} {operator} {placeholder}' for column, operator, _ in predicates)
+
+        return sql, [value for _, _, value in predicates]
+
+    def __repr__(self):
+        return f'TableQuery({self.to_sql()[0]!r}, {self.to_sql()[1]!r})'
+
+
+class QueryBackend(ABC):
+    """
+    Abstract class of the engines running a TableQuery.
+    """
+
+    # The storage of the category dictionary the categorical columns are mapped to, None keeps the columns as read
+    storage: Storage = None
+
+    @abstractmethod
+    def read_arrow(self, query: TableQuery) -> pa.Table:
+        """
+        Returns the rows of the query as an Arrow table.
+        """
+        pass
+
+    @abstractmethod
+    def read_batches(self, query: TableQuery, batch_size: int = 1_000_000) -> Iterator[pd.DataFrame]:
+        """
+        Returns the rows of the query as a stream of dataframes of at most batch_size rows.
+        """
+        pass
+
+    @profile('query.read')
+    def read(self, query: TableQuery) -> pd.DataFrame:
+        """
+        Returns the rows of the query.
+        """
+        return to_dataframe(self.read_arrow(query), self.storage)
+
+
+def to_dataframe(table: pa.Table, storage: Storage = None) -> pd.DataFrame:
+    """
+    Converts rows to a dataframe. The categorical columns are dictionary encoded by Arrow, so no Python string is
+    created per row, and mapped to the category dictionary of the storage if one is given. The dictionary is never
+    written by a read.
+    """
+    categories = [column for column in table.column_names if column in CATEGORICAL_COLUMNS]
+    df = table.to_pandas(categories=categories)
+    return encode_categories(df, storage) if storage is not None else df
+
+
+class BigQueryBackend(QueryBackend):
+    """
+    Reads tables with the BigQuery Storage Read API: the projection and the range are pushed down as selected fields
+    and row restriction of a read session, so no query job runs and only the selected columns of the matching
+    partitions are scanned. The streams of the session are read in parallel as Arrow record batches.
+    """
+
+    def __init__(self, project: str = PROJECT, max_streams: int = None, token: str = None, storage: Storage = None):
+        """
+        Initialize the backend.
+
+        Args:
+            project (str): The project billed for the reads.
+            max_streams (int): The maximum number of streams read in parallel, defaults to the number of cores.
+            token (str): The service account json, defaults to GOOGLE_APPLICATION_CREDENTIALS.
+            storage (Storage): The storage of the category dictionary, the categorical columns are kept as read if None.
+        """
+        self.project = project
+        self.max_streams = max_streams or os.cpu_count()
+        self.token = token or os.environ.get('GOOGLE_APPLICATION_CREDENTIALS')
+        self.storage = storage
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            from google.cloud import bigquery_storage
+            if self.token is not None:
+                self._client = bigquery_storage.BigQueryReadClient.from_service_account_json(self.token)
+            else:
+                self._client = bigquery_storage.BigQueryReadClient()
+        return self._client
+
+    def create_session(self, query: TableQuery, max_streams: int = None):
+        """
+        Creates a read session of the query, split in at most max_streams streams.
+        """
+        from google.cloud.bigquery_storage import types
+
+        project, dataset, table = query.table.split('.')
+        read_options = types.ReadSession.TableReadOptions(row_restriction=query.row_restriction())
+        if query.columns is not None:
+            read_options.selected_fields = query.columns
+
+        session = types.ReadSession(table=f'projects/{project}/datasets/{dataset}/tables/{table}',
+                                    data_format=types.DataFormat.ARROW, read_options=read_options)
+
+        return self.client.create_read_session(parent=f'projects/{self.project}', read_session=session,
+                                               max_stream_count=max_streams or self.max_streams)
+
+    def _read_stream(self, session, stream) -> pa.Table:
+        return self.client.read_rows(stream.name).to_arrow(session)
+
+    def read_arrow(self, query: TableQuery) -> pa.Table:
+        session = self.create_session(query)
+        if not session.streams:
+            # no row matches, the schema of the session still gives the columns and types
+            return pa.ipc.read_schema(pa.py_buffer(session.arrow_schema.serialized_schema)).empty_table()
+
+        with ThreadPoolExecutor(max_workers=len(session.streams)) as executor:
+            tables = list(executor.map(lambda stream: self._read_stream(session, stream), session.streams))
+
+        return pa.concat_tables(tables)
+
+    def read_batches(self, query: TableQuery, batch_size: int = 1_000_000) -> Iterator[pd.DataFrame]:
+        # one stream read in order keeps the memory bounded
+        session = self.create_session(query, max_streams=1)
+
+        for stream in session.streams:
+            batches, rows = [], 0
+            for page in self.client.read_rows(stream.name).rows(session).pages:
+                batch = page.to_arrow()
+                batches.append(batch)
+                rows += batch.num_rows
+                if rows >= batch_size:
+                    yield to_dataframe(pa.Table.from_batches(batches), self.storage)
+                    batches, rows = [], 0
+            if batches:
+                yield to_dataframe(pa.Table.from_batches(batches), self.storage)
+
+
+class DuckDBBackend(QueryBackend):
+    """
+    Local stand-in of BigQuery: a table is the Parquet files of <root>/<table name>/ (e.g. root/trips_clean/*.parquet,
+    hive partitioned directories included). DuckDB pushes the projection and the range down to the Parquet reader,
+    which skips the columns and the row groups outside of them.
+    """
+
+    def __init__(self, root: str, threads: int = None, storage: Storage = None):
+        """
+        Initialize the backend.
+
+        Args:
+            root (str): The directory of the tables.
+            threads (int): The number of threads of DuckDB, defaults to the number of cores.
+            storage (Storage): The storage of the category dictionary, the categorical columns are kept as read if None.
+        """
+        self.root = root
+        self.threads = threads
+        self.storage = storage
+
+    def source(self, query: TableQuery) -> str:
+        path = os.path.join(self.root, query.table_name, '**', '*.parquet').replace('\\', '/')
+        return f"read_parquet('{path}', hive_partitioning = true, union_by_name = true)"
+
+    def _execute(self, query: TableQuery):
+        import duckdb
+
+        connection = duckdb.connect()
+        if self.threads is not None:
+            connection.execute(f'SET threads TO {int(self.threads)}')
+
+        sql, parameters = query.to_sql(self.source(query))
+        return connection.execute(sql, parameters)
+
+    def read_arrow(self, query: TableQuery) -> pa.Table:
+        return self._execute(query).fetch_arrow_table()
+
+    def read_batches(self, query: TableQuery, batch_size: int = 1_000_000) -> Iterator[pd.DataFrame]:
+        reader = self._execute(query).fetch_record_batch(batch_size)
+        for batch in reader:
+            yield to_dataframe(pa.Table.from_batches([batch]), self.storage)
+
+
+@lru_cache(maxsize=None)
+def get_query_backend(backend: str = None, location: str = None, storage: Storage = None) -> QueryBackend:
+    """
+    Returns the query backend, one instance per backend and location.
+
+    Args:
+        backend: 'bigquery' or 'duckdb', defaults to the PIPELINE_QUERY environment variable or 'bigquery'.
+        location: The billed project for 'bigquery' or the directory of the tables for 'duckdb', defaults to
+            PIPELINE_QUERY_ROOT.
+        storage: The storage of the category dictionary the categorical columns are mapped to, kept as read if None.
+
+    Returns:
+        The query backend.
+    """
+
+    backend = backend or os.environ.get(QUERY_BACKEND_ENV, 'bigquery')
+
+    if backend == 'bigquery':
+        return BigQueryBackend(location or PROJECT, storage=storage)
+
+    if backend == 'duckdb':
+        location = location or os.environ.get(QUERY_ROOT_ENV)
+        assert location is not None, f'Please set {QUERY_ROOT_ENV} to the directory of the local tables.'
+        return DuckDBBackend(location, storage=storage)
+
+    raise ValueError(f'Unknown query backend: {backend}. Please select "bigquery" or "duckdb".')
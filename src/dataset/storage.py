@@ -0,0 +1,355 @@
+"""
+Storage.py
+Contains the storage backends used to read and write the pipeline data.
+"""
+import logging
+import os
+import tempfile
+import time
+from abc import ABC, abstractmethod
+from functools import lru_cache
+from pathlib import Path
+from typing import IO, List, Optional, Tuple
+from src.monitoring.profiler import profile
+
+BUCKET_NAME = 'yellow_taxi_vineet'
+CHUNK_SIZE = 262144
+
+# Environment variables used by get_storage to pick the backend
+STORAGE_ENV = 'PIPELINE_STORAGE'
+STORAGE_ROOT_ENV = 'PIPELINE_STORAGE_ROOT'
+BUCKET_ENV = 'PIPELINE_BUCKET'
+
+
+class PreconditionFailed(Exception):
+    """
+    Raised by write_if_generation when the file changed since it was read.
+    """
+    pass
+
+
+class Storage(ABC):
+    """
+    Abstract class for storage backends. Paths are '/' separated and relative to the root of the backend.
+    """
+
+    @abstractmethod
+    def write_bytes(self, path: str, data: bytes, content_type: str = None) -> str:
+        """
+        Write the data to the given path and return the path.
+        """
+        pass
+
+    @abstractmethod
+    def read_bytes(self, path: str) -> bytes:
+        """
+        Read the data at the given path.
+        """
+        pass
+
+    @abstractmethod
+    def open(self, path: str, mode: str = 'rb') -> IO:
+        """
+        Open the given path as a file object.
+        """
+        pass
+
+    @abstractmethod
+    def list_files(self, prefix: str) -> List[str]:
+        """
+        List the paths starting with the given prefix.
+        """
+        pass
+
+    @abstractmethod
+    def exists(self, path: str) -> bool:
+        """
+        Check if the given path exists.
+        """
+        pass
+
+    @abstractmethod
+    def delete(self, path: str):
+        """
+        Delete the given path if it exists.
+        """
+        pass
+
+    @abstractmethod
+    def uri(self, path: str) -> str:
+        """
+        Returns the location of the given path that can be passed to pandas.
+        """
+        pass
+
+    @abstractmethod
+    def read_versioned(self, path: str) -> Tuple[Optional[bytes], int]:
+        """
+        Read the data at the given path along with its generation, (None, 0) if the path does not exist.
+        """
+        pass
+
+    @abstractmethod
+    def write_if_generation(self, path: str, data: bytes, generation: int, content_type: str = None) -> str:
+        """
+        Write the data only if the generation of the path still matches (0 if the path must not exist),
+        raise PreconditionFailed otherwise.
+        """
+        pass
+
+    @property
+    def storage_options(self) -> Optional[dict]:
+        """
+        The storage options to pass to pandas along with uri().
+        """
+        return None
+
+
+class GCSStorage(Storage):
+    """
+    Google Cloud Storage backend. The client, the bucket and the filesystem handles are created once and reused.
+    """
+
+    def __init__(self, bucket_name: str = BUCKET_NAME, token: str = None):
+        """
+        Initialize the backend.
+
+        Args:
+            bucket_name (str): The name of the bucket.
+            token (str): Path to the service account credentials, defaults to GOOGLE_APPLICATION_CREDENTIALS.
+        """
+        self.bucket_name = bucket_name
+        self.token = token if token is not None else os.environ.get('GOOGLE_APPLICATION_CREDENTIALS')
+        self._client = None
+        self._bucket = None
+        self._filesystem = None
+
+    def __getstate__(self):
+        # the handles are not picklable, they are created again in the process the backend is sent to
+        return {'bucket_name': self.bucket_name, 'token': self.token}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    @property
+    def client(self):
+        if self._client is None:
+            from google.cloud import storage
+
+            self._client = storage.Client()
+        return self._client
+
+    @property
+    def bucket(self):
+        if self._bucket is None:
+            self._bucket = self.client.get_bucket(self.bucket_name)
+        return self._bucket
+
+    @property
+    def filesystem(self):
+        if self._filesystem is None:
+            import gcsfs
+
+            self._filesystem = gcsfs.GCSFileSystem(token=self.token)
+        return self._filesystem
+
+    @profile('storage.write_bytes', level=logging.DEBUG)
+    def write_bytes(self, path: str, data: bytes, content_type: str = None) -> str:
+        blob = self.bucket.blob(path)
+        blob.chunk_size = CHUNK_SIZE
+        blob.upload_from_string(data, content_type=content_type or 'application/octet-stream')
+        return path
+
+    @profile('storage.read_bytes', level=logging.DEBUG)
+    def read_bytes(self, path: str) -> bytes:
+        return self.bucket.blob(path).download_as_bytes()
+
+    def open(self, path: str, mode: str = 'rb') -> IO:
+        return self.filesystem.open(f'{self.bucket_name}/{path}', mode)
+
+    def list_files(self, prefix: str) -> List[str]:
+        return [blob.name for blob in self.client.list_blobs(self.bucket, prefix=prefix)]
+
+    def exists(self, path: str) -> bool:
+        return self.bucket.blob(path).exists()
+
+    def delete(self, path: str):
+        from google.api_core.exceptions import NotFound
+
+        try:
+            self.bucket.blob(path).delete()
+        except NotFound:
+            pass
+
+    def uri(self, path: str) -> str:
+        return f'gs://{self.bucket_name}/{path}'
+
+    @profile('storage.read_versioned', level=logging.DEBUG)
+    def read_versioned(self, path: str) -> Tuple[Optional[bytes], int]:
+        from google.api_core.exceptions import NotFound, PreconditionFailed as GCSPreconditionFailed
+
+        blob = self.bucket.get_blob(path)
+        if blob is None:
+            return None, 0
+
+        try:
+            return blob.download_as_bytes(if_generation_match=blob.generation), blob.generation
+        except (NotFound, GCSPreconditionFailed):
+            # the blob was replaced between the metadata request and the download
+            return self.read_versioned(path)
+
+    def write_if_generation(self, path: str, data: bytes, generation: int, content_type: str = None) -> str:
+        from google.api_core.exceptions import PreconditionFailed as GCSPreconditionFailed
+
+        blob = self.bucket.blob(path)
+        try:
+            blob.upload_from_string(data, content_type=content_type or 'application/octet-stream', if_generation_match=generation)
+        except GCSPreconditionFailed as error:
+            raise PreconditionFailed(path) from error
+
+        return path
+
+    @property
+    def storage_options(self) -> Optional[dict]:
+        return {'token': self.token}
+
+
+class LocalStorage(Storage):
+    """
+    Local directory backend with the same layout as the bucket, used to run and benchmark the pipeline offline.
+    """
+
+    def __init__(self, root: str):
+        """
+        Initialize the backend.
+
+        Args:
+            root (str): The directory that plays the role of the bucket.
+        """
+        self.root = Path(root).resolve()
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, path: str) -> Path:
+        return Path(self.root, path)
+
+    @profile('storage.write_bytes', level=logging.DEBUG)
+    def write_bytes(self, path: str, data: bytes, content_type: str = None) -> str:
+        target = self._path(path)
+        target.parent.mkdir(parents=True, exist_ok=True)
+
+        # write to a temporary file first so readers never see a partial file
+        fd, temp_path = tempfile.mkstemp(dir=target.parent, prefix=f'.{target.name}.')
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                file.write(data)
+            os.replace(temp_path, target)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+        return path
+
+    @profile('storage.read_bytes', level=logging.DEBUG)
+    def read_bytes(self, path: str) -> bytes:
+        return self._path(path).read_bytes()
+
+    def open(self, path: str, mode: str = 'rb') -> IO:
+        target = self._path(path)
+        if any(flag in mode for flag in 'wax'):
+            target.parent.mkdir(parents=True, exist_ok=True)
+        return open(target, mode)
+
+    def list_files(self, prefix: str) -> List[str]:
+        # like a bucket, the prefix is matched as a string and not as a directory
+        base = self._path(prefix) if prefix.endswith('/') else self._path(prefix).parent
+
+        if not base.is_dir():
+            return []
+
+        files = []
+        for dirpath, _, filenames in os.walk(base):
+            for filename in filenames:
+                name = Path(dirpath, filename).relative_to(self.root).as_posix()
+                if name.startswith(prefix) and not filename.startswith('.'):
+                    files.append(name)
+
+        return sorted(files)
+
+    def exists(self, path: str) -> bool:
+        return self._path(path).is_file()
+
+    def delete(self, path: str):
+        self._path(path).unlink(missing_ok=True)
+
+    def uri(self, path: str) -> str:
+        return str(self._path(path))
+
+    @profile('storage.read_versioned', level=logging.DEBUG)
+    def read_versioned(self, path: str) -> Tuple[Optional[bytes], int]:
+        target = self._path(path)
+
+        try:
+            with open(target, 'rb') as file:
+                return file.read(), _generation(os.fstat(file.fileno()))
+        except FileNotFoundError:
+            return None, 0
+
+    def write_if_generation(self, path: str, data: bytes, generation: int, content_type: str = None) -> str:
+        target = self._path(path)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        lock = Path(target.parent, f'.{target.name}.lock')
+
+        # the lock file serializes the check and the replace between processes
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                fd = os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                break
+            except FileExistsError:
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f'Could not acquire the lock on {path}')
+                time.sleep(0.01)
+
+        try:
+            current = _generation(target.stat()) if target.exists() else 0
+            if current != generation:
+                raise PreconditionFailed(path)
+            return self.write_bytes(path, data, content_type)
+        finally:
+            os.close(fd)
+            os.remove(lock)
+
+
+def _generation(stat: os.stat_result) -> int:
+    """
+    Generation of a local file. Every write replaces the file, so the inode changes even if the mtime resolution is coarse.
+    """
+    return (stat.st_ino << 64) | stat.st_mtime_ns
+
+
+@lru_cache(maxsize=None)
+def get_storage(backend: str = None, location: str = None) -> Storage:
+    """
+    Returns the storage backend, one instance per backend and location so that the handles are reused across calls.
+
+    Args:
+        backend: 'gcs' or 'local', defaults to the PIPELINE_STORAGE environment variable or 'gcs'.
+        location: The bucket name for 'gcs' or the root directory for 'local', defaults to
+            PIPELINE_BUCKET / PIPELINE_STORAGE_ROOT.
+
+    Returns:
+        The storage backend.
+    """
+
+    backend = backend or os.environ.get(STORAGE_ENV, 'gcs')
+
+    if backend == 'gcs':
+        return GCSStorage(location or os.environ.get(BUCKET_ENV, BUCKET_NAME))
+
+    if backend == 'local':
+        location = location or os.environ.get(STORAGE_ROOT_ENV)
+        assert location is not None, f'Please set {STORAGE_ROOT_ENV} to the directory to use as local storage.'
+        return LocalStorage(location)
+
+    raise ValueError(f'Unknown storage backend: {backend}. Please select "gcs" or "local".')
@@ -0,0 +1,177 @@
+"""
+Warehouse.py
+Contains the BigQuery load schemas generated from the declared dtypes, and the chunked Parquet loader.
+"""
+import io
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from src.dataset.create_dataset import YELLOW_TRIP_DATE_COLUMNS, YELLOW_TRIP_DTYPES
+from src.dataset.query import PARTITION_COLUMN
+
+# Column dtypes of the trip tables (trips, trips_clean)
+TRIP_DTYPES = {**{column: 'datetime64[ns]' for column in YELLOW_TRIP_DATE_COLUMNS}, **YELLOW_TRIP_DTYPES}
+
+# Rows of a Parquet file of the loader, and load jobs running at the same time
+LOAD_CHUNK_ROWS = 2_000_000
+MAX_LOAD_JOBS = 4
+
+# The tables are partitioned by month on the pickup time and clustered on it within a partition
+PARTITION_TYPE = 'MONTH'
+CLUSTERING_FIELDS = [PARTITION_COLUMN]
+
+
+def bigquery_type(dtype) -> str:
+    """
+    Returns the BigQuery type of a pandas or NumPy dtype.
+
+    Args:
+        dtype: The dtype, e.g. np.int8, 'Int32', 'string', 'datetime64[ns]'.
+
+    Returns:
+        INT64, FLOAT64, BOOL, DATETIME (naive times), TIMESTAMP (time zone aware times) or STRING.
+    """
+    dtype = pd.api.types.pandas_dtype(dtype)
+
+    if pd.api.types.is_bool_dtype(dtype):
+        return 'BOOL'
+    if pd.api.types.is_integer_dtype(dtype):
+        return 'INT64'
+    if pd.api.types.is_float_dtype(dtype):
+        return 'FLOAT64'
+    if isinstance(dtype, pd.DatetimeTZDtype):
+        return 'TIMESTAMP'
+    if pd.api.types.is_datetime64_dtype(dtype):
+        return 'DATETIME'
+    if pd.api.types.is_string_dtype(dtype):
+        return 'STRING'
+
+    raise TypeError(f'No BigQuery type for dtype {dtype}.')
+
+
+def arrow_type(dtype) -> pa.DataType:
+    """
+    Returns the Arrow type the loader writes a column of the given dtype as.
+    """
+    return {
+        'BOOL'     : pa.bool_(),
+        'INT64'    : pa.int64(),
+        'FLOAT64'  : pa.float64(),
+        'DATETIME' : pa.timestamp('us'),
+        'TIMESTAMP': pa.timestamp('us', tz='UTC'),
+        'STRING'   : pa.string()
+    }[bigquery_type(dtype)]
+
+
+def get_schema(dtypes: Dict[str, object], required: List[str] = None) -> list:
+    """
+    Returns the BigQuery schema of the given columns.
+
+    Args:
+        dtypes: The dtype of every column, in the order of the table.
+        required: The columns that can not be null.
+
+    Returns:
+        The list of bigquery.SchemaField.
+    """
+    from google.cloud import bigquery
+
+    required = set(required or [])
+    return [bigquery.SchemaField(column, bigquery_type(dtype), mode='REQUIRED' if column in required else 'NULLABLE')
+            for column, dtype in dtypes.items()]
+
+
+def trip_dtypes(columns: List[str] = None) -> Dict[str, object]:
+    """
+    Returns the dtypes of the given trip columns, every trip column if None.
+    """
+    if columns is None:
+        return dict(TRIP_DTYPES)
+
+    unknown = [column for column in columns if column not in TRIP_DTYPES]
+    assert not unknown, f'The columns {unknown} are not trip columns.'
+    return {column: TRIP_DTYPES[column] for column in columns}
+
+
+def feature_dtypes(features: list, passthrough: List[str] = None) -> Dict[str, object]:
+    """
+    Returns the dtypes of the feature table: the feature_dtype() of every FeatureEngineer followed by the passthrough
+    trip columns.
+    """
+    dtypes = {}
+    for feature in features:
+        dtypes.update(feature.feature_dtype())
+    dtypes.update(trip_dtypes(passthrough or []))
+    return dtypes
+
+
+def to_parquet_chunk(df: pd.DataFrame, dtypes: Dict[str, object]) -> io.BytesIO:
+    """
+    Encodes rows as Parquet with the Arrow types of the declared dtypes.
+    """
+    schema = pa.schema([(column, arrow_type(dtype)) for column, dtype in dtypes.items()])
+    table = pa.Table.from_pandas(df[list(dtypes)], schema=schema, preserve_index=False, safe=True)
+
+    buffer = io.BytesIO()
+    pq.write_table(table, buffer, compression='snappy', coerce_timestamps='us', allow_truncated_timestamps=True)
+    buffer.seek(0)
+    return buffer
+
+
+def load_dataframe(client, df: pd.DataFrame, table: str, dtypes: Dict[str, object], truncate: bool = False,
+                   chunk_rows: int = LOAD_CHUNK_ROWS, max_jobs: int = MAX_LOAD_JOBS, partition_column: str = PARTITION_COLUMN,
+                   clustering_fields: List[str] = None) -> int:
+    """
+    Loads a dataframe into a BigQuery table with the schema of the declared dtypes. The rows are split in Parquet files of
+    chunk_rows rows loaded by up to max_jobs concurrent load jobs. A new table is partitioned by month on the partition
+    column and clustered on the clustering fields.
+
+    Args:
+        client: The bigquery.Client.
+        df: The rows to load.
+        table: The table (dataset.table or project.dataset.table).
+        dtypes: The dtype of every column of the table.
+        truncate: Replace the rows of the table instead of appending.
+        chunk_rows: The rows of a Parquet file.
+        max_jobs: The number of load jobs running at the same time.
+        partition_column: The column the table is partitioned on, None for no partitioning.
+        clustering_fields: The columns the table is clustered on, defaults to CLUSTERING_FIELDS.
+
+    Returns:
+        The number of loaded rows.
+    """
+    from google.cloud import bigquery
+
+    missing = [column for column in dtypes if column not in df.columns]
+    assert not missing, f'The dataframe is missing the columns {missing}.'
+
+    def job_config(write_disposition: str) -> bigquery.LoadJobConfig:
+        config = bigquery.LoadJobConfig(source_format=bigquery.SourceFormat.PARQUET, schema=get_schema(dtypes),
+                                        write_disposition=write_disposition)
+        if write_disposition == 'WRITE_APPEND':
+            # new features add columns to an existing table
+            config.schema_update_options = [bigquery.SchemaUpdateOption.ALLOW_FIELD_ADDITION]
+        if partition_column is not None and partition_column in dtypes:
+            config.time_partitioning = bigquery.TimePartitioning(type_=PARTITION_TYPE, field=partition_column)
+            config.clustering_fields = clustering_fields or CLUSTERING_FIELDS
+        return config
+
+    def load(start: int, write_disposition: str) -> int:
+        data = to_parquet_chunk(df.iloc[start:start + chunk_rows], dtypes)
+        job = client.load_table_from_file(data, table, job_config=job_config(write_disposition))
+        return job.result().output_rows
+
+    starts = list(range(0, len(df), chunk_rows))
+    if not starts:
+        return 0
+
+    # the first chunk creates (or truncates) the table before the other chunks are appended concurrently
+    loaded = load(starts[0], 'WRITE_TRUNCATE' if truncate else 'WRITE_APPEND')
+
+    with ThreadPoolExecutor(max_workers=max_jobs) as executor:
+        loaded += sum(executor.map(lambda start: load(start, 'WRITE_APPEND'), starts[1:]))
+
+    return loaded
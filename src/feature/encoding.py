@@ -0,0 +1,299 @@
+"""
+This file contains the persisted category dictionary of the low-cardinality trip columns, their categorical encoding and
+their sparse one-hot encoding.
+"""
+import copy
+import json
+from functools import lru_cache
+from typing import Dict, List
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from src.dataset.catalog import DATA_DIR
+from src.dataset.storage import PreconditionFailed, Storage, get_storage
+
+DICTIONARY_PATH = f'{DATA_DIR}/features/categories.json'
+
+MAX_ATTEMPTS = 10
+
+# Kind and known categories of the categorical columns, from the TLC data dictionary: the codes of the known categories
+# never depend on the order of the data. 'str' columns are read as strings, 'int' columns as integer IDs.
+CATEGORICAL_COLUMNS = {
+    'VendorID'          : ('str', ['1', '2']),
+    'store_and_fwd_flag': ('str', ['N', 'Y']),
+    'payment_type'      : ('str', ['1', '2', '3', '4', '5', '6']),
+    'RatecodeID'        : ('int', [1, 2, 3, 4, 5, 6, 99]),
+    'PULocationID'      : ('int', list(range(1, 266))),
+    'DOLocationID'      : ('int', list(range(1, 266)))
+}
+
+# Columns one-hot encoded by default, the location IDs have too many categories to be worth it
+ONE_HOT_COLUMNS = ['VendorID', 'store_and_fwd_flag', 'payment_type', 'RatecodeID']
+
+
+class CategoryDictionary:
+    """
+    The categories of every categorical column, in a stable order: a category keeps its code forever and new categories
+    are appended, so the codes of data encoded with an older dictionary are still valid. The columns are encoded as
+    pandas Categorical with int8 codes (int16 for the location IDs), instead of a Python string per row.
+
+    A frozen dictionary does not learn new categories, unknown values are encoded as missing. Freeze the dictionary a
+    model was trained with, so the one-hot columns of the serving data match the training ones.
+    """
+
+    def __init__(self, categories: Dict[str, list] = None, kinds: Dict[str, str] = None, frozen: bool = False):
+        """
+        Initialize the dictionary.
+
+        Args:
+            categories (Dict[str, list]): The categories of every column, defaults to the known categories.
+            kinds (Dict[str, str]): 'str' or 'int' for every column, defaults to the kinds of CATEGORICAL_COLUMNS.
+            frozen (bool): Encode unknown values as missing instead of adding them.
+        """
+        if categories is None:
+            categories = {column: values for column, (_, values) in CATEGORICAL_COLUMNS.items()}
+
+        self.kinds = {column: (kinds or {}).get(column, CATEGORICAL_COLUMNS.get(column, ('str',))[0]) for column in categories}
+        self.categories = {column: list(values) for column, values in categories.items()}
+        self.index = {column: {value: code for code, value in enumerate(values)} for column, values in self.categories.items()}
+        self.frozen = frozen
+        self.changed = False
+        self._dtypes = {}
+
+    @property
+    def columns(self) -> List[str]:
+        return list(self.categories)
+
+    def dtype(self, column: str) -> pd.CategoricalDtype:
+        """
+        The categorical dtype of a column, with the current categories.
+        """
+        size = len(self.categories[column])
+        if column not in self._dtypes or len(self._dtypes[column].categories) != size:
+            self._dtypes[column] = pd.CategoricalDtype(self.categories[column])
+        return self._dtypes[column]
+
+    def read_dtypes(self, dtypes: Dict[str, object]) -> Dict[str, object]:
+        """
+        The dtypes to read a file with: the categorical columns are parsed straight into categories, without a string
+        per row, and encode() maps them to the dictionary afterwards.
+        """
+        return {column: 'category' if column in self.categories else dtype for column, dtype in dtypes.items()}
+
+    def _normalize(self, column: str, values: pd.Index) -> list:
+        """
+        The categories of the dictionary matching some values, e.g. '1', '1.0' and 1 are the ID 1.
+        """
+        if self.kinds[column] == 'str':
+            return [str(value).strip() for value in values]
+
+        numbers = pd.to_numeric(pd.Series(values, dtype=object), errors='raise').to_numpy(dtype=np.float64)
+        if not np.array_equal(numbers, np.round(numbers)):
+            raise ValueError(f'Column {column} has non integer IDs: {list(values[numbers != np.round(numbers)])}.')
+        return numbers.astype(np.int64).tolist()
+
+    def positions(self, column: str, values: pd.Index) -> np.ndarray:
+        """
+        The codes of the given values, new values are added unless the dictionary is frozen (-1 then).
+        """
+        index = self.index[column]
+        codes = np.empty(len(values), dtype=np.int64)
+
+        for i, value in enumerate(self._normalize(column, values)):
+            if value not in index:
+                if self.frozen:
+                    codes[i] = -1
+                    continue
+                index[value] = len(self.categories[column])
+                self.categories[column].append(value)
+                self.changed = True
+            codes[i] = index[value]
+
+        return codes
+
+    def encode_column(self, column: str, values: pd.Series) -> pd.Series:
+        """
+        Encodes a column as a Categorical of the dictionary.
+
+        Args:
+            column (str): The column of the dictionary.
+            values (pd.Series): The values, of any dtype (e.g. strings, nullable integers or categories).
+
+        Returns:
+            The categorical column, missing values included.
+        """
+        if values.dtype == self.dtype(column):
+            return values
+
+        if not isinstance(values.dtype, pd.CategoricalDtype):
+            values = values.astype('category')
+
+        # the few categories of the values are mapped to the dictionary, the codes of the rows with one lookup
+        mapping = np.append(self.positions(column, values.cat.categories), -1)
+        codes = mapping[values.cat.codes.to_numpy()]
+
+        # pandas stores the codes in the smallest integer type of the categories
+        return pd.Series(pd.Categorical.from_codes(codes, dtype=self.dtype(column)), index=values.index, name=values.name)
+
+    def encode(self, df: pd.DataFrame, columns: List[str] = None) -> pd.DataFrame:
+        """
+        Encodes the categorical columns of a dataframe, the other columns are not copied.
+
+        Args:
+            df (pd.DataFrame): The data.
+            columns (List[str]): The columns to encode, defaults to every column of the dictionary in the data.
+
+        Returns:
+            A new dataframe with the encoded columns.
+        """
+        columns = [column for column in (columns or self.columns) if column in df.columns]
+        encoded = df.copy(deep=False)
+        for column in columns:
+            encoded[column] = self.encode_column(column, df[column])
+        return encoded
+
+    def codes(self, column: str, values: pd.Series) -> np.ndarray:
+        """
+        The codes of a column, -1 for the missing values.
+        """
+        return self.encode_column(column, values).cat.codes.to_numpy()
+
+    def feature_names(self, columns: List[str] = None) -> List[str]:
+        """
+        The names of the one-hot columns, e.g. 'payment_type=1'.
+        """
+        return [f'{column}={value}' for column in (columns or ONE_HOT_COLUMNS) for value in self.categories[column]]
+
+    def one_hot(self, df: pd.DataFrame, columns: List[str] = None) -> sp.csr_matrix:
+        """
+        One-hot encodes categorical columns as a sparse matrix, one row per trip and one column per category (see
+        feature_names). The matrix is built from the codes, the dense one-hot matrix is never materialized.
+
+        GaussianNB only takes dense features: give it the categorical columns as codes (see GaussianNBModel.preprocess),
+        the sparse matrix is meant for the models taking sparse input.
+
+        Args:
+            df (pd.DataFrame): The data.
+            columns (List[str]): The columns to encode, defaults to ONE_HOT_COLUMNS.
+
+        Returns:
+            The float32 CSR matrix, a row has no 1 for a missing value.
+        """
+        columns = columns or ONE_HOT_COLUMNS
+        codes = np.column_stack([self.codes(column, df[column]).astype(np.int64) for column in columns])
+
+        # the codes are known once every column is encoded, a new category shifts the offsets of the next columns
+        offsets = np.cumsum([0] + [len(self.categories[column]) for column in columns])
+        valid = codes >= 0
+
+        indices = (codes + offsets[:-1])[valid].astype(np.int32)
+        indptr = np.concatenate([[0], np.cumsum(valid.sum(axis=1))]).astype(np.int32)
+        data = np.ones(len(indices), dtype=np.float32)
+
+        return sp.csr_matrix((data, indices, indptr), shape=(len(df), int(offsets[-1])))
+
+    def merge(self, other: 'CategoryDictionary') -> 'CategoryDictionary':
+        """
+        Appends the categories of another dictionary missing in this one.
+
+        Returns:
+            self
+        """
+        for column, values in other.categories.items():
+            if column not in self.categories:
+                self.categories[column], self.index[column] = [], {}
+                self.kinds[column] = other.kinds[column]
+            for value in values:
+                if value not in self.index[column]:
+                    self.index[column][value] = len(self.categories[column])
+                    self.categories[column].append(value)
+                    self.changed = True
+        return self
+
+    def freeze(self) -> 'CategoryDictionary':
+        """
+        A frozen copy of the dictionary.
+        """
+        frozen = copy.deepcopy(self)
+        frozen.frozen = True
+        return frozen
+
+    def to_json(self) -> bytes:
+        return json.dumps({column: {'kind': self.kinds[column], 'categories': values}
+                           for column, values in self.categories.items()}, indent=2).encode('utf-8')
+
+    @classmethod
+    def from_json(cls, data: bytes) -> 'CategoryDictionary':
+        columns = json.loads(data)
+        return cls({column: spec['categories'] for column, spec in columns.items()},
+                   {column: spec['kind'] for column, spec in columns.items()})
+
+    def save(self, path: str = DICTIONARY_PATH, storage: Storage = None) -> str:
+        """
+        Writes the dictionary. The stored categories come first, the new ones of this dictionary are appended after
+        them, so concurrent writers never change the code of a stored category.
+
+        Args:
+            path (str): The path of the dictionary.
+            storage (Storage): The storage backend, defaults to get_storage().
+
+        Returns:
+            The path of the dictionary.
+        """
+        storage = storage or get_storage()
+
+        for _ in range(MAX_ATTEMPTS):
+            data, generation = storage.read_versioned(path)
+            stored = CategoryDictionary.from_json(data) if data is not None else CategoryDictionary({})
+            stored.merge(self)
+
+            # the order of the stored dictionary is the reference, this one may have added the same categories in another order
+            self.categories, self.index, self.kinds = stored.categories, stored.index, stored.kinds
+            self.changed, self._dtypes = False, {}
+            if data is not None and not stored.changed:
+                return path
+
+            try:
+                storage.write_if_generation(path, stored.to_json(), generation, content_type='application/json')
+            except PreconditionFailed:
+                continue
+            return path
+
+        raise RuntimeError(f'Could not update the category dictionary {path} after {MAX_ATTEMPTS} attempts.')
+
+    @classmethod
+    def load(cls, path: str = DICTIONARY_PATH, storage: Storage = None) -> 'CategoryDictionary':
+        """
+        Reads a dictionary, the known categories if it was never written.
+        """
+        data, _ = (storage or get_storage()).read_versioned(path)
+        return cls.from_json(data) if data is not None else cls()
+
+
+@lru_cache(maxsize=None)
+def get_dictionary(storage: Storage = None) -> CategoryDictionary:
+    """
+    Returns the category dictionary of the storage backend, one per backend so that the categories are shared.
+    """
+    return CategoryDictionary.load(storage=storage or get_storage())
+
+
+def encode_categories(df: pd.DataFrame, storage: Storage = None, save: bool = False) -> pd.DataFrame:
+    """
+    Encodes the categorical columns of trips with the dictionary of the storage backend. New categories are only added
+    to the dictionary in memory: the steps writing data persist them with save=True (see save_dictionary), reading
+    trips never writes the dictionary.
+    """
+    dictionary = get_dictionary(storage or get_storage())
+    df = dictionary.encode(df)
+    if save and dictionary.changed:
+        dictionary.save(storage=storage)
+    return df
+
+
+def save_dictionary(storage: Storage = None) -> str:
+    """
+    Persists the categories the trips encoded by this process added to the dictionary of the storage backend.
+    """
+    dictionary = get_dictionary(storage or get_storage())
+    return dictionary.save(storage=storage) if dictionary.changed else DICTIONARY_PATH
@@ -0,0 +1,144 @@
+"""
+This file contains the executor that runs a set of features as a dependency graph.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+import numpy as np
+import pandas as pd
+from src.feature.feature_selection import FeatureEngineer, memory_usage
+from src.monitoring.profiler import stage
+
+
+class FeatureExecutor:
+    """
+    Runs a set of features. The graph is built from the declarations of the features: a feature depends on another one
+    if one of its `column_name` inputs is in the `feature_dtype()` outputs of the other one. Features of the same level
+    of the graph run concurrently, and every feature writes its outputs into arrays allocated once for the whole run.
+    """
+
+    def __init__(self, features: List[FeatureEngineer], max_workers: int = None):
+        """
+        Initialize the executor and resolve the dependency graph.
+
+        Args:
+            features (List[FeatureEngineer]): The features to generate.
+            max_workers (int): The number of threads running the features of a level, defaults to the size of the level.
+                With 1 the features run in the calling thread, e.g. for small batches where threads cost more than they save.
+        """
+        self.features = features
+        self.max_workers = max_workers
+
+        self.producers = {}
+        for feature in features:
+            for column in feature.feature_dtype():
+                assert column not in self.producers, f'Column {column} is generated by more than one feature.'
+                self.producers[column] = feature
+
+        self.memory_report = {}
+
+        self.dependencies = {
+            feature: {self.producers[column] for column in feature.column_name if column in self.producers} - {feature}
+            for feature in features
+        }
+        self.levels = self._resolve_levels()
+
+    def _resolve_levels(self) -> List[List[FeatureEngineer]]:
+        """
+        Groups the features in levels, every feature only depends on features of the previous levels.
+        """
+        levels = []
+        done = set()
+        remaining = list(self.features)
+
+        while remaining:
+            level = [feature for feature in remaining if self.dependencies[feature] <= done]
+            if not level:
+                names = [feature.feature_name for feature in remaining]
+                raise ValueError(f'The features {names} have circular dependencies.')
+
+            levels.append(level)
+            done.update(level)
+            remaining = [feature for feature in remaining if feature not in done]
+
+        return levels
+
+    @property
+    def source_columns(self) -> List[str]:
+        """
+        The columns that must be loaded from the source to generate every feature.
+        """
+        columns = []
+        for feature in self.features:
+            for column in feature.column_name:
+                if column not in self.producers and column not in columns:
+                    columns.append(column)
+        return columns
+
+    @property
+    def output_dtypes(self) -> Dict[str, np.dtype]:
+        """
+        The columns and dtypes of the generated features.
+        """
+        dtypes = {}
+        for feature in self.features:
+            dtypes.update(feature.feature_dtype())
+        return dtypes
+
+    def run(self, df: pd.DataFrame, passthrough: List[str] = None) -> pd.DataFrame:
+        """
+        Generate every feature with the dtypes of its feature_dtype(). The memory used by every feature before and after
+        the cast is stored in memory_report.
+
+        Args:
+            df (pd.DataFrame): The source data, it is not modified.
+            passthrough (List[str]): Source columns to copy to the output (e.g. the pickup time).
+
+        Returns:
+            A frame with the generated features followed by the passthrough columns.
+        """
+        passthrough = passthrough or []
+
+        missing = [column for column in self.source_columns + passthrough if column not in df.columns]
+        if missing:
+            raise KeyError(f'The source data is missing the columns {missing}.')
+
+        outputs = {column: np.empty(len(df), dtype=dtype) for column, dtype in self.output_dtypes.items()}
+
+        for level in self.levels:
+            if len(level) == 1 or self.max_workers == 1:
+                for feature in level:
+                    self._run_feature(feature, df, outputs)
+                continue
+
+            with ThreadPoolExecutor(max_workers=self.max_workers or len(level)) as executor:
+                # list() re-raises the exception of a failed feature
+                list(executor.map(lambda feature: self._run_feature(feature, df, outputs), level))
+
+        for column in passthrough:
+            outputs[column] = df[column].copy()
+
+        return pd.DataFrame(outputs, index=df.index, copy=False)
+
+    def _run_feature(self, feature: FeatureEngineer, df: pd.DataFrame, outputs: Dict[str, np.ndarray]):
+        """
+        Generate one feature and write it into its output arrays.
+        """
+        if self.dependencies[feature]:
+            # the generated columns the feature depends on are only available in the output arrays
+            df = pd.DataFrame({
+                column: outputs[column] if column in self.producers else df[column] for column in feature.column_name
+            }, index=df.index, copy=False)
+
+        with stage(f'feature.{feature.feature_name}', rows_in=len(df)) as record:
+            generated = feature.generate_feature(df)
+            result = feature.cast_feature(generated)
+
+            self.memory_report[feature.feature_name] = {
+                'rows'        : len(result),
+                'bytes_before': memory_usage(generated),
+                'bytes_after' : memory_usage(result)
+            }
+            record.record(rows_out=len(result), bytes_out=self.memory_report[feature.feature_name]['bytes_after'])
+
+        for column in feature.feature_dtype():
+            np.copyto(outputs[column], result[column].to_numpy())
@@ -5,6 +5,7 @@ from typing import List
 import pandas as pd
 import numpy as np
 from abc import ABC, abstractmethod
+from src.monitoring.profiler import stage
 
 
 class FeatureEngineer(ABC):
@@ -26,7 +27,7 @@ class FeatureEngineer(ABC):
     @abstractmethod
     def generate_feature(self, *args, **kwargs):
         """
-        Generate feature.
+        Generate feature. Returns a new frame with the columns of feature_dtype(), the input frame is not modified.
         """
         pass
 
@@ -37,6 +38,75 @@ class FeatureEngineer(ABC):
         """
         pass
 
+    def transform(self, *args, **kwargs) -> pd.DataFrame:
+        """
+        Generate the feature with the dtypes of feature_dtype(). This is the output downstream consumers should rely on.
+        """
+        with stage(f'feature.{self.feature_name}') as record:
+            if args and isinstance(args[0], pd.DataFrame):
+                record.record(rows_in=len(args[0]))
+            feature = self.cast_feature(self.generate_feature(*args, **kwargs))
+            record.record(rows_out=len(feature), bytes_out=memory_usage(feature))
+        return feature
+
+    def cast_feature(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Cast the generated columns to the dtypes of feature_dtype() and validate the result.
+
+        Args:
+            df (pd.DataFrame): The output of generate_feature.
+
+        Returns:
+            The feature with the declared dtypes.
+        """
+        dtypes = self.feature_dtype()
+
+        missing = [column for column in dtypes if column not in df.columns]
+        if missing:
+            raise ValueError(f'Feature {self.feature_name} did not generate the columns {missing}.')
+
+        # categorical source columns (see encoding.CategoryDictionary) are cast from their values, not their codes
+        categorical = [column for column in dtypes if isinstance(df[column].dtype, pd.CategoricalDtype)]
+        if categorical:
+            df = df.assign(**{column: np.asarray(df[column]) for column in categorical})
+
+        for column, dtype in dtypes.items():
+            if np.issubdtype(dtype, np.integer) and len(df) > 0:
+                # astype wraps around silently on overflow
+                info = np.iinfo(dtype)
+                low, high = df[column].min(), df[column].max()
+                if low < info.min or high > info.max:
+                    raise ValueError(f'Column {column} of feature {self.feature_name} has values in [{low}, {high}] '
+                                     f'which do not fit in {np.dtype(dtype).name}.')
+
+        feature = df[list(dtypes)].astype(dtypes, copy=False)
+        self.validate_feature(feature)
+
+        return feature
+
+    def validate_feature(self, df: pd.DataFrame):
+        """
+        Check that the frame has exactly the columns and dtypes of feature_dtype().
+
+        Raises:
+            TypeError: if a column is missing, unexpected or has another dtype.
+        """
+        dtypes = self.feature_dtype()
+
+        if list(df.columns) != list(dtypes):
+            raise TypeError(f'Feature {self.feature_name} has the columns {list(df.columns)} instead of {list(dtypes)}.')
+
+        for column, dtype in dtypes.items():
+            if df[column].dtype != np.dtype(dtype):
+                raise TypeError(f'Column {column} of feature {self.feature_name} is {df[column].dtype} instead of {np.dtype(dtype)}.')
+
+
+def memory_usage(df: pd.DataFrame) -> int:
+    """
+    Returns the memory used by the columns of the frame in bytes.
+    """
+    return int(df.memory_usage(index=False, deep=True).sum())
+
 
 class TripFeature(FeatureEngineer):
     """
@@ -53,11 +123,13 @@ class TripFeature(FeatureEngineer):
         """
         Generate the feature.
         """
-        df['trip_duration'] = (df['tpep_dropoff_datetime'] - df['tpep_pickup_datetime']).dt.total_seconds()
-        df['trip_speed'] = df['trip_distance'] / (df['trip_duration'] + 1000)  ## add 1000 to avoid division by zero
-        df['trip_tolls'] = df['tolls_amount']
+        trip_duration = (df['tpep_dropoff_datetime'] - df['tpep_pickup_datetime']).dt.total_seconds()
 
-        return df[self.feature_dtype().keys()]
+        return pd.DataFrame({
+            'trip_duration': trip_duration,
+            'trip_speed'   : df['trip_distance'] / (trip_duration + 1000),  ## add 1000 to avoid division by zero
+            'trip_tolls'   : df['tolls_amount']
+        }, index=df.index)
 
     def feature_dtype(self):
         """
@@ -86,13 +158,15 @@ class TimeFeature(FeatureEngineer):
         Generate the feature.
         """
 
-        df['pickup_weekday'] = df.tpep_pickup_datetime.dt.dayofweek
-        df['pickup_hour'] = df.tpep_pickup_datetime.dt.hour
-        df['pickup_minute'] = df.tpep_pickup_datetime.dt.minute
+        pickup_weekday = df.tpep_pickup_datetime.dt.dayofweek
+        pickup_hour = df.tpep_pickup_datetime.dt.hour
 
-        df['work_hours'] = (df['pickup_hour'] >= 8) & (df['pickup_hour'] <= 17) & (df['pickup_weekday'] < 5)
-
-        return df[self.feature_dtype().keys()]
+        return pd.DataFrame({
+            'pickup_weekday': pickup_weekday,
+            'pickup_hour'   : pickup_hour,
+            'pickup_minute' : df.tpep_pickup_datetime.dt.minute,
+            'work_hours'    : (pickup_hour >= 8) & (pickup_hour <= 17) & (pickup_weekday < 5)
+        }, index=df.index)
 
     def feature_dtype(self):
         """
@@ -102,7 +176,7 @@ class TimeFeature(FeatureEngineer):
             'pickup_weekday': np.int8,
             'pickup_hour'   : np.int8,
             'pickup_minute' : np.int8,
-            'work_hours'    : np.bool
+            'work_hours'    : np.bool_
         }
 
 
@@ -121,10 +195,10 @@ class MeterFeature(FeatureEngineer):
         """
         Generate the feature.
         """
-        df['meter_eng'] = df['PULocationID']
-        df['meter_dis'] = df['DOLocationID']
-
-        return df[self.feature_dtype().keys()]
+        return pd.DataFrame({
+            'meter_eng': df['PULocationID'],
+            'meter_dis': df['DOLocationID']
+        }, index=df.index)
 
     def feature_dtype(self):
         """
@@ -153,13 +227,14 @@ class TipFeature(FeatureEngineer):
         Generate the feature.
         """
 
-        df['total_tip'] = df['tip_amount']
-        df['total_fare'] = df['fare_amount']
-        df['tip_percentage'] = df['total_tip'] / df['total_fare'] * 100
-
-        df['big_tip'] = df['tip_percentage'] > (high_tip * 100)
+        tip_percentage = df['tip_amount'] / df['fare_amount'] * 100
 
-        return df[self.feature_dtype().keys()]
+        return pd.DataFrame({
+            'total_tip'     : df['tip_amount'],
+            'total_fare'    : df['fare_amount'],
+            'tip_percentage': tip_percentage,
+            'big_tip'       : tip_percentage > (high_tip * 100)
+        }, index=df.index)
 
     def feature_dtype(self):
         """
@@ -169,5 +244,5 @@ class TipFeature(FeatureEngineer):
             'total_tip'     : np.float32,
             'total_fare'    : np.float32,
             'tip_percentage': np.float32,
-            'big_tip'       : np.bool
+            'big_tip'       : np.bool_
         }
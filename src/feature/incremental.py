@@ -0,0 +1,281 @@
+"""
+This file contains the incremental materialization of the features, one (year, month) partition at a time.
+"""
+import hashlib
+import inspect
+import json
+from typing import Callable, Dict, List, Tuple
+import numpy as np
+import pandas as pd
+from src.dataset.catalog import DATA_DIR
+from src.dataset.columnar import to_parquet_bytes, read_parquet
+from src.dataset.storage import Storage, PreconditionFailed, get_storage
+from src.feature.executor import FeatureExecutor
+from src.feature.feature_selection import FeatureEngineer
+
+STAGE = 'features/partitions'
+STATE_NAME = '_state.json'
+
+# Attempts to update the state that is concurrently updated by another writer
+MAX_ATTEMPTS = 10
+
+
+def feature_fingerprint(feature: FeatureEngineer) -> str:
+    """
+    Fingerprint of the definition of a feature: the source code of its class and base classes, its inputs, its dtypes and
+    its optional `version` attribute. Any change of the code that generates the feature changes the fingerprint.
+
+    Args:
+        feature (FeatureEngineer): The feature.
+
+    Returns:
+        The hexadecimal fingerprint.
+    """
+    digest = hashlib.sha256()
+
+    for cls in type(feature).__mro__:
+        if cls.__module__ in ('builtins', 'abc'):
+            continue
+        try:
+            digest.update(inspect.getsource(cls).encode('utf-8'))
+        except (OSError, TypeError):
+            digest.update(cls.__qualname__.encode('utf-8'))
+
+    definition = {
+        'feature_name': feature.feature_name,
+        'column_name' : list(feature.column_name),
+        'dtypes'      : {column: np.dtype(dtype).name for column, dtype in feature.feature_dtype().items()},
+        'version'     : getattr(feature, 'version', None)
+    }
+    digest.update(json.dumps(definition, sort_keys=True).encode('utf-8'))
+
+    return digest.hexdigest()
+
+
+def partition_fingerprint(df: pd.DataFrame) -> str:
+    """
+    Fingerprint of the content of a source partition, independent of the order of the rows.
+
+    Args:
+        df (pd.DataFrame): The source data of the partition.
+
+    Returns:
+        The hexadecimal fingerprint.
+    """
+    rows = pd.util.hash_pandas_object(df, index=False).to_numpy()
+
+    digest = hashlib.sha256()
+    digest.update(json.dumps([str(column) for column in df.columns]).encode('utf-8'))
+    digest.update(np.sort(rows).tobytes())
+
+    return digest.hexdigest()
+
+
+class IncrementalFeatureStore:
+    """
+    Stores the features per partition along with the fingerprint of the source partition and of every feature.
+    Refreshing the store only recomputes the partitions whose source or feature definitions changed.
+
+    The state lives at data/features/partitions/_state.json and looks like
+
+        {"2020-01": {"source": "<fingerprint>", "features": {"trip": "<fingerprint>", ...}, "path": "...", "rows": 6405008}}
+    """
+
+    def __init__(self, features: List[FeatureEngineer], passthrough: List[str] = None, storage: Storage = None,
+                 stage: str = STAGE):
+        """
+        Initialize the store.
+
+        Args:
+            features (List[FeatureEngineer]): The features to materialize.
+            passthrough (List[str]): Source columns stored along with the features (e.g. the pickup time).
+            storage (Storage): The storage backend, defaults to get_storage().
+            stage (str): The stage the partitions are stored in.
+        """
+        self.executor = FeatureExecutor(features)
+        self.passthrough = passthrough or []
+        self.storage = storage or get_storage()
+        self.stage = stage
+        self.fingerprints = {feature.feature_name: feature_fingerprint(feature) for feature in features}
+        self._planned = {}
+
+    @property
+    def source_columns(self) -> List[str]:
+        """
+        The source columns needed to compute a partition.
+        """
+        return self.executor.source_columns + [column for column in self.passthrough if column not in self.executor.source_columns]
+
+    @property
+    def state_path(self) -> str:
+        return f'{DATA_DIR}/{self.stage}/{STATE_NAME}'
+
+    def partition_path(self, partition: str) -> str:
+        return f'{DATA_DIR}/{self.stage}/{partition}.parquet'
+
+    def load_state(self) -> dict:
+        """
+        Returns the state of the store.
+        """
+        data, _ = self.storage.read_versioned(self.state_path)
+        return json.loads(data) if data is not None else {}
+
+    def partition_fingerprints(self, partition: str, source_fingerprints: Dict[str, str]) -> Dict[str, str]:
+        """
+        Returns the fingerprints of the features of a partition. The output of some features also depends on other
+        partitions, e.g. ZoneFeature encodes a month with the aggregates of the previous months: their optional
+        `partition_version(partition, source_fingerprints)` is part of their fingerprint, so the partition is computed
+        again when one of those partitions changes.
+
+        Args:
+            partition (str): The partition (e.g. '2020-01').
+            source_fingerprints (Dict[str, str]): The current fingerprint of every source partition.
+
+        Returns:
+            The fingerprint of every feature.
+        """
+        fingerprints = dict(self.fingerprints)
+
+        for feature in self.executor.features:
+            partition_version = getattr(feature, 'partition_version', None)
+            version = partition_version(partition, source_fingerprints) if partition_version is not None else None
+            if version is not None:
+                digest = hashlib.sha256(f'{fingerprints[feature.feature_name]}:{version}'.encode('utf-8'))
+                fingerprints[feature.feature_name] = digest.hexdigest()
+
+        return fingerprints
+
+    def plan(self, source_fingerprints: Dict[str, str]) -> List[str]:
+        """
+        Returns the partitions that must be computed: new partitions, partitions whose source changed and partitions
+        computed with another definition of the features.
+
+        Args:
+            source_fingerprints (Dict[str, str]): The current fingerprint of every source partition (e.g. '2020-01').
+
+        Returns:
+            The sorted partitions to compute.
+        """
+        state = self.load_state()
+        stale = []
+
+        for partition, fingerprint in source_fingerprints.items():
+            entry = state.get(partition)
+            fingerprints = self.partition_fingerprints(partition, source_fingerprints)
+            if entry is None or entry['source'] != fingerprint or entry['features'] != fingerprints:
+                stale.append(partition)
+                self._planned[partition] = fingerprints
+
+        return sorted(stale)
+
+    def compute(self, partition: str, df: pd.DataFrame, source_fingerprint: str = None) -> Tuple[pd.DataFrame, dict]:
+        """
+        Computes and stores the features of one partition, without marking the partition as computed: commit() the
+        returned entry once the features are written everywhere they go, so a failed write computes the partition again.
+
+        Args:
+            partition (str): The partition (e.g. '2020-01').
+            df (pd.DataFrame): The source data of the partition.
+            source_fingerprint (str): The fingerprint of the source partition, computed from df if not given.
+
+        Returns:
+            The features of the partition and its state entry.
+        """
+        if source_fingerprint is None:
+            source_fingerprint = partition_fingerprint(df[self.source_columns])
+
+        features = self.executor.run(df, passthrough=self.passthrough)
+
+        data, _ = to_parquet_bytes(features)
+        path = self.storage.write_bytes(self.partition_path(partition), data)
+
+        # the fingerprints of a planned partition depend on the other source partitions
+        fingerprints = self._planned.pop(partition, None) or self.partition_fingerprints(partition, {partition: source_fingerprint})
+
+        entry = {'source': source_fingerprint, 'features': fingerprints, 'path': path, 'rows': len(features)}
+
+        return features, entry
+
+    def commit(self, partition: str, entry: dict):
+        """
+        Marks a partition returned by compute() as computed.
+
+        Args:
+            partition (str): The partition (e.g. '2020-01').
+            entry (dict): The state entry returned by compute().
+        """
+        self._update_state(partition, entry)
+
+    def materialize(self, partition: str, df: pd.DataFrame, source_fingerprint: str = None) -> pd.DataFrame:
+        """
+        Computes, stores and commits the features of one partition.
+
+        Args:
+            partition (str): The partition (e.g. '2020-01').
+            df (pd.DataFrame): The source data of the partition.
+            source_fingerprint (str): The fingerprint of the source partition, computed from df if not given.
+
+        Returns:
+            The features of the partition.
+        """
+        features, entry = self.compute(partition, df, source_fingerprint)
+        self.commit(partition, entry)
+
+        return features
+
+    def refresh(self, source_fingerprints: Dict[str, str], load: Callable[[str, List[str]], pd.DataFrame]) -> List[str]:
+        """
+        Computes the partitions returned by plan().
+
+        Args:
+            source_fingerprints (Dict[str, str]): The current fingerprint of every source partition.
+            load (Callable): Function of a partition and the source columns that returns the source data of the partition.
+
+        Returns:
+            The computed partitions.
+        """
+        partitions = self.plan(source_fingerprints)
+
+        for partition in partitions:
+            self.materialize(partition, load(partition, self.source_columns), source_fingerprints[partition])
+
+        return partitions
+
+    def read(self, partitions: List[str] = None, columns: List[str] = None) -> pd.DataFrame:
+        """
+        Reads the stored features.
+
+        Args:
+            partitions (List[str]): The partitions to read, defaults to every stored partition.
+            columns (List[str]): The columns to read, defaults to every column.
+
+        Returns:
+            The features of the partitions.
+        """
+        state = self.load_state()
+        partitions = sorted(state) if partitions is None else partitions
+
+        frames = []
+        for partition in partitions:
+            with self.storage.open(state[partition]['path'], 'rb') as file:
+                frames.append(read_parquet(file, columns=columns))
+
+        return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=columns)
+
+    def _update_state(self, partition: str, entry: dict):
+        """
+        Sets the entry of a partition with a compare-and-swap on the state, so concurrent writers do not lose entries.
+        """
+        for _ in range(MAX_ATTEMPTS):
+            data, generation = self.storage.read_versioned(self.state_path)
+            state = json.loads(data) if data is not None else {}
+            state[partition] = entry
+
+            try:
+                self.storage.write_if_generation(self.state_path, json.dumps(state, indent=2, sort_keys=True).encode('utf-8'),
+                                                 generation, content_type='application/json')
+                return
+            except PreconditionFailed:
+                continue
+
+        raise RuntimeError(f'Could not update the state of stage {self.stage} after {MAX_ATTEMPTS} attempts.')
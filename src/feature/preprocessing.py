@@ -1,7 +1,13 @@
+from typing import Any, Callable, Dict, List, Tuple
+import numpy as np
 import pandas as pd
-import calendar
+from src.monitoring.profiler import profile, stage
 
+NAT = np.iinfo(np.int64).min
+INCLUSIVE = ('both', 'neither', 'left', 'right')
 
+
+@profile('clean.remove_rows_with_missing_values')
 def remove_rows_with_missing_values(df: pd.DataFrame) -> pd.DataFrame:
     """
     This function removes rows with missing values.
@@ -9,6 +15,7 @@ def remove_rows_with_missing_values(df: pd.DataFrame) -> pd.DataFrame:
     return df.dropna()
 
 
+@profile('clean.remove_fare_amount_with_zero_values')
 def remove_fare_amount_with_zero_values(df: pd.DataFrame) -> pd.DataFrame:
     """
     This function removes rows with zero values.
@@ -16,6 +23,7 @@ def remove_fare_amount_with_zero_values(df: pd.DataFrame) -> pd.DataFrame:
     return df.loc[df['fare_amount'] > 0.0]
 
 
+@profile('clean.remove_trip_distance_with_zero_values')
 def remove_trip_distance_with_zero_values(df: pd.DataFrame) -> pd.DataFrame:
     """
     This function removes rows with zero values.
@@ -23,15 +31,194 @@ def remove_trip_distance_with_zero_values(df: pd.DataFrame) -> pd.DataFrame:
     return df.loc[df['trip_distance'] > 0.0]
 
 
-def remove_out_of_range_data(df: pd.DataFrame, year: str = None, month: str = None) -> pd.DataFrame:
+@profile('clean.remove_out_of_range_data')
+def remove_out_of_range_data(df: pd.DataFrame, year: str = None, month: str = None, columns: List[str] = None,
+                             inclusive: str = 'left', tz: str = None) -> pd.DataFrame:
+    """
+    This function removes rows with values out of the date range of the month.
+    """
+    return df.loc[out_of_range_mask(df, year, month, columns, inclusive, tz)]
+
+
+def missing_values_mask(df: pd.DataFrame) -> np.ndarray:
+    """
+    This function returns True for the rows without missing values.
+    """
+    mask = np.ones(len(df), dtype=bool)
+    for column in df.columns:
+        mask &= df[column].notna().to_numpy()
+    return mask
+
+
+def positive_values_mask(df: pd.DataFrame, column: str) -> np.ndarray:
+    """
+    This function returns True for the rows with a value greater than zero in the given column.
+    """
+    return df[column].gt(0.0).to_numpy(dtype=bool, na_value=False)
+
+
+def out_of_range_mask(df: pd.DataFrame, year: str = None, month: str = None, columns: List[str] = None,
+                      inclusive: str = 'left', tz: str = None) -> np.ndarray:
+    """
+    This function returns True for the rows within the date range of the month, from the first day at midnight
+    to the first day of the next month at midnight.
+
+    Args:
+        df: The data to filter.
+        year: The year of the range.
+        month: The month of the range.
+        columns: The datetime columns that must be in range, defaults to the dropoff time.
+        inclusive: Which bounds are included, one of 'both', 'neither', 'left' or 'right'.
+        tz: The timezone of the bounds, see datetime_range_mask.
+    """
+    start = pd.Timestamp(year=int(year), month=int(month), day=1)
+    end = start + pd.offsets.MonthBegin(1)
+
+    return datetime_range_mask(df, columns or ['tpep_dropoff_datetime'], start, end, inclusive, tz)
+
+
+def datetime_range_mask(df: pd.DataFrame, columns: List[str], start: Any = None, end: Any = None, inclusive: str = 'left',
+                        tz: str = None) -> np.ndarray:
+    """
+    This function returns True for the rows whose datetime columns are all between start and end.
+
+    The comparison runs on the int64 representation of the datetime64 columns, no value is converted to a string
+    or to a Python object. Missing values are never in range.
+
+    Args:
+        df: The data to filter.
+        columns: The datetime columns that must be in range (e.g. pickup and dropoff time).
+        start: The lower bound, None for no lower bound.
+        end: The upper bound, None for no upper bound.
+        inclusive: Which bounds are included, one of 'both', 'neither', 'left' or 'right'.
+        tz: The timezone of naive bounds. Naive columns are taken as wall times in this timezone,
+            timezone aware columns are compared on the same instant.
+
+    Returns:
+        The boolean mask of the rows in range.
+    """
+    assert inclusive in INCLUSIVE, f'Inclusive must be one of {INCLUSIVE}'
+
+    mask = np.ones(len(df), dtype=bool)
+
+    for column in columns:
+        series = df[column]
+        values = series.values
+        assert np.issubdtype(values.dtype, np.datetime64), f'Column {column} must be a datetime column.'
+
+        column_tz = getattr(series.dtype, 'tz', None)
+        dtype = values.dtype
+        values = values.view('i8')
+
+        mask &= values != NAT
+
+        if start is not None:
+            bound = _to_int64_bound(start, dtype, column_tz, tz)
+            mask &= values >= bound if inclusive in ('both', 'left') else values > bound
+
+        if end is not None:
+            bound = _to_int64_bound(end, dtype, column_tz, tz)
+            mask &= values <= bound if inclusive in ('both', 'right') else values < bound
+
+    return mask
+
+
+def _to_int64_bound(bound: Any, dtype: np.dtype, column_tz: Any, tz: str = None) -> int:
+    """
+    This function converts a bound to the int64 representation of the column it is compared with.
+    """
+    bound = pd.Timestamp(bound)
+
+    if bound.tzinfo is None and (tz is not None or column_tz is not None):
+        bound = bound.tz_localize(tz or column_tz)
+
+    if column_tz is None and bound.tzinfo is not None:
+        # naive columns hold wall times in tz (or UTC)
+        bound = bound.tz_convert(tz or 'UTC').tz_localize(None)
+    elif column_tz is not None:
+        # aware columns hold UTC instants
+        bound = bound.tz_convert('UTC').tz_localize(None)
+
+    return int(np.datetime64(bound.to_datetime64()).astype(dtype).view('i8'))
+
+
+class CleaningPipeline:
     """
-    This function removes rows with values out of date range. (date range is workdays)
+    Declarative filter pipeline. Every rule returns a boolean mask of the rows to keep, the masks are combined
+    into one and the frame is filtered once, instead of materializing a filtered copy per rule.
     """
-    start, end = calendar.monthrange(int(year), int(month))
-    start_day = f'{year}-{month}-{start:02d}'
-    end_day = f'{year}-{month}-{end:02d}'
 
-    df = df[df['tpep_dropoff_datetime'].astype('str') >= start_day]
-    df = df[df['tpep_dropoff_datetime'].astype('str') <= end_day]
+    def __init__(self):
+        """
+        Initialize the pipeline without rules.
+        """
+        self.rules = {}
+
+    def register(self, name: str, rule: Callable[..., np.ndarray], **kwargs) -> 'CleaningPipeline':
+        """
+        Register a rule.
+
+        Args:
+            name (str): The name of the rule in the report.
+            rule (Callable): Function of the frame (and kwargs) returning True for the rows to keep.
+            kwargs: Additional arguments of the rule.
 
-    return df
+        Returns:
+            The pipeline, so that registrations can be chained.
+        """
+        assert name not in self.rules, f'Rule {name} is already registered.'
+        self.rules[name] = (rule, kwargs)
+        return self
+
+    def mask(self, df: pd.DataFrame) -> Tuple[np.ndarray, Dict[str, int]]:
+        """
+        Evaluate every rule on the frame.
+
+        Args:
+            df (pd.DataFrame): The data to clean.
+
+        Returns:
+            The combined mask of the rows to keep and the number of rows rejected by each rule.
+        """
+        keep = np.ones(len(df), dtype=bool)
+        rejected = {}
+
+        for name, (rule, kwargs) in self.rules.items():
+            with stage(f'clean.{name}', rows_in=len(df)) as record:
+                mask = np.asarray(rule(df, **kwargs), dtype=bool)
+                rejected[name] = int(len(mask) - np.count_nonzero(mask))
+                record.record(rows_out=len(mask) - rejected[name])
+            keep &= mask
+
+        return keep, rejected
+
+    @profile('clean.apply')
+    def apply(self, df: pd.DataFrame) -> Tuple[pd.DataFrame, dict]:
+        """
+        Clean the frame.
+
+        Args:
+            df (pd.DataFrame): The data to clean.
+
+        Returns:
+            The cleaned data and the report with the rows in, the rows out and the rows rejected by each rule.
+            A row rejected by several rules is counted for each of them.
+        """
+        keep, rejected = self.mask(df)
+        rows_out = int(np.count_nonzero(keep))
+
+        if rows_out < len(df):
+            df = df.take(np.flatnonzero(keep))
+
+        return df, {'rows_in': len(keep), 'rows_out': rows_out, 'rejected': rejected}
+
+
+def get_cleaning_pipeline(year: str, month: str) -> CleaningPipeline:
+    """
+    This function returns the pipeline with the cleaning rules of main/preprocess.py.
+    """
+    return CleaningPipeline() \
+        .register('missing_values', missing_values_mask) \
+        .register('fare_amount', positive_values_mask, column='fare_amount') \
+        .register('trip_distance', positive_values_mask, column='trip_distance') \
+        .register('out_of_range', out_of_range_mask, year=year, month=month)
@@ -0,0 +1,236 @@
+"""
+This file contains the sliding-window engine of the trips of a zone over the last minutes, and the rolling features.
+"""
+from typing import Callable, Dict, Optional, Tuple
+import numpy as np
+import pandas as pd
+from src.feature.feature_selection import FeatureEngineer
+from src.feature.spatial import HIGH_TIP, zone_index
+
+# Window lengths in minutes
+WINDOWS = (15, 60)
+
+# Events older than the latest event minus the lateness are final, later events in the past are late
+LATENESS = pd.Timedelta(minutes=30)
+
+# Zone and time of an event in one sortable int64: zone * 2 ** 33 + seconds since the epoch (until year 2242)
+ZONE_SHIFT = 2 ** 33
+
+# Per-event arrays of the state
+FIELDS = ['key', 'seconds', 'fare', 'fare_valid', 'big_tip', 'tip_valid', 'label']
+
+
+def _concat(*events: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    return {field: np.concatenate([event[field] for event in events]) for field in FIELDS}
+
+
+def _take(events: Dict[str, np.ndarray], mask: np.ndarray) -> Dict[str, np.ndarray]:
+    return {field: values[mask] for field, values in events.items()}
+
+
+def _empty() -> Dict[str, np.ndarray]:
+    return {field: np.empty(0, dtype=np.float64 if field in ('fare', 'big_tip') else np.int64) for field in FIELDS}
+
+
+class SlidingWindowEngine:
+    """
+    Counts, per pickup zone, the trips picked up in the last 15 and 60 minutes before every trip, with their mean fare
+    and big tip rate. The window of a trip at time t is [t - window, t): only trips strictly before it, so a trip never
+    sees itself or the trips picked up at the same second.
+
+    The trips arrive in chunks, in any order within the allowed lateness. A trip is final once the latest pickup time
+    seen is more than `lateness` after it: every trip of its window has then arrived. Final trips are scored in one
+    vectorized pass: the trips are sorted on a (zone, time) composite key, and the window of every trip is two
+    np.searchsorted over the keys and a difference of cumulative sums. Between chunks the engine only keeps the trips
+    that are not final yet and the final trips of the longest window, so memory is bounded whatever the stream length.
+
+    Trips arriving after they would have been final are late: they are scored against the trips still kept and added
+    to the windows of the following trips, and counted in `late`.
+    """
+
+    def __init__(self, windows: Tuple[int, ...] = WINDOWS, lateness: pd.Timedelta = LATENESS,
+                 zone_column: str = 'PULocationID', time_column: str = 'tpep_pickup_datetime'):
+        """
+        Initialize the engine.
+
+        Args:
+            windows (Tuple[int, ...]): The window lengths in minutes.
+            lateness (pd.Timedelta): How long a trip may arrive after later trips.
+            zone_column (str): The zone the trips are grouped by.
+            time_column (str): The time of the trips.
+        """
+        self.windows = tuple(windows)
+        self.lateness = int(pd.Timedelta(lateness).total_seconds())
+        self.zone_column = zone_column
+        self.time_column = time_column
+
+        self.history = _empty()
+        self.pending = _empty()
+        self.watermark = None
+        self.late = 0
+
+    @property
+    def columns(self) -> Dict[str, type]:
+        """
+        The generated columns and their dtypes.
+        """
+        dtypes = {}
+        for window in self.windows:
+            dtypes[f'zone_trips_{window}m'] = np.int32
+            dtypes[f'zone_fare_{window}m'] = np.float32
+            dtypes[f'zone_tip_rate_{window}m'] = np.float32
+        return dtypes
+
+    def _events(self, df: pd.DataFrame) -> Dict[str, np.ndarray]:
+        """
+        The arrays of the trips of a chunk.
+        """
+        seconds = df[self.time_column].to_numpy(dtype='datetime64[s]').astype(np.int64)
+        fare = df['fare_amount'].to_numpy(dtype=np.float64, na_value=np.nan)
+        tip = df['tip_amount'].to_numpy(dtype=np.float64, na_value=np.nan)
+
+        fare_valid = np.isfinite(fare)
+        tip_valid = fare_valid & np.isfinite(tip) & (fare > 0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            big_tip = np.where(tip_valid, tip / fare > HIGH_TIP, 0).astype(np.float64)
+
+        return {
+            'key'       : zone_index(df[self.zone_column]).astype(np.int64) * ZONE_SHIFT + seconds,
+            'seconds'   : seconds,
+            'fare'      : np.where(fare_valid, fare, 0.0),
+            'fare_valid': fare_valid.astype(np.int64),
+            'big_tip'   : big_tip,
+            'tip_valid' : tip_valid.astype(np.int64),
+            'label'     : df.index.to_numpy()
+        }
+
+    def process(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Adds a chunk of trips and returns the features of the trips that became final.
+
+        Args:
+            df (pd.DataFrame): Trips with the zone, the pickup time, the fare and the tip.
+
+        Returns:
+            The features of the final trips, indexed by the labels of their rows.
+        """
+        events = self._events(df)
+        if len(df) == 0:
+            return self._frame(_empty(), {})
+
+        late = events['seconds'] < self.watermark if self.watermark is not None else np.zeros(len(df), dtype=bool)
+        self.late += int(late.sum())
+
+        latest = int(events['seconds'].max())
+        if self.watermark is None or latest - self.lateness > self.watermark:
+            self.watermark = latest - self.lateness
+
+        pending = _concat(self.pending, _take(events, ~late))
+        ready = pending['seconds'] <= self.watermark
+        self.pending = _take(pending, ~ready)
+
+        return self._emit(_concat(_take(pending, ready), _take(events, late)))
+
+    def flush(self) -> pd.DataFrame:
+        """
+        Returns the features of every trip not emitted yet, at the end of the stream.
+        """
+        pending, self.pending = self.pending, _empty()
+        if len(pending['key']):
+            self.watermark = max(self.watermark, int(pending['seconds'].max()))
+        return self._emit(pending)
+
+    def _emit(self, ready: Dict[str, np.ndarray]) -> pd.DataFrame:
+        """
+        Computes the windows of the final trips and keeps the trips the next windows need.
+        """
+        events = _concat(self.history, ready)
+        order = np.argsort(events['key'], kind='stable')
+        events = _take(events, order)
+        keys = events['key']
+
+        sums = {}
+        for field in ['fare', 'fare_valid', 'big_tip', 'tip_valid']:
+            sums[field] = np.concatenate([[0], np.cumsum(events[field])])
+
+        # the window [t - window, t) of a trip is [lo, hi) in the sorted keys
+        hi = np.searchsorted(keys, ready['key'], side='left')
+        features = {}
+        for window in self.windows:
+            lo = np.searchsorted(keys, ready['key'] - window * 60, side='left')
+            fares, tips = sums['fare_valid'][hi] - sums['fare_valid'][lo], sums['tip_valid'][hi] - sums['tip_valid'][lo]
+
+            with np.errstate(divide='ignore', invalid='ignore'):
+                features[f'zone_trips_{window}m'] = hi - lo
+                features[f'zone_fare_{window}m'] = np.where(fares > 0, (sums['fare'][hi] - sums['fare'][lo]) / fares, 0.0)
+                features[f'zone_tip_rate_{window}m'] = np.where(tips > 0, (sums['big_tip'][hi] - sums['big_tip'][lo]) / tips, 0.0)
+
+        # the trips older than the longest window of the next final trip are not needed anymore
+        if self.watermark is not None:
+            self.history = _take(events, events['seconds'] >= self.watermark - max(self.windows) * 60)
+
+        return self._frame(ready, features)
+
+    def _frame(self, ready: Dict[str, np.ndarray], features: Dict[str, np.ndarray]) -> pd.DataFrame:
+        """
+        The features of the emitted trips, indexed by the labels of their rows.
+        """
+        frame = pd.DataFrame({column: features.get(column, np.empty(0)) for column in self.columns}, index=ready['label'])
+        return frame.astype(self.columns, copy=False)
+
+
+class RollingFeature(FeatureEngineer):
+    """
+    This class generates the trips per pickup zone over the last 15 and 60 minutes, with their mean fare and big tip
+    rate. The windows of the first trips of a frame see the trips before it returned by `lookback`, e.g. the end of the
+    previous month partition; without lookback they only see the trips of the frame.
+    """
+
+    def __init__(self, windows: Tuple[int, ...] = WINDOWS,
+                 lookback: Callable[[pd.Timestamp, pd.Timestamp], pd.DataFrame] = None):
+        """
+        Initialize the class.
+
+        Args:
+            windows (Tuple[int, ...]): The window lengths in minutes.
+            lookback (Callable): Function of a range [start, end) returning the trips picked up in it, with the columns
+                of column_name.
+        """
+        super().__init__('rolling', ['PULocationID', 'tpep_pickup_datetime', 'fare_amount', 'tip_amount'])
+        self.windows = tuple(windows)
+        self.lookback = lookback
+
+    def partition_version(self, partition: str, source_fingerprints: Dict[str, str]) -> Optional[str]:
+        """
+        The windows of the first trips of a month see the end of the previous month, see
+        IncrementalFeatureStore.partition_fingerprints.
+        """
+        if self.lookback is None:
+            return None
+        return source_fingerprints.get(str(pd.Period(partition, freq='M') - 1))
+
+    def generate_feature(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Generate the feature.
+        """
+        engine = SlidingWindowEngine(self.windows)
+
+        # the rows are labelled by position, the index of df may have duplicates
+        trips = df[self.column_name].reset_index(drop=True)
+        rows = len(trips)
+
+        start = trips['tpep_pickup_datetime'].min()
+        if self.lookback is not None and not pd.isna(start):
+            # the trips of the longest window before the frame, labelled after its rows and dropped from the features
+            history = self.lookback(start - pd.Timedelta(minutes=max(self.windows)), start)[self.column_name]
+            trips = pd.concat([trips, history.set_axis(pd.RangeIndex(rows, rows + len(history)), axis=0)])
+
+        features = pd.concat([engine.process(trips), engine.flush()])
+        features = features[features.index < rows].sort_index()
+        return features.set_axis(df.index, axis=0)
+
+    def feature_dtype(self):
+        """
+        indicates the dtype of the feature
+        """
+        return SlidingWindowEngine(self.windows).columns
@@ -0,0 +1,408 @@
+"""
+This file contains the per-zone and per origin-destination aggregates of the trips and the target encoded zone features.
+"""
+import hashlib
+import io
+import json
+from typing import Callable, Dict, List, Optional, Tuple, Union
+import numpy as np
+import pandas as pd
+from src.dataset.catalog import DATA_DIR
+from src.dataset.storage import PreconditionFailed, Storage, get_storage
+from src.feature.feature_selection import FeatureEngineer
+
+# TLC taxi zones are numbered 1 to 265, index 0 collects missing and unknown zones
+NUM_ZONES = 266
+
+# Statistics of the aggregates, averaged per zone or pair of zones
+TARGETS = ['big_tip', 'fare_amount', 'speed']
+
+# Number of trips of prior weight in the smoothed means, zones with fewer trips are pulled towards the global mean
+SMOOTHING = 100.0
+
+# A tip is big above this share of the fare, as in TipFeature
+HIGH_TIP = 0.25
+
+# Zone groupings of the aggregates and the size of their arrays
+GROUPS = {'pickup': NUM_ZONES, 'dropoff': NUM_ZONES, 'od': NUM_ZONES * NUM_ZONES}
+
+# Source columns of the aggregates
+AGGREGATE_COLUMNS = ['PULocationID', 'DOLocationID', 'tpep_pickup_datetime', 'tpep_dropoff_datetime', 'trip_distance',
+                     'fare_amount', 'tip_amount']
+
+# Stage of the aggregates of every month partition
+STAGE = 'features/zones'
+STATE_NAME = '_state.json'
+
+# Attempts to update the state that is concurrently updated by another writer
+MAX_ATTEMPTS = 10
+
+
+def zone_index(values: pd.Series) -> np.ndarray:
+    """
+    Returns the zone IDs as array indices, missing and out of range IDs are 0.
+    """
+    zones = values.to_numpy(dtype=np.float64, na_value=0)
+    zones = np.where((zones >= 1) & (zones < NUM_ZONES), zones, 0)
+    return zones.astype(np.intp)
+
+
+class ZoneAggregator:
+    """
+    Sums of the targets and trip counts per pickup zone, per dropoff zone and per (pickup, dropoff) pair, stored as dense
+    arrays indexed by zone ID (the pairs on a flattened 266 x 266 grid). Every update is a np.bincount, aggregators of
+    different month partitions merge by adding their arrays, and the encoded features are array lookups.
+    """
+
+    def __init__(self, smoothing: float = SMOOTHING):
+        """
+        Initialize empty aggregates.
+
+        Args:
+            smoothing (float): The prior weight, in trips, of the global mean in the smoothed means.
+        """
+        self.smoothing = smoothing
+        self.counts = {group: np.zeros(size, dtype=np.int64) for group, size in GROUPS.items()}
+        self.sums = {(group, target): np.zeros(size, dtype=np.float64) for group, size in GROUPS.items() for target in TARGETS}
+        # trips with a valid value of the target, e.g. a zero fare has no tip rate
+        self.valid = {(group, target): np.zeros(size, dtype=np.int64) for group, size in GROUPS.items() for target in TARGETS}
+        self._tables = None
+
+    @staticmethod
+    def targets(df: pd.DataFrame) -> Dict[str, Tuple[np.ndarray, np.ndarray]]:
+        """
+        Returns the value and the validity mask of every target of the trips.
+        """
+        fare = df['fare_amount'].to_numpy(dtype=np.float64, na_value=np.nan)
+        tip = df['tip_amount'].to_numpy(dtype=np.float64, na_value=np.nan)
+        distance = df['trip_distance'].to_numpy(dtype=np.float64, na_value=np.nan)
+        hours = (df['tpep_dropoff_datetime'] - df['tpep_pickup_datetime']).dt.total_seconds().to_numpy() / 3600
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            big_tip = (tip / fare > HIGH_TIP).astype(np.float64)
+            speed = distance / hours
+
+        return {
+            'big_tip'    : (big_tip, np.isfinite(tip) & np.isfinite(fare) & (fare > 0)),
+            'fare_amount': (fare, np.isfinite(fare)),
+            'speed'      : (speed, np.isfinite(speed) & (hours > 0))
+        }
+
+    def update(self, df: pd.DataFrame) -> 'ZoneAggregator':
+        """
+        Adds trips to the aggregates.
+
+        Args:
+            df (pd.DataFrame): Trips with the zones, times, distance, fare and tip.
+
+        Returns:
+            self
+        """
+        pickup, dropoff = zone_index(df['PULocationID']), zone_index(df['DOLocationID'])
+        keys = {'pickup': pickup, 'dropoff': dropoff, 'od': pickup * NUM_ZONES + dropoff}
+        targets = self.targets(df)
+
+        for group, key in keys.items():
+            size = GROUPS[group]
+            self.counts[group] += np.bincount(key, minlength=size)
+            for target, (values, valid) in targets.items():
+                self.sums[group, target] += np.bincount(key[valid], weights=values[valid], minlength=size)
+                self.valid[group, target] += np.bincount(key[valid], minlength=size)
+
+        self._tables = None
+        return self
+
+    def merge(self, other: 'ZoneAggregator') -> 'ZoneAggregator':
+        """
+        Adds the aggregates of another partition.
+
+        Args:
+            other (ZoneAggregator): The aggregates of other trips.
+
+        Returns:
+            self
+        """
+        for group in GROUPS:
+            self.counts[group] += other.counts[group]
+        for key in self.sums:
+            self.sums[key] += other.sums[key]
+            self.valid[key] += other.valid[key]
+        self._tables = None
+        return self
+
+    def __add__(self, other: 'ZoneAggregator') -> 'ZoneAggregator':
+        return ZoneAggregator(self.smoothing).merge(self).merge(other)
+
+    @property
+    def trips(self) -> int:
+        return int(self.counts['pickup'].sum())
+
+    def global_mean(self, target: str) -> float:
+        """
+        The mean of a target over every trip with a valid value.
+        """
+        valid = self.valid['pickup', target].sum()
+        return float(self.sums['pickup', target].sum() / valid) if valid else 0.0
+
+    def tables(self) -> Dict[Tuple[str, str], np.ndarray]:
+        """
+        The smoothed mean of every target per zone or pair of zones,
+
+            (sum + smoothing * global mean) / (valid count + smoothing)
+
+        computed once per version of the aggregates, in float32.
+        """
+        if self._tables is None:
+            tables = {}
+            for (group, target), sums in self.sums.items():
+                prior = self.global_mean(target)
+                valid = self.valid[group, target]
+                tables[group, target] = ((sums + self.smoothing * prior) / (valid + self.smoothing)).astype(np.float32)
+            self._tables = tables
+        return self._tables
+
+    def encode(self, pickup: np.ndarray, dropoff: np.ndarray) -> Dict[str, np.ndarray]:
+        """
+        Looks up the smoothed means of the zones of every trip.
+
+        Args:
+            pickup (np.ndarray): The pickup zone indices (see zone_index).
+            dropoff (np.ndarray): The dropoff zone indices.
+
+        Returns:
+            One float32 array per feature, e.g. 'pu_big_tip', 'do_fare_amount', 'od_speed'.
+        """
+        tables = self.tables()
+        keys = {'pu': ('pickup', pickup), 'do': ('dropoff', dropoff), 'od': ('od', pickup * NUM_ZONES + dropoff)}
+
+        return {f'{prefix}_{target}': tables[group, target][key] for prefix, (group, key) in keys.items() for target in TARGETS}
+
+    def fingerprint(self) -> str:
+        """
+        Fingerprint of the aggregates, changes whenever the encoded features change.
+        """
+        digest = hashlib.sha256(str(self.smoothing).encode('utf-8'))
+        for group in GROUPS:
+            digest.update(self.counts[group].tobytes())
+        for key in sorted(self.sums):
+            digest.update(self.sums[key].tobytes())
+            digest.update(self.valid[key].tobytes())
+        return digest.hexdigest()
+
+    def to_bytes(self) -> bytes:
+        """
+        The aggregates as a compressed .npz file.
+        """
+        arrays = {f'count__{group}': counts for group, counts in self.counts.items()}
+        arrays.update({f'sum__{group}__{target}': sums for (group, target), sums in self.sums.items()})
+        arrays.update({f'valid__{group}__{target}': valid for (group, target), valid in self.valid.items()})
+
+        buffer = io.BytesIO()
+        np.savez_compressed(buffer, smoothing=np.float64(self.smoothing), **arrays)
+        return buffer.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'ZoneAggregator':
+        """
+        Reads aggregates written by to_bytes.
+        """
+        with np.load(io.BytesIO(data), allow_pickle=False) as arrays:
+            aggregator = cls(float(arrays['smoothing']))
+            for group in GROUPS:
+                aggregator.counts[group] = arrays[f'count__{group}']
+            for group, target in aggregator.sums:
+                aggregator.sums[group, target] = arrays[f'sum__{group}__{target}']
+                aggregator.valid[group, target] = arrays[f'valid__{group}__{target}']
+        return aggregator
+
+    def save(self, path: str, storage: Storage = None) -> str:
+        """
+        Writes the aggregates, e.g. to data/features/zones/2020-01.npz.
+        """
+        return (storage or get_storage()).write_bytes(path, self.to_bytes())
+
+    @classmethod
+    def load(cls, path: str, storage: Storage = None) -> 'ZoneAggregator':
+        return cls.from_bytes((storage or get_storage()).read_bytes(path))
+
+
+class MonthlyZoneAggregates:
+    """
+    The aggregates of every (year, month) partition, stored at data/features/zones/<partition>.npz along with the
+    fingerprint of the source partition, so only the months whose source changed are aggregated again. A month is
+    encoded with the sum of the aggregates of the months before it (see prior), never with its own trips.
+
+    The state lives at data/features/zones/_state.json and looks like
+
+        {"2020-01": {"source": "<fingerprint>", "aggregates": "<fingerprint>", "path": "..."}}
+    """
+
+    def __init__(self, smoothing: float = SMOOTHING, storage: Storage = None, stage: str = STAGE):
+        """
+        Initialize the aggregates.
+
+        Args:
+            smoothing (float): The prior weight, in trips, of the global mean in the smoothed means.
+            storage (Storage): The storage backend, defaults to get_storage().
+            stage (str): The stage the aggregates are stored in.
+        """
+        self.smoothing = smoothing
+        self.storage = storage or get_storage()
+        self.stage = stage
+        self.state = self.load_state()
+        self._prior = ((), ZoneAggregator(smoothing))
+
+    @property
+    def state_path(self) -> str:
+        return f'{DATA_DIR}/{self.stage}/{STATE_NAME}'
+
+    def partition_path(self, partition: str) -> str:
+        return f'{DATA_DIR}/{self.stage}/{partition}.npz'
+
+    def load_state(self) -> dict:
+        """
+        Returns the state of the aggregates.
+        """
+        data, _ = self.storage.read_versioned(self.state_path)
+        return json.loads(data) if data is not None else {}
+
+    def refresh(self, source_fingerprints: Dict[str, str], load: Callable[[str, List[str]], pd.DataFrame]) -> List[str]:
+        """
+        Aggregates the new partitions and the partitions whose source changed.
+
+        Args:
+            source_fingerprints (Dict[str, str]): The current fingerprint of every source partition (e.g. '2020-01').
+            load (Callable): Function of a partition and the source columns that returns the source data of the partition.
+
+        Returns:
+            The sorted aggregated partitions.
+        """
+        state = self.load_state()
+        stale = sorted(partition for partition, fingerprint in source_fingerprints.items()
+                       if state.get(partition, {}).get('source') != fingerprint)
+
+        for partition in stale:
+            aggregator = ZoneAggregator(self.smoothing).update(load(partition, AGGREGATE_COLUMNS))
+            path = aggregator.save(self.partition_path(partition), self.storage)
+            entry = {'source': source_fingerprints[partition], 'aggregates': aggregator.fingerprint(), 'path': path}
+            state = self._update_state(partition, entry)
+
+        # the partitions that are no longer in the source do not count in the priors
+        self.state = {partition: state[partition] for partition in source_fingerprints if partition in state}
+        self._prior = ((), ZoneAggregator(self.smoothing))
+
+        return stale
+
+    def prior_partitions(self, partition: str) -> List[str]:
+        """
+        The sorted partitions before the given one.
+        """
+        return sorted(other for other in self.state if other < partition)
+
+    def prior_fingerprint(self, partition: str) -> str:
+        """
+        Fingerprint of the aggregates the partition is encoded with, changes whenever one of the previous months changes.
+        """
+        digest = hashlib.sha256(str(self.smoothing).encode('utf-8'))
+        for other in self.prior_partitions(partition):
+            digest.update(f'{other}:{self.state[other]["aggregates"]};'.encode('utf-8'))
+        return digest.hexdigest()
+
+    def prior(self, partition: str) -> ZoneAggregator:
+        """
+        The sum of the aggregates of the months before the partition. The partitions are usually encoded in order, the
+        last sum is kept and only the months since are added to it.
+        """
+        partitions = tuple(self.prior_partitions(partition))
+        added, aggregator = self._prior
+
+        if partitions[:len(added)] != added:
+            added, aggregator = (), ZoneAggregator(self.smoothing)
+
+        if len(partitions) > len(added):
+            # a new sum, the kept one may still be used by the features of the previous partition
+            aggregator = ZoneAggregator(self.smoothing).merge(aggregator)
+            for other in partitions[len(added):]:
+                aggregator.merge(ZoneAggregator.load(self.state[other]['path'], self.storage))
+
+        self._prior = (partitions, aggregator)
+        return aggregator
+
+    def _update_state(self, partition: str, entry: dict) -> dict:
+        """
+        Sets the entry of a partition with a compare-and-swap on the state, so concurrent writers do not lose entries.
+        """
+        for _ in range(MAX_ATTEMPTS):
+            data, generation = self.storage.read_versioned(self.state_path)
+            state = json.loads(data) if data is not None else {}
+            state[partition] = entry
+
+            try:
+                self.storage.write_if_generation(self.state_path, json.dumps(state, indent=2, sort_keys=True).encode('utf-8'),
+                                                 generation, content_type='application/json')
+                return state
+            except PreconditionFailed:
+                continue
+
+        raise RuntimeError(f'Could not update the state of stage {self.stage} after {MAX_ATTEMPTS} attempts.')
+
+
+class ZoneFeature(FeatureEngineer):
+    """
+    This class generates the target encoded features of the pickup zone, the dropoff zone and the pair of zones of a
+    trip: the smoothed big tip rate, fare and speed of the trips of the aggregates. With MonthlyZoneAggregates the trips
+    of a month are encoded with the aggregates of the months before it; a single ZoneAggregator must be fitted on months
+    before the encoded ones, so the features of a trip never include its own target.
+    """
+
+    def __init__(self, aggregator: Union[ZoneAggregator, MonthlyZoneAggregates]):
+        """
+        Initialize the class.
+        """
+        monthly = isinstance(aggregator, MonthlyZoneAggregates)
+        super().__init__('zone', ['PULocationID', 'DOLocationID'] + (['tpep_pickup_datetime'] if monthly else []))
+        self.aggregator = aggregator
+
+    @property
+    def version(self) -> Optional[str]:
+        """
+        The features change with the aggregates, see incremental.feature_fingerprint. The monthly aggregates of a
+        partition are part of its partition_version instead.
+        """
+        return None if isinstance(self.aggregator, MonthlyZoneAggregates) else self.aggregator.fingerprint()
+
+    def partition_version(self, partition: str, source_fingerprints: Dict[str, str]) -> Optional[str]:
+        """
+        The fingerprint of the aggregates a partition is encoded with, see IncrementalFeatureStore.partition_fingerprints.
+        """
+        if isinstance(self.aggregator, MonthlyZoneAggregates):
+            return self.aggregator.prior_fingerprint(partition)
+        return None
+
+    def generate_feature(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Generate the feature.
+        """
+        pickup, dropoff = zone_index(df['PULocationID']), zone_index(df['DOLocationID'])
+
+        if not isinstance(self.aggregator, MonthlyZoneAggregates):
+            return pd.DataFrame(self.aggregator.encode(pickup, dropoff), index=df.index)
+
+        # the rows are encoded month by month, a partition is a single month
+        time = df['tpep_pickup_datetime'].dt
+        months = (time.year * 100 + time.month).fillna(0).to_numpy(dtype=np.int64)
+        encoded = {column: np.empty(len(df), dtype=np.float32) for column in self.feature_dtype()}
+
+        for month in np.unique(months):
+            rows = months == month
+            aggregator = self.aggregator.prior(f'{month // 100:04d}-{month % 100:02d}')
+            for column, values in aggregator.encode(pickup[rows], dropoff[rows]).items():
+                encoded[column][rows] = values
+
+        return pd.DataFrame(encoded, index=df.index)
+
+    def feature_dtype(self):
+        """
+        indicates the dtype of the feature
+        """
+        return {f'{prefix}_{target}': np.float32 for prefix in ['pu', 'do', 'od'] for target in TARGETS}
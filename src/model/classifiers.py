@@ -1,13 +1,111 @@
+import logging
+import os
+import time
 from abc import ABC, abstractmethod
-from typing import Any, List
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Iterable, List, Union
 
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 from sklearn.naive_bayes import GaussianNB
-from sklearn.metrics import f1_score, confusion_matrix, ConfusionMatrixDisplay
+from sklearn.metrics import ConfusionMatrixDisplay
 from sklearn.model_selection import StratifiedKFold
 
+from src.model.inference import CHUNK_SIZE, CompiledGaussianNB
+from src.model.metrics import BinaryMetrics, evaluate_stream, split_chunks
+from src.model.sampling import ReservoirSampler
+from src.model.shared_memory import SharedMatrix
+from src.monitoring.profiler import profile
+
+# Data of the cross validation, set once per worker process by _init_fold_worker
+_FOLD_DATA = {}
+
+
+def _init_fold_worker(X, Y):
+    """Keep the data of the cross validation in the worker process, so the folds only send indices.
+    Shared matrices are attached to instead of copied."""
+    _FOLD_DATA['shared'] = [data for data in (X, Y) if isinstance(data, SharedMatrix)]
+    _FOLD_DATA['X'] = X.array if isinstance(X, SharedMatrix) else X
+    _FOLD_DATA['Y'] = Y.array if isinstance(Y, SharedMatrix) else Y
+
+
+def _valid_rows(values: pd.Series) -> np.ndarray:
+    """True for the rows of a column that are neither missing nor infinite."""
+    if isinstance(values.dtype, np.dtype) and values.dtype.kind == 'f':
+        return np.isfinite(values.to_numpy())
+    if isinstance(values.dtype, np.dtype) and values.dtype.kind in 'biu':
+        return np.ones(len(values), dtype=bool)
+    return values.notna().to_numpy()
+
+
+def _fit_rows(params: dict, X, Y, rows: np.ndarray, chunk_size: int = CHUNK_SIZE) -> GaussianNB:
+    """Train a new model on some rows of X, gathered chunk by chunk: only one chunk of the rows is copied at a time,
+    instead of the whole training set of a fold. The model is the one GaussianNB.fit trains on X[rows].
+    Args:
+        params: GaussianNB parameters.
+        X: features.
+        Y: labels.
+        rows: indices of the training rows.
+        chunk_size: number of rows copied at once.
+    Returns:
+        model: the trained model.
+    """
+    model = GaussianNB(**params)
+    classes = np.unique(Y)
+    for start in range(0, len(rows), chunk_size):
+        chunk = rows[start:start + chunk_size]
+        model.partial_fit(X[chunk], Y[chunk], classes=classes)
+
+    # partial_fit smooths the variances with the variance of the first chunk, fit with the variance of all the rows,
+    # which is the variance within the classes plus the variance of the class means
+    variance = model.var_ - model.epsilon_
+    mean = model.class_count_ @ model.theta_ / model.class_count_.sum()
+    total = (model.class_count_[:, None] * (variance + (model.theta_ - mean) ** 2)).sum(axis=0) / model.class_count_.sum()
+    model.epsilon_ = model.var_smoothing * total.max()
+    model.var_ = variance + model.epsilon_
+
+    return model
+
+
+def _fit_fold(params: dict, fold: int, train: np.ndarray, test: np.ndarray, X=None, Y=None,
+              chunk_size: int = CHUNK_SIZE) -> dict:
+    """Train and evaluate a new model on one fold. The rows of the fold are copied chunk by chunk, so concurrent folds
+    do not each hold a copy of X.
+    Args:
+        params: GaussianNB parameters.
+        fold: index of the fold.
+        train: indices of the training rows.
+        test: indices of the testing rows.
+        X: features, defaults to the data of the worker process.
+        Y: labels, defaults to the data of the worker process.
+        chunk_size: number of rows copied at once.
+    Returns:
+        result: metrics and timings of the fold.
+    """
+    X = _FOLD_DATA['X'] if X is None else X
+    Y = _FOLD_DATA['Y'] if Y is None else Y
+
+    start = time.perf_counter()
+    model = _fit_rows(params, X, Y, train, chunk_size)
+    fit_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    positive = list(model.classes_).index(True)
+    metrics = BinaryMetrics()
+    for begin in range(0, len(test), chunk_size):
+        chunk = test[begin:begin + chunk_size]
+        metrics.update(Y[chunk], model.predict_proba(X[chunk])[:, positive])
+    score_time = time.perf_counter() - start
+
+    return {
+        'fold'      : fold,
+        **metrics.report(),
+        'fit_time'  : fit_time,
+        'score_time': score_time,
+        'metrics'   : metrics
+    }
+
 
 class Model(ABC):
     """Abstract class for models."""
@@ -23,6 +121,15 @@ class Model(ABC):
         self.features = features
         self.params = params
         self.model = None
+        self.holdout = None
+        self.shared = None
+
+    def __getstate__(self):
+        # the holdout rows and shared matrices are training data, they are not part of a saved model
+        state = self.__dict__.copy()
+        state['holdout'] = None
+        state['shared'] = None
+        return state
 
     def preprocess(self, df: pd.DataFrame):
         """ Any model specific preprocessing that needs to be done before training the model."""
@@ -41,11 +148,66 @@ class Model(ABC):
         """Train the model."""
         pass
 
+    def partial_fit(self, X, Y, classes=None):
+        """Train the model on one more batch."""
+        raise NotImplementedError(f'{type(self).__name__} does not support incremental training.')
+
+    def fit_stream(self, batches: Iterable[Union[pd.DataFrame, tuple]], classes=None, holdout_size: int = 0,
+                   random_state: int = None) -> dict:
+        """Train the model on a stream of batches with bounded memory.
+
+        A uniform sample of `holdout_size` rows of the stream is held out of training (reservoir sampling) and used to
+        evaluate the model once the stream is consumed. Rows evicted from the reservoir are trained on with the batch that
+        evicts them, so every row of the stream is either trained or evaluated on.
+
+        Args:
+            batches: iterator of dataframes (passed to preprocess) or of (X, Y) tuples, e.g. chunks of a query result.
+            classes: all the labels of the stream, needed by the first call of partial_fit.
+            holdout_size: number of rows to hold out for evaluation, 0 to train on every row.
+            random_state: seed of the holdout sampling.
+        Returns:
+            summary: the number of trained and held out rows and the evaluation on the holdout rows.
+        """
+        sampler = ReservoirSampler(holdout_size, random_state) if holdout_size > 0 else None
+        trained = 0
+
+        # like fit, the stream trains a new model
+        self.model = None
+
+        for batch in batches:
+            X, Y = self.preprocess(batch) if isinstance(batch, pd.DataFrame) else batch
+            if len(X) == 0:
+                continue
+
+            if sampler is not None:
+                X, Y = sampler.add(X, Y)
+                if len(X) == 0:
+                    continue
+
+            self.partial_fit(X, Y, classes=classes)
+            trained += len(X)
+
+        summary = {'trained_rows': trained, 'holdout_rows': 0, 'holdout_score': None, 'holdout_metrics': None}
+
+        if sampler is not None:
+            x_holdout, y_holdout = sampler.sample
+            self.holdout = (x_holdout, y_holdout)
+            summary['holdout_rows'] = len(x_holdout)
+            if len(x_holdout) > 0 and self.model is not None:
+                summary['holdout_metrics'] = self.evaluate(x_holdout, y_holdout)
+                summary['holdout_score'] = summary['holdout_metrics']['f1']
+
+        return summary
+
     @abstractmethod
     def predict(self, X):
         """Predict the labels for the given data."""
         pass
 
+    def predict_proba(self, X):
+        """Predict the probability of every class for the given data."""
+        raise NotImplementedError(f'{type(self).__name__} does not predict probabilities.')
+
     @abstractmethod
     def evaluate(self, X, Y):
         """Evaluate the model."""
@@ -75,21 +237,62 @@ class GaussianNBModel(Model, ABC):
             features = []
         super().__init__(features, label, params)
 
-    def preprocess(self, df: pd.DataFrame) -> tuple[Any, Any]:
+    @profile('model.preprocess')
+    def preprocess(self, df: pd.DataFrame, backing: str = None, path: str = None) -> tuple[Any, Any]:
         """Preprocess the dataframe.
 
+        Rows with a missing or infinite feature or a missing label are dropped. The features are written once into a
+        C-contiguous float32 matrix, the dataframe is not modified.
+
         Args:
             df: dataframe to preprocess.
+            backing: None for a regular array, 'shm' or 'mmap' to allocate the matrix and labels as SharedMatrix (kept
+                in self.shared) that worker processes attach to. The caller frees them with unlink().
+            path: path of the .npy file of the features with the 'mmap' backing.
         Returns:
             X: features.
             Y: labels.
         """
-        df.dropna(inplace=True)
-        df = df[np.isfinite(df['trip_speed'])]  # drop rows with inf in trip_speed
-        X = df[self.features].values
-        Y = df[self.label].values
+        # combined validity mask, computed without copying the columns
+        valid = _valid_rows(df[self.label])
+        for feature in self.features:
+            valid &= _valid_rows(df[feature])
+        rows = int(np.count_nonzero(valid))
+
+        # boolean labels (including the nullable boolean dtype) take one byte per row
+        label = df[self.label]
+        if pd.api.types.is_bool_dtype(label.dtype):
+            label = label.to_numpy(dtype=np.bool_, na_value=False)
+        else:
+            label = label.to_numpy()
+        label_dtype = label.dtype
+        shape = (rows, len(self.features))
+
+        if backing is None:
+            self.shared = None
+            X = np.empty(shape, dtype=np.float32)
+            Y = np.empty(rows, dtype=label_dtype)
+        else:
+            self.shared = (SharedMatrix.create(shape, np.float32, backing, path),
+                           SharedMatrix.create((rows,), label_dtype, backing, None if path is None else f'{path[:-4]}.labels.npy'))
+            X, Y = self.shared[0].array, self.shared[1].array
+
+        for j, feature in enumerate(self.features):
+            values = df[feature]
+            if isinstance(values.dtype, pd.CategoricalDtype):
+                # GaussianNB needs dense features, categorical columns are given as their codes
+                values = values.cat.codes.to_numpy()
+            elif isinstance(values.dtype, np.dtype):
+                values = values.to_numpy()
+            else:
+                values = values.to_numpy(dtype=np.float32, na_value=np.nan)
+            X[:, j] = values[valid]
+
+        Y[:] = label[valid]
+
         return X, Y
 
+    @profile('model.fit')
     def fit(self, X, Y) -> GaussianNB:
         """
             Fit the model.
@@ -104,6 +307,27 @@ class GaussianNBModel(Model, ABC):
         self.model = model
         return model
 
+    @profile('model.partial_fit')
+    def partial_fit(self, X, Y, classes=None) -> GaussianNB:
+        """
+            Update the model with one more batch, starting a new model on the first call.
+            The variance smoothing is computed from the first batch only, as in GaussianNB.partial_fit.
+        Args:
+            X: training features of the batch.
+            Y: training labels of the batch.
+            classes: all the labels, required on the first call.
+        Returns:
+            model: the updated model.
+        """
+        if self.model is None or not hasattr(self.model, 'classes_'):
+            assert classes is not None, 'The labels of the whole stream must be given on the first batch.'
+            self.model = GaussianNB(**self.params)
+            self.model.partial_fit(X, Y, classes=classes)
+        else:
+            self.model.partial_fit(X, Y)
+        return self.model
+
+    @profile('model.predict', level=logging.DEBUG)
     def predict(self, X) -> np.ndarray:
         """Predict the labels for the given data.
         Args:
@@ -113,43 +337,93 @@ class GaussianNBModel(Model, ABC):
         """
         return self.model.predict(X)
 
-    def evaluate(self, X, Y) -> tuple:
-        """Evaluate the model.
+    @profile('model.predict_proba', level=logging.DEBUG)
+    def predict_proba(self, X) -> np.ndarray:
+        """Predict the probability of every class for the given data.
+        Args:
+            X: features to predict.
+        Returns:
+            probabilities: one column per class, in the order of self.model.classes_.
+        """
+        return self.model.predict_proba(X)
+
+    def compile(self, chunk_size: int = CHUNK_SIZE) -> CompiledGaussianNB:
+        """Export the fitted parameters to an inference kernel for bulk scoring.
+        Args:
+            chunk_size: number of rows scored at once.
+        Returns:
+            kernel: the compiled model, with the same predictions.
+        """
+        return CompiledGaussianNB.from_model(self.model, chunk_size)
+
+    def evaluate(self, X, Y, chunk_size: int = CHUNK_SIZE) -> dict:
+        """Evaluate the model, chunk by chunk.
         Args:
             X: features to evaluate.
             Y: labels to evaluate.
+            chunk_size: number of rows scored at once.
         Returns:
-            accuracy: accuracy of the model.
-            precision: precision of the model.
-            recall: recall of the model.
-            f1: f1 of the model.
+            metrics: rows, accuracy, precision, recall, f1 and log_loss of the model.
         """
-        y_pred = self.predict(X)
-        f1 = f1_score(Y, y_pred)
-        return f1
+        return self.evaluate_stream(split_chunks(X, Y, chunk_size)).report()
 
-    def cross_validate(self, X, Y, n_splits: int = 10) -> List[tuple]:
+    def evaluate_stream(self, chunks: Iterable[tuple], n_jobs: int = 1, bins: int = 10) -> BinaryMetrics:
+        """Evaluate the model over a stream of (X, Y) chunks in one pass, e.g. a multi-year holdout.
+        Args:
+            chunks: iterator of (features, labels).
+            n_jobs: number of chunks scored at the same time.
+            bins: number of calibration bins.
+        Returns:
+            metrics: confusion matrix, precision/recall/F1, log-loss and calibration of the model.
         """
-            Cross validate the model.
+        kernel = self.compile()
+        return evaluate_stream(kernel.predict_proba, chunks, positive_index=list(kernel.classes).index(True), bins=bins,
+                               n_jobs=n_jobs)
+
+    def cross_validate(self, X, Y, n_splits: int = 10, n_jobs: int = None, backend: str = 'thread') -> List[dict]:
+        """
+            Cross validate the model. Every fold trains its own model, self.model is left untouched.
+            The folds only receive the indices of their rows: threads share X and Y, and each worker process
+            receives X and Y once instead of once per fold. A fold copies its rows one chunk at a time.
         Args:
             X:  testing features.
             Y:  testing labels.
             n_splits: number of K splits.
+            n_jobs: number of folds run at the same time, defaults to min(n_splits, number of cores).
+            backend: 'thread' or 'process'.
         Returns:
-            scores: list of F1 scores.
+            results: accuracy, precision, recall, F1, fit and score times of every fold.
         """
-        f1_scores = []
-        for fold, (train, test) in enumerate(StratifiedKFold(n_splits=n_splits).split(X, Y)):
+        assert backend in ('thread', 'process'), 'Backend must be "thread" or "process".'
+
+        folds = list(StratifiedKFold(n_splits=n_splits).split(np.empty((len(Y), 0)), Y))
+        n_jobs = n_jobs or min(n_splits, os.cpu_count())
+
+        if n_jobs == 1:
+            results = [_fit_fold(self.params, fold, train, test, X, Y) for fold, (train, test) in enumerate(folds)]
+        elif backend == 'thread':
+            with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+                results = list(executor.map(lambda args: _fit_fold(self.params, *args, X, Y),
+                                            [(fold, train, test) for fold, (train, test) in enumerate(folds)]))
+        else:
+            # matrices of preprocess(backing=...) are sent as handles, the workers attach to them
+            if self.shared is not None and X is self.shared[0].array and Y is self.shared[1].array:
+                initargs = self.shared
+            else:
+                initargs = (X, Y)
+
+            with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_fold_worker, initargs=initargs) as executor:
+                futures = [executor.submit(_fit_fold, self.params, fold, train, test) for fold, (train, test) in enumerate(folds)]
+                results = [future.result() for future in futures]
+
+        for result in results:
             print('=============================')
-            print(f'Fold: {fold}')
-            x_train, x_test, y_train, y_test = X[train], X[test], Y[train], Y[test]
-            self.fit(x_train, y_train)
-            score = self.evaluate(x_test, y_test)
-            print(f'F1 score: {score}')
-            f1_scores.append(score)
-        return f1_scores
+            print(f"Fold: {result['fold']}")
+            print(f"F1 score: {result['f1']} (fit {result['fit_time']:.2f}s, score {result['score_time']:.2f}s)")
+
+        return results
 
-    def plot_confusion_matrix(self, X, Y, normalize: str = None):
+    def plot_confusion_matrix(self, X=None, Y=None, normalize: str = None, metrics: BinaryMetrics = None):
         """
         Plot the confusion matrix.
 
@@ -157,9 +431,11 @@ class GaussianNBModel(Model, ABC):
             X: The data to predict on.
             Y: The labels to compare against.
             normalize: Whether to normalize the matrix e.g. 'true', 'pred', 'all' etc
+            metrics: The counts of a previous evaluate_stream, instead of predicting on X again.
         """
-        y_pred = self.predict(X)
-        cm = confusion_matrix(Y, y_pred, normalize=normalize, labels=[True, False])
+        if metrics is None:
+            metrics = self.evaluate_stream(split_chunks(X, Y, CHUNK_SIZE))
+        cm = metrics.confusion_matrix(normalize=normalize)
         disp = ConfusionMatrixDisplay(confusion_matrix=cm, display_labels=[True, False])
         disp.plot(include_values=True, cmap='Blues')
         plt.show()
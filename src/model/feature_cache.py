@@ -0,0 +1,170 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+from typing import Callable, List, Optional, Tuple
+
+import numpy as np
+
+CACHE_DIR = os.environ.get('PIPELINE_FEATURE_CACHE', os.path.join('data', 'cache', 'matrices'))
+MAX_BYTES = 20 * 2 ** 30
+META_NAME = 'meta.json'
+
+
+class FeatureMatrixCache:
+    """Local cache of the training matrices built by Model.preprocess.
+
+    An entry is keyed by the version of the feature table and the selected features and label, and holds X.npy, Y.npy
+    and meta.json in its own directory. Entries are opened with np.load(mmap_mode='r'), so a hit costs no reading
+    until the rows are used. When the entries exceed the disk budget, the least recently used ones are deleted.
+    """
+
+    def __init__(self, cache_dir: str = CACHE_DIR, max_bytes: int = MAX_BYTES):
+        """Initialize the cache.
+        Args:
+            cache_dir: directory of the entries.
+            max_bytes: disk budget of the entries.
+        """
+        assert max_bytes > 0, 'The disk budget must be a positive number of bytes.'
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def key(version: str, features: List[str], label: str) -> str:
+        """Key of an entry, the order of the features matters as it is the order of the columns of X."""
+        definition = json.dumps({'version': str(version), 'features': list(features), 'label': label})
+        return hashlib.sha256(definition.encode('utf-8')).hexdigest()
+
+    def entry_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key)
+
+    def get(self, version: str, features: List[str], label: str) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """Open a cached matrix.
+        Args:
+            version: version of the feature table, e.g. its last modification time.
+            features: features of the matrix.
+            label: label of the matrix.
+        Returns:
+            (X, Y) memory-mapped read-only, or None if the entry is not cached.
+        """
+        path = self.entry_path(self.key(version, features, label))
+        try:
+            X = np.load(os.path.join(path, 'X.npy'), mmap_mode='r')
+            Y = np.load(os.path.join(path, 'Y.npy'), mmap_mode='r')
+        except FileNotFoundError:
+            return None
+
+        self._touch(path)
+        return X, Y
+
+    def put(self, version: str, features: List[str], label: str, X: np.ndarray, Y: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Store a matrix and evict the least recently used entries over the budget.
+        Args:
+            version: version of the feature table.
+            features: features of the matrix.
+            label: label of the matrix.
+            X: features.
+            Y: labels.
+        Returns:
+            (X, Y) memory-mapped from the cache.
+        """
+        key = self.key(version, features, label)
+        path = self.entry_path(key)
+
+        # written next to the entry and renamed, readers never see a partial entry
+        staging = os.path.join(self.cache_dir, f'.{key}.{uuid.uuid4().hex}')
+        os.makedirs(staging)
+        try:
+            np.save(os.path.join(staging, 'X.npy'), np.ascontiguousarray(X))
+            np.save(os.path.join(staging, 'Y.npy'), np.ascontiguousarray(Y))
+            meta = {'version': str(version), 'features': list(features), 'label': label, 'rows': len(X),
+                    'created': time.time(), 'last_access': time.time()}
+            with open(os.path.join(staging, META_NAME), 'w') as file:
+                json.dump(meta, file, indent=2)
+
+            if os.path.exists(path):
+                shutil.rmtree(path, ignore_errors=True)
+            os.replace(staging, path)
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+
+        self.evict(keep=key)
+        return self.get(version, features, label)
+
+    def get_or_build(self, version: str, features: List[str], label: str,
+                     build: Callable[[], Tuple[np.ndarray, np.ndarray]]) -> Tuple[np.ndarray, np.ndarray]:
+        """Open a cached matrix, or build and store it on a miss.
+        Args:
+            version: version of the feature table.
+            features: features of the matrix.
+            label: label of the matrix.
+            build: function returning (X, Y), only called on a miss.
+        Returns:
+            (X, Y) memory-mapped from the cache.
+        """
+        cached = self.get(version, features, label)
+        if cached is not None:
+            print(f'Feature matrix cache hit: {self.key(version, features, label)[:12]}')
+            return cached
+
+        print(f'Feature matrix cache miss: {self.key(version, features, label)[:12]}')
+        X, Y = build()
+        return self.put(version, features, label, X, Y)
+
+    def entries(self) -> List[dict]:
+        """Metadata of the cached entries with their key and size, least recently used first."""
+        entries = []
+        for key in os.listdir(self.cache_dir):
+            path = self.entry_path(key)
+            if key.startswith('.') or not os.path.isdir(path):
+                continue
+            try:
+                with open(os.path.join(path, META_NAME)) as file:
+                    meta = json.load(file)
+            except (FileNotFoundError, json.JSONDecodeError):
+                continue
+            meta['key'] = key
+            meta['bytes'] = sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+            entries.append(meta)
+        return sorted(entries, key=lambda meta: meta['last_access'])
+
+    def evict(self, keep: str = None) -> List[str]:
+        """Delete the least recently used entries until the cache fits in the budget.
+        Args:
+            keep: key of an entry that is never evicted, e.g. the one just stored.
+        Returns:
+            keys: the evicted entries.
+        """
+        entries = self.entries()
+        total = sum(meta['bytes'] for meta in entries)
+        evicted = []
+
+        for meta in entries:
+            if total <= self.max_bytes:
+                break
+            if meta['key'] == keep:
+                continue
+            # open memory maps of an evicted entry stay readable until they are closed
+            shutil.rmtree(self.entry_path(meta['key']), ignore_errors=True)
+            total -= meta['bytes']
+            evicted.append(meta['key'])
+
+        return evicted
+
+    def _touch(self, path: str):
+        """Record the access of an entry for the LRU eviction."""
+        meta_path = os.path.join(path, META_NAME)
+        try:
+            with open(meta_path) as file:
+                meta = json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return
+        meta['last_access'] = time.time()
+
+        temp = f'{meta_path}.{uuid.uuid4().hex}'
+        with open(temp, 'w') as file:
+            json.dump(meta, file, indent=2)
+        os.replace(temp, meta_path)
@@ -0,0 +1,125 @@
+from typing import Iterable, Iterator
+
+import numpy as np
+from scipy.special import logsumexp
+from sklearn.naive_bayes import GaussianNB
+
+# Number of rows scored at once, the buffers of a chunk are allocated once per call
+CHUNK_SIZE = 65_536
+
+
+class CompiledGaussianNB:
+    """Inference kernel of a fitted GaussianNB for bulk scoring.
+
+    The parameters are exported once: per class the log prior plus the normalization term of the Gaussians, the means
+    and the inverse variances. Matrices are scored chunk by chunk into buffers allocated once, without the input
+    validation and the float64 copy of the whole matrix done by sklearn on every call. The joint log likelihood is the
+    one of sklearn,
+
+        log P(c) - 1/2 sum_j log(2 pi var_cj) - 1/2 sum_j (x_j - mean_cj)^2 / var_cj
+
+    computed in float64, so the predictions are the ones of sklearn and the probabilities match up to rounding.
+    """
+
+    def __init__(self, classes: np.ndarray, log_prior: np.ndarray, means: np.ndarray, inverse_variances: np.ndarray,
+                 chunk_size: int = CHUNK_SIZE):
+        """Initialize the kernel from exported parameters, use from_model to export them from a fitted model.
+        Args:
+            classes: labels of the classes.
+            log_prior: log prior of every class.
+            means: mean of every feature per class, shape (classes, features).
+            inverse_variances: inverse variance of every feature per class, shape (classes, features).
+            chunk_size: number of rows scored at once.
+        """
+        assert means.shape == inverse_variances.shape and len(classes) == len(log_prior) == len(means), \
+            'The parameters must have one row per class.'
+        self.classes = np.asarray(classes)
+        self.means = np.ascontiguousarray(means, dtype=np.float64)
+        self.inverse_variances = np.ascontiguousarray(inverse_variances, dtype=np.float64)
+        self.log_prior = np.asarray(log_prior, dtype=np.float64)
+        self.chunk_size = chunk_size
+
+        # constant part of the joint log likelihood of every class
+        self.offsets = self.log_prior + 0.5 * np.sum(np.log(self.inverse_variances / (2.0 * np.pi)), axis=1)
+
+    @classmethod
+    def from_model(cls, model, chunk_size: int = CHUNK_SIZE) -> 'CompiledGaussianNB':
+        """Export the parameters of a fitted model.
+        Args:
+            model: fitted GaussianNBModel or sklearn GaussianNB.
+            chunk_size: number of rows scored at once.
+        Returns:
+            kernel: the compiled model.
+        """
+        estimator = model if isinstance(model, GaussianNB) else model.model
+        assert estimator is not None and hasattr(estimator, 'theta_'), 'The model must be fitted.'
+        return cls(estimator.classes_, np.log(estimator.class_prior_), estimator.theta_, 1.0 / estimator.var_, chunk_size)
+
+    @property
+    def n_features(self) -> int:
+        return self.means.shape[1]
+
+    def joint_log_likelihood(self, X: np.ndarray, out: np.ndarray = None) -> np.ndarray:
+        """Joint log likelihood of every row and class.
+        Args:
+            X: features, any numeric dtype, shape (rows, features).
+            out: array of shape (rows, classes) the result is written into.
+        Returns:
+            jll: joint log likelihood, shape (rows, classes).
+        """
+        X = np.asarray(X)
+        assert X.ndim == 2 and X.shape[1] == self.n_features, f'Expected a matrix of {self.n_features} features.'
+        rows = len(X)
+        if out is None:
+            out = np.empty((rows, len(self.classes)), dtype=np.float64)
+
+        size = min(self.chunk_size, rows)
+        chunk = np.empty((size, self.n_features), dtype=np.float64)
+        squares = np.empty((size, self.n_features), dtype=np.float64)
+        column = np.empty(size, dtype=np.float64)
+
+        for start in range(0, rows, self.chunk_size):
+            end = min(start + self.chunk_size, rows)
+            x, sq, col = chunk[:end - start], squares[:end - start], column[:end - start]
+            np.copyto(x, X[start:end], casting='unsafe')
+
+            for c in range(len(self.classes)):
+                np.subtract(x, self.means[c], out=sq)
+                np.square(sq, out=sq)
+                np.dot(sq, self.inverse_variances[c], out=col)
+                out[start:end, c] = col
+
+        out *= -0.5
+        out += self.offsets
+        return out
+
+    def predict_proba(self, X: np.ndarray) -> np.ndarray:
+        """Probability of every class.
+        Args:
+            X: features.
+        Returns:
+            probabilities: one column per class, in the order of self.classes.
+        """
+        jll = self.joint_log_likelihood(X)
+        jll -= logsumexp(jll, axis=1, keepdims=True)
+        return np.exp(jll, out=jll)
+
+    def predict(self, X: np.ndarray) -> np.ndarray:
+        """Most likely class of every row.
+        Args:
+            X: features.
+        Returns:
+            labels: predicted labels.
+        """
+        return self.classes[np.argmax(self.joint_log_likelihood(X), axis=1)]
+
+    def predict_iter(self, chunks: Iterable[np.ndarray], proba: bool = False) -> Iterator[np.ndarray]:
+        """Score a stream of matrices, e.g. the months of a backfill, one at a time.
+        Args:
+            chunks: iterator of feature matrices.
+            proba: yield the probabilities instead of the labels.
+        Returns:
+            results: the labels (or probabilities) of every chunk.
+        """
+        for X in chunks:
+            yield self.predict_proba(X) if proba else self.predict(X)
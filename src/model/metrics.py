@@ -0,0 +1,189 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, List, Tuple
+
+import numpy as np
+
+# Number of calibration bins over [0, 1]
+CALIBRATION_BINS = 10
+
+# Probabilities are clipped to [EPSILON, 1 - EPSILON] in the log-loss
+EPSILON = 1e-15
+
+
+class BinaryMetrics:
+    """Mergeable accumulator of the evaluation of a binary classifier.
+
+    Every update counts one chunk of labels and predicted probabilities: the confusion matrix, the log-loss and the
+    calibration bins are sums, so accumulators of different chunks or workers are merged by adding them, and any
+    holdout is evaluated in one streaming pass. Every metric is computed from the same predictions.
+    """
+
+    def __init__(self, positive=True, bins: int = CALIBRATION_BINS):
+        """Initialize an empty accumulator.
+        Args:
+            positive: label of the positive class.
+            bins: number of calibration bins.
+        """
+        self.positive = positive
+        self.bins = bins
+        # rows are the true class, columns the predicted class, index 1 is the positive class
+        self.confusion = np.zeros((2, 2), dtype=np.int64)
+        self.log_loss_sum = 0.0
+        self.bin_count = np.zeros(bins, dtype=np.int64)
+        self.bin_probability = np.zeros(bins, dtype=np.float64)
+        self.bin_positive = np.zeros(bins, dtype=np.int64)
+
+    def update(self, y_true: np.ndarray, probability: np.ndarray, y_pred: np.ndarray = None) -> 'BinaryMetrics':
+        """Count one chunk.
+        Args:
+            y_true: true labels.
+            probability: predicted probability of the positive class.
+            y_pred: predicted labels, defaults to probability > 0.5.
+        Returns:
+            self
+        """
+        actual = np.asarray(y_true) == self.positive
+        probability = np.asarray(probability, dtype=np.float64)
+        predicted = probability > 0.5 if y_pred is None else np.asarray(y_pred) == self.positive
+
+        self.confusion += np.bincount(actual * 2 + predicted, minlength=4).reshape(2, 2)
+
+        clipped = np.clip(probability, EPSILON, 1 - EPSILON)
+        self.log_loss_sum -= np.log(np.where(actual, clipped, 1 - clipped)).sum()
+
+        bins = np.minimum((probability * self.bins).astype(np.intp), self.bins - 1)
+        self.bin_count += np.bincount(bins, minlength=self.bins)
+        self.bin_probability += np.bincount(bins, weights=probability, minlength=self.bins)
+        self.bin_positive += np.bincount(bins, weights=actual, minlength=self.bins).astype(np.int64)
+
+        return self
+
+    def merge(self, other: 'BinaryMetrics') -> 'BinaryMetrics':
+        """Add the counts of another accumulator.
+        Args:
+            other: accumulator of other chunks, with the same positive class and bins.
+        Returns:
+            self
+        """
+        assert other.positive == self.positive and other.bins == self.bins, 'Only accumulators with the same classes and bins merge.'
+        self.confusion += other.confusion
+        self.log_loss_sum += other.log_loss_sum
+        self.bin_count += other.bin_count
+        self.bin_probability += other.bin_probability
+        self.bin_positive += other.bin_positive
+        return self
+
+    def __add__(self, other: 'BinaryMetrics') -> 'BinaryMetrics':
+        return BinaryMetrics(self.positive, self.bins).merge(self).merge(other)
+
+    @property
+    def rows(self) -> int:
+        return int(self.confusion.sum())
+
+    @property
+    def accuracy(self) -> float:
+        return _ratio(np.trace(self.confusion), self.rows)
+
+    @property
+    def precision(self) -> float:
+        return _ratio(self.confusion[1, 1], self.confusion[:, 1].sum())
+
+    @property
+    def recall(self) -> float:
+        return _ratio(self.confusion[1, 1], self.confusion[1].sum())
+
+    @property
+    def f1(self) -> float:
+        return _ratio(2 * self.confusion[1, 1], 2 * self.confusion[1, 1] + self.confusion[0, 1] + self.confusion[1, 0])
+
+    @property
+    def log_loss(self) -> float:
+        return self.log_loss_sum / self.rows if self.rows else float('nan')
+
+    def calibration(self) -> dict:
+        """Mean predicted probability and observed frequency of the positive class in every non-empty bin."""
+        filled = self.bin_count > 0
+        return {
+            'bin_edges'           : np.linspace(0, 1, self.bins + 1),
+            'count'               : self.bin_count,
+            'mean_probability'    : np.where(filled, self.bin_probability / np.maximum(self.bin_count, 1), np.nan),
+            'observed_probability': np.where(filled, self.bin_positive / np.maximum(self.bin_count, 1), np.nan)
+        }
+
+    def confusion_matrix(self, normalize: str = None, positive_first: bool = True) -> np.ndarray:
+        """Confusion matrix like sklearn.metrics.confusion_matrix.
+        Args:
+            normalize: None, 'true', 'pred' or 'all'.
+            positive_first: order the classes [positive, negative], like labels=[True, False].
+        Returns:
+            matrix: rows are the true classes, columns the predicted classes.
+        """
+        matrix = self.confusion[::-1, ::-1] if positive_first else self.confusion
+        matrix = matrix.astype(np.float64) if normalize else matrix.copy()
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            if normalize == 'true':
+                matrix /= matrix.sum(axis=1, keepdims=True)
+            elif normalize == 'pred':
+                matrix /= matrix.sum(axis=0, keepdims=True)
+            elif normalize == 'all':
+                matrix /= matrix.sum()
+        return np.nan_to_num(matrix) if normalize else matrix
+
+    def report(self) -> dict:
+        """Every scalar metric."""
+        return {
+            'rows'     : self.rows,
+            'accuracy' : self.accuracy,
+            'precision': self.precision,
+            'recall'   : self.recall,
+            'f1'       : self.f1,
+            'log_loss' : self.log_loss
+        }
+
+
+def _ratio(numerator, denominator) -> float:
+    # 0 when undefined, like zero_division=0 in sklearn
+    return float(numerator / denominator) if denominator else 0.0
+
+
+def evaluate_stream(predict_proba: Callable[[np.ndarray], np.ndarray], chunks: Iterable[Tuple[np.ndarray, np.ndarray]],
+                    positive_index: int = 1, positive=True, bins: int = CALIBRATION_BINS, n_jobs: int = 1) -> BinaryMetrics:
+    """Evaluate a classifier over a stream of (X, Y) chunks in one pass.
+    Args:
+        predict_proba: function returning the probability of every class of a feature matrix.
+        chunks: iterator of (features, labels), e.g. the months of a multi-year holdout.
+        positive_index: column of the positive class in the probabilities.
+        positive: label of the positive class.
+        bins: number of calibration bins.
+        n_jobs: number of chunks scored at the same time by threads, at most 2 * n_jobs chunks are in memory.
+    Returns:
+        metrics: the merged accumulator of every chunk.
+    """
+    def evaluate_chunk(chunk: Tuple[np.ndarray, np.ndarray]) -> BinaryMetrics:
+        X, Y = chunk
+        return BinaryMetrics(positive, bins).update(Y, predict_proba(X)[:, positive_index])
+
+    metrics = BinaryMetrics(positive, bins)
+
+    if n_jobs == 1:
+        for chunk in chunks:
+            metrics.merge(evaluate_chunk(chunk))
+        return metrics
+
+    with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(executor.submit(evaluate_chunk, chunk))
+            if len(pending) >= 2 * n_jobs:
+                metrics.merge(pending.popleft().result())
+        while pending:
+            metrics.merge(pending.popleft().result())
+
+    return metrics
+
+
+def split_chunks(X: np.ndarray, Y: np.ndarray, chunk_size: int) -> List[Tuple[np.ndarray, np.ndarray]]:
+    """Views of consecutive chunks of an in-memory (or memory-mapped) matrix and its labels."""
+    return [(X[start:start + chunk_size], Y[start:start + chunk_size]) for start in range(0, len(X), chunk_size)]
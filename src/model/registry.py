@@ -0,0 +1,237 @@
+import hashlib
+import io
+import json
+import os
+import threading
+import uuid
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import Dict, List, Optional
+
+import numpy as np
+from sklearn.naive_bayes import GaussianNB
+
+from src.dataset.catalog import DATA_DIR, TIME_STAMP_FORMAT, get_catalog
+from src.dataset.create_dataset import get_time_stamp
+from src.dataset.storage import LocalStorage, PreconditionFailed, Storage, get_storage
+from src.model.classifiers import GaussianNBModel
+
+STAGE = 'models/gaussian_nb'
+MODEL_FORMAT = 'model'
+META_NAME = 'meta.json'
+INDEX_NAME = '_versions.json'
+
+# Fitted attributes of GaussianNB stored in the artifacts, one .npy file each
+PARAMETERS = ['classes_', 'class_prior_', 'class_count_', 'theta_', 'var_']
+
+# Local copy of the artifacts of remote storages, so they can be memory-mapped
+CACHE_DIR = os.path.join('data', 'cache', 'models')
+
+# Attempts to update the version index that is concurrently updated by another save
+MAX_ATTEMPTS = 10
+
+# Bytes hashed at once by data_fingerprint
+FINGERPRINT_BLOCK = 2 ** 24
+
+
+def data_fingerprint(X: np.ndarray, Y: np.ndarray) -> str:
+    """Fingerprint of a training matrix and its labels, read block by block so memory maps are not loaded at once.
+    Args:
+        X: features.
+        Y: labels.
+    Returns:
+        fingerprint: hexadecimal sha256 of the shapes, dtypes and values.
+    """
+    digest = hashlib.sha256()
+    for array in (X, Y):
+        array = np.ascontiguousarray(array)
+        digest.update(f'{array.shape}{array.dtype.str}'.encode('utf-8'))
+        data = array.reshape(-1).view(np.uint8)
+        for start in range(0, len(data), FINGERPRINT_BLOCK):
+            digest.update(data[start:start + FINGERPRINT_BLOCK])
+    return digest.hexdigest()
+
+
+class ModelRegistry:
+    """Versioned artifacts of trained GaussianNBModel.
+
+    A version is a time stamp like the stage outputs of create_dataset, allocated with a compare-and-swap on the index
+    data/models/gaussian_nb/_versions.json: a save gets the current second, or the second after the last allocated
+    version if another save already took it, so concurrent saves never share a version. Its artifact lives at data/models/gaussian_nb/<version>/ and holds one .npy file per
+    fitted parameter and meta.json (features, label, dtypes, parameters, training data fingerprint and metrics). The versions are recorded in the catalog of the stage,
+    so the latest model is a catalog lookup.
+
+    Loading is lazy: the parameters are memory-mapped, and every loaded version is kept in-process, so scoring jobs and
+    notebooks get the latest model in milliseconds without retraining.
+    """
+
+    def __init__(self, storage: Storage = None, stage: str = STAGE, cache_dir: str = CACHE_DIR):
+        """Initialize the registry.
+        Args:
+            storage: storage backend of the artifacts, defaults to get_storage().
+            stage: stage of the artifacts.
+            cache_dir: local directory the artifacts of remote storages are downloaded to.
+        """
+        self.storage = storage or get_storage()
+        self.stage = stage
+        self.cache_dir = cache_dir
+        self._models = {}
+        self._lock = threading.Lock()
+
+    def artifact_path(self, version: str) -> str:
+        return f'{DATA_DIR}/{self.stage}/{version}'
+
+    def save(self, model: GaussianNBModel, metrics: dict = None, fingerprint: str = None, dtypes: dict = None) -> str:
+        """Store a new version of a trained model.
+        Args:
+            model: the trained model.
+            metrics: evaluation of the model, e.g. {'f1': 0.82}.
+            fingerprint: fingerprint of the training data, e.g. data_fingerprint(X, Y).
+            dtypes: dtype of every feature.
+        Returns:
+            version: the version of the artifact.
+        """
+        assert model.model is not None, 'Only trained models can be saved.'
+
+        arrays = {}
+        for name in PARAMETERS:
+            buffer = io.BytesIO()
+            np.save(buffer, np.asarray(getattr(model.model, name)), allow_pickle=False)
+            arrays[name] = buffer.getvalue()
+
+        version = self._claim_version()
+        path = self.artifact_path(version)
+        for name in PARAMETERS:
+            self.storage.write_bytes(f'{path}/{name}.npy', arrays[name])
+
+        meta = {
+            'version'    : version,
+            'model'      : type(model).__name__,
+            'features'   : list(model.features),
+            'label'      : model.label,
+            'dtypes'     : {feature: str(dtype) for feature, dtype in (dtypes or {}).items()},
+            'params'     : model.params,
+            'fingerprint': fingerprint,
+            'metrics'    : metrics or {}
+        }
+        # written last, an artifact without meta.json is incomplete
+        self.storage.write_bytes(f'{path}/{META_NAME}', json.dumps(meta, indent=2).encode('utf-8'),
+                                 content_type='application/json')
+
+        get_catalog(self.storage).register(self.stage, version, f'{path}/{META_NAME}', MODEL_FORMAT,
+                                           fingerprint=fingerprint, metrics=metrics or {})
+        return version
+
+    @property
+    def index_path(self) -> str:
+        return f'{DATA_DIR}/{self.stage}/{INDEX_NAME}'
+
+    def _claim_version(self) -> str:
+        """Allocate a new version with a compare-and-swap on the version index, which holds the last allocated version:
+        the new version is the current time stamp, or the second after the last version if it is not later.
+        Returns:
+            version: the allocated version.
+        """
+        for _ in range(MAX_ATTEMPTS):
+            data, generation = self.storage.read_versioned(self.index_path)
+            # the registries saved before the index start after the latest version of the catalog
+            index = json.loads(data) if data is not None else {'last': self.latest(), 'allocated': 0}
+
+            version = get_time_stamp()
+            if index['last'] is not None and version <= index['last'][:15]:
+                last = datetime.strptime(index['last'][:15], TIME_STAMP_FORMAT)
+                version = (last + timedelta(seconds=1)).strftime(TIME_STAMP_FORMAT)
+
+            index = {'last': version, 'allocated': index['allocated'] + 1}
+            try:
+                self.storage.write_if_generation(self.index_path, json.dumps(index, indent=2).encode('utf-8'), generation,
+                                                 content_type='application/json')
+            except PreconditionFailed:
+                continue
+            return version
+
+        raise RuntimeError(f'Could not allocate a new version of stage {self.stage} after {MAX_ATTEMPTS} attempts.')
+
+    def latest(self) -> Optional[str]:
+        """The latest saved version, None if there is none."""
+        return get_catalog(self.storage).latest(self.stage, MODEL_FORMAT)
+
+    def versions(self) -> List[str]:
+        """Every saved version, oldest first."""
+        files = get_catalog(self.storage).load(self.stage, refresh=True)['files']
+        return sorted(entry['version'] for entry in files.values() if entry['format'] == MODEL_FORMAT)
+
+    def metadata(self, version: str = None) -> dict:
+        """The meta.json of a version, without loading its parameters.
+        Args:
+            version: version of the model, defaults to the latest.
+        Returns:
+            meta: features, label, dtypes, parameters, fingerprint and metrics of the model.
+        """
+        version = version or self._latest()
+        return json.loads(self.storage.read_bytes(f'{self.artifact_path(version)}/{META_NAME}'))
+
+    def load(self, version: str = None) -> GaussianNBModel:
+        """Load a model, from the in-process cache if the version was already loaded.
+        Args:
+            version: version of the model, defaults to the latest.
+        Returns:
+            model: the trained model, its parameters are read-only memory maps.
+        """
+        version = version or self._latest()
+
+        with self._lock:
+            model = self._models.get(version)
+        if model is not None:
+            return model
+
+        directory = self._local_directory(version)
+        with open(os.path.join(directory, META_NAME)) as file:
+            meta = json.load(file)
+
+        estimator = GaussianNB(**meta['params'])
+        for name in PARAMETERS:
+            setattr(estimator, name, np.load(os.path.join(directory, f'{name}.npy'), mmap_mode='r'))
+        estimator.n_features_in_ = len(meta['features'])
+        estimator.epsilon_ = 0.0  # already included in var_
+
+        model = GaussianNBModel(features=meta['features'], label=meta['label'], params=meta['params'])
+        model.model = estimator
+        model.version = version
+        model.metadata = meta
+
+        with self._lock:
+            return self._models.setdefault(version, model)
+
+    def _latest(self) -> str:
+        version = self.latest()
+        assert version is not None, f'No model found in stage {self.stage}.'
+        return version
+
+    def _local_directory(self, version: str) -> str:
+        """Local directory of the artifact of a version, downloaded once from remote storages."""
+        path = self.artifact_path(version)
+
+        if isinstance(self.storage, LocalStorage):
+            return os.path.join(self.storage.root, path)
+
+        directory = os.path.join(self.cache_dir, self.stage, version)
+        if os.path.exists(os.path.join(directory, META_NAME)):
+            return directory
+
+        os.makedirs(directory, exist_ok=True)
+        for name in [f'{name}.npy' for name in PARAMETERS] + [META_NAME]:
+            temp = os.path.join(directory, f'.{name}.{uuid.uuid4().hex}')
+            with open(temp, 'wb') as file:
+                file.write(self.storage.read_bytes(f'{path}/{name}'))
+            os.replace(temp, os.path.join(directory, name))
+
+        return directory
+
+
+@lru_cache(maxsize=None)
+def get_registry(storage: Storage = None) -> ModelRegistry:
+    """
+    Returns the registry of the storage, shared by every caller of the process so loaded models are reused.
+    """
+    return ModelRegistry(storage)
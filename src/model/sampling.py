@@ -0,0 +1,69 @@
+from typing import Tuple
+
+import numpy as np
+
+
+class ReservoirSampler:
+    """Uniform sample of fixed size over a stream of batches (reservoir sampling, algorithm R).
+
+    Every row of the stream ends up in the sample with the same probability, whatever the length of the stream.
+    Used to hold out an evaluation set while training on a stream: the rows in the reservoir are not trained on, the rows
+    that never enter it or are evicted from it are.
+    """
+
+    def __init__(self, size: int, random_state: int = None):
+        """Initialize an empty reservoir.
+        Args:
+            size: number of rows of the sample.
+            random_state: seed of the sampling.
+        """
+        assert size > 0, 'Reservoir size must be a positive number of rows.'
+        self.size = size
+        self.rng = np.random.default_rng(random_state)
+        self.seen = 0
+        self.X = None
+        self.Y = None
+
+    def add(self, X: np.ndarray, Y: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Offer a batch to the reservoir.
+        Args:
+            X: features of the batch.
+            Y: labels of the batch.
+        Returns:
+            X, Y: the rows out of the reservoir, the rows of the batch that did not enter it or were replaced by a later
+                row of the batch, followed by the rows of the previous batches it evicted.
+        """
+        n = len(X)
+        if self.X is None:
+            self.X = np.empty((self.size,) + X.shape[1:], dtype=X.dtype)
+            self.Y = np.empty((self.size,) + Y.shape[1:], dtype=Y.dtype)
+
+        # row i of the stream replaces a uniformly drawn slot in [0, i] if that slot is in the reservoir
+        positions = self.seen + np.arange(n)
+        slots = np.where(positions < self.size, positions, self.rng.integers(0, positions + 1))
+        taken = np.flatnonzero(slots < self.size)
+
+        # with repeated slots the last row wins, as if the rows were offered one after the other
+        unique_slots, last = np.unique(slots[taken][::-1], return_index=True)
+        rows = taken[len(taken) - 1 - last]
+
+        # the slots filled before this batch evict their rows, the other slots were empty
+        evicted = unique_slots[unique_slots < min(self.seen, self.size)]
+        x_evicted, y_evicted = self.X[evicted], self.Y[evicted]
+
+        self.X[unique_slots] = X[rows]
+        self.Y[unique_slots] = Y[rows]
+        self.seen += n
+
+        out = np.ones(n, dtype=bool)
+        out[rows] = False
+
+        return np.concatenate([X[out], x_evicted]), np.concatenate([Y[out], y_evicted])
+
+    @property
+    def sample(self) -> Tuple[np.ndarray, np.ndarray]:
+        """The rows currently in the reservoir."""
+        filled = min(self.seen, self.size)
+        if self.X is None:
+            return np.empty((0,)), np.empty((0,))
+        return self.X[:filled], self.Y[:filled]
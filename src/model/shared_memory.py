@@ -0,0 +1,95 @@
+import os
+import tempfile
+import uuid
+from multiprocessing import shared_memory
+from typing import Tuple
+
+import numpy as np
+
+BACKINGS = ('shm', 'mmap')
+
+
+class SharedMatrix:
+    """Array whose buffer lives outside the process heap, in shared memory or in a memory-mapped .npy file.
+
+    Pickling a SharedMatrix only sends its handle (backing, location, shape and dtype): the receiving process attaches to
+    the same buffer instead of copying the data, so worker processes can read a training matrix of several gigabytes.
+    The process that created the matrix owns it and must call unlink() once the workers are done.
+    """
+
+    def __init__(self, backing: str, location: str, shape: Tuple[int, ...], dtype, create: bool = False):
+        """Create or attach to a matrix, use SharedMatrix.create and SharedMatrix.attach instead.
+        Args:
+            backing: 'shm' for multiprocessing.shared_memory, 'mmap' for a memory-mapped .npy file.
+            location: name of the shared memory block or path of the .npy file.
+            shape: shape of the matrix.
+            dtype: dtype of the matrix.
+            create: allocate the buffer instead of attaching to an existing one.
+        """
+        assert backing in BACKINGS, f'Backing must be one of {BACKINGS}.'
+        self.backing = backing
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.owner = create
+        self._shm = None
+
+        if backing == 'shm':
+            size = max(int(np.prod(self.shape)) * self.dtype.itemsize, 1)
+            self._shm = shared_memory.SharedMemory(name=location, create=create, size=size if create else 0)
+            self.location = self._shm.name
+            self.array = np.ndarray(self.shape, dtype=self.dtype, buffer=self._shm.buf)
+        else:
+            self.location = location
+            mode = 'w+' if create else 'r'
+            self.array = np.lib.format.open_memmap(location, mode=mode, dtype=self.dtype, shape=self.shape if create else None)
+
+    @classmethod
+    def create(cls, shape: Tuple[int, ...], dtype, backing: str = 'shm', path: str = None) -> 'SharedMatrix':
+        """Allocate a new matrix.
+        Args:
+            shape: shape of the matrix.
+            dtype: dtype of the matrix.
+            backing: 'shm' or 'mmap'.
+            path: path of the .npy file of the 'mmap' backing, defaults to a new file in the temporary directory.
+        Returns:
+            matrix: the new matrix, owned by the calling process.
+        """
+        if backing == 'mmap' and path is None:
+            path = os.path.join(tempfile.gettempdir(), f'matrix-{uuid.uuid4().hex}.npy')
+        return cls(backing, path, shape, dtype, create=True)
+
+    @classmethod
+    def attach(cls, handle: tuple) -> 'SharedMatrix':
+        """Attach to the matrix of a handle.
+        Args:
+            handle: the handle of the matrix.
+        Returns:
+            matrix: a view of the same buffer.
+        """
+        return cls(*handle)
+
+    @property
+    def handle(self) -> tuple:
+        """Picklable description of the matrix: backing, location, shape and dtype."""
+        return self.backing, self.location, self.shape, self.dtype.str
+
+    def __reduce__(self):
+        return SharedMatrix.attach, (self.handle,)
+
+    def close(self):
+        """Release the view of this process, the buffer stays available to the other processes."""
+        self.array = None
+        if self._shm is not None:
+            self._shm.close()
+            self._shm = None
+
+    def unlink(self):
+        """Release the view and free the buffer, only the owner should call it."""
+        shm, path = self._shm, self.location
+        self.array = None
+        if shm is not None:
+            shm.close()
+            shm.unlink()
+            self._shm = None
+        elif os.path.exists(path):
+            os.remove(path)
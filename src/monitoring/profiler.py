@@ -0,0 +1,393 @@
+"""
+This file contains the stage profiler of the pipeline: the wall time, CPU time, memory, rows and bytes of every stage,
+logged as one JSON record per stage and summed per stage in a table at the end of a run.
+"""
+import cProfile
+import functools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from fnmatch import fnmatch
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
+import numpy as np
+import pandas as pd
+from rich.console import Console
+from rich.table import Table
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows, the peak memory is not recorded there
+    resource = None
+
+# Environment variables of the profiler: PIPELINE_PROFILE=0 disables it, PIPELINE_PROFILE_DUMP=cprofile,tracemalloc
+# dumps the stages matching the PIPELINE_PROFILE_STAGES glob (e.g. 'feature.*') to PIPELINE_PROFILE_DIR
+PROFILE_ENV = 'PIPELINE_PROFILE'
+PROFILE_DUMP_ENV = 'PIPELINE_PROFILE_DUMP'
+PROFILE_STAGES_ENV = 'PIPELINE_PROFILE_STAGES'
+PROFILE_DIR_ENV = 'PIPELINE_PROFILE_DIR'
+
+PROFILE_DIR = 'logs/profiles'
+DUMPS = ('cprofile', 'tracemalloc')
+
+logger = logging.getLogger('pipeline.profile')
+
+
+def current_rss() -> Optional[int]:
+    """
+    The resident memory of the process in bytes, None where /proc is not available.
+    """
+    try:
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return None
+
+
+def peak_rss() -> Optional[int]:
+    """
+    The highest resident memory of the process so far in bytes.
+    """
+    if resource is None:
+        return None
+    # bytes on macOS, kilobytes on Linux
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def size_of(value) -> Tuple[Optional[int], Optional[int]]:
+    """
+    The rows and bytes of a value moved by a stage: a dataframe, an array, bytes, or the first of a tuple (e.g. the
+    (X, Y) of preprocess). (None, None) for anything else.
+    """
+    if isinstance(value, tuple) and value:
+        value = value[0]
+    if isinstance(value, pd.DataFrame):
+        return len(value), int(value.memory_usage(index=False, deep=False).sum())
+    if isinstance(value, pd.Series):
+        return len(value), int(value.memory_usage(index=False, deep=False))
+    if isinstance(value, np.ndarray):
+        return (len(value) if value.ndim else 1), int(value.nbytes)
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return None, len(value)
+    return None, None
+
+
+class Stage:
+    """
+    The measures of one call of a stage. Code running in the stage adds its counters with record().
+    """
+
+    def __init__(self, name: str, parent: str = None, level: int = logging.INFO):
+        self.name = name
+        self.parent = parent
+        self.level = level
+        self.counters = {}
+        self.measures = {}
+
+    def record(self, **counters) -> 'Stage':
+        """
+        Adds to the counters of the stage, e.g. record(rows_in=len(df), rows_out=kept).
+        """
+        for counter, value in counters.items():
+            if value is not None:
+                self.counters[counter] = self.counters.get(counter, 0) + int(value)
+        return self
+
+    def to_dict(self) -> dict:
+        return {'stage': self.name, 'parent': self.parent, **self.measures, **self.counters}
+
+
+class Profiler:
+    """
+    Measures the stages of the pipeline. A stage is a block of code run with the stage() context manager, a function
+    decorated with profile(), or every step of an iterator wrapped with iterate(). For every call the profiler
+    records the wall time, the CPU time of the process, the resident memory at the end, the peak resident memory of the
+    process and how much the stage raised it, and the rows and bytes in and out. Every call is logged as a JSON record
+    on the 'pipeline.profile' logger, and the calls are summed per stage for the summary table.
+
+    Stages nest (the record of a stage has the name of its parent) and may run in several threads at once. The CPU time
+    is the one of the process, so it includes the other threads running at the same time.
+
+    The stages matching the dump glob can also run under cProfile and tracemalloc, the statistics are written to the
+    dump directory (one dump at a time, the stages nested in a dumped stage are part of its dump).
+    """
+
+    def __init__(self, enabled: bool = None, dump: List[str] = None, stages: str = None, directory: str = None):
+        """
+        Initialize the profiler, the arguments default to the environment variables.
+
+        Args:
+            enabled (bool): Measure the stages, defaults to PIPELINE_PROFILE != '0'.
+            dump (List[str]): 'cprofile' and/or 'tracemalloc', defaults to PIPELINE_PROFILE_DUMP.
+            stages (str): The glob of the dumped stages, defaults to PIPELINE_PROFILE_STAGES or every stage.
+            directory (str): The directory of the dumps, defaults to PIPELINE_PROFILE_DIR or logs/profiles.
+        """
+        if dump is None:
+            dump = [name.strip() for name in os.environ.get(PROFILE_DUMP_ENV, '').split(',') if name.strip()]
+        unknown = [name for name in dump if name not in DUMPS]
+        assert not unknown, f'Unknown profile dumps {unknown}, please select in {list(DUMPS)}.'
+
+        self.enabled = os.environ.get(PROFILE_ENV, '1') != '0' if enabled is None else enabled
+        self.dump = list(dump)
+        self.stages = stages or os.environ.get(PROFILE_STAGES_ENV, '*')
+        self.directory = Path(directory or os.environ.get(PROFILE_DIR_ENV, PROFILE_DIR))
+
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._dumping = False
+        self._totals = {}
+
+    def _stack(self) -> list:
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    def _start(self, name: str, level: int) -> Stage:
+        stack = self._stack()
+        stage = Stage(name, stack[-1].name if stack else None, level)
+        stack.append(stage)
+
+        stage.dumps = self._start_dump(name)
+        stage.started = (time.perf_counter(), time.process_time(), peak_rss())
+        return stage
+
+    def _finish(self, stage: Stage, error: BaseException = None, discard: bool = False):
+        wall, cpu, peak = stage.started
+        wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+        self._stack().pop()
+
+        stage.measures = {'wall_s': round(wall, 6), 'cpu_s': round(cpu, 6), 'rss': current_rss(), 'peak_rss': peak_rss()}
+        if peak is not None:
+            stage.measures['peak_rss_growth'] = stage.measures['peak_rss'] - peak
+        stage.measures.update(self._finish_dump(stage))
+        if error is not None:
+            stage.measures['error'] = f'{type(error).__name__}: {error}'
+
+        if discard:
+            return
+
+        with self._lock:
+            total = self._totals.setdefault(stage.name, {'stage': stage.name, 'calls': 0, 'errors': 0, 'wall_s': 0.0,
+                                                         'cpu_s': 0.0, 'peak_rss': None, 'peak_rss_growth': 0})
+            total['calls'] += 1
+            total['errors'] += error is not None
+            total['wall_s'] += wall
+            total['cpu_s'] += cpu
+            if stage.measures['peak_rss'] is not None:
+                total['peak_rss'] = max(total['peak_rss'] or 0, stage.measures['peak_rss'])
+                total['peak_rss_growth'] += stage.measures.get('peak_rss_growth', 0)
+            for counter, value in stage.counters.items():
+                total[counter] = total.get(counter, 0) + value
+
+        if logger.isEnabledFor(stage.level):
+            logger.log(stage.level, json.dumps({'pid': os.getpid(), **stage.to_dict()}, default=str))
+
+    def _start_dump(self, name: str) -> dict:
+        """
+        Starts cProfile and tracemalloc for a dumped stage, if no other stage is dumped.
+        """
+        if not self.dump or not fnmatch(name, self.stages):
+            return {}
+        with self._lock:
+            if self._dumping:
+                return {}
+            self._dumping = True
+
+        dumps = {}
+        if 'tracemalloc' in self.dump:
+            dumps['tracemalloc'] = not tracemalloc.is_tracing()
+            if dumps['tracemalloc']:
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+        if 'cprofile' in self.dump:
+            dumps['cprofile'] = cProfile.Profile()
+            dumps['cprofile'].enable()
+        return dumps
+
+    def _finish_dump(self, stage: Stage) -> dict:
+        """
+        Writes the dumps of a stage, returns their paths and the peak of the traced memory.
+        """
+        if not stage.dumps:
+            return {}
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        prefix = Path(self.directory, f"{stage.name}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}")
+        measures = {}
+
+        if 'cprofile' in stage.dumps:
+            stage.dumps['cprofile'].disable()
+            stage.dumps['cprofile'].dump_stats(f'{prefix}.prof')
+            measures['cprofile'] = f'{prefix}.prof'
+
+        if 'tracemalloc' in stage.dumps:
+            measures['traced_peak'] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.take_snapshot().dump(f'{prefix}.tracemalloc')
+            measures['tracemalloc'] = f'{prefix}.tracemalloc'
+            if stage.dumps['tracemalloc']:
+                tracemalloc.stop()
+
+        with self._lock:
+            self._dumping = False
+        return measures
+
+    @contextmanager
+    def stage(self, name: str, level: int = logging.INFO, **counters) -> Iterator[Stage]:
+        """
+        Measures a block of code.
+
+            with profiler.stage('clean.fare_amount', rows_in=len(df)) as stage:
+                mask = ...
+                stage.record(rows_out=mask.sum())
+
+        Args:
+            name (str): The name of the stage, e.g. 'feature.trip'.
+            level (int): The logging level of the records, DEBUG for frequent stages.
+            counters: The initial counters of the stage.
+        """
+        if not self.enabled:
+            yield Stage(name)
+            return
+
+        stage = self._start(name, level).record(**counters)
+        try:
+            yield stage
+        except BaseException as error:
+            self._finish(stage, error)
+            raise
+        self._finish(stage)
+
+    def profile(self, name: str = None, level: int = logging.INFO) -> Callable:
+        """
+        Decorator measuring every call of a function. The rows and bytes in are the ones of the first dataframe, array
+        or bytes argument, the rows and bytes out the ones of the result (see size_of).
+
+        Args:
+            name (str): The name of the stage, defaults to the module and the qualified name of the function.
+            level (int): The logging level of the records.
+        """
+
+        def decorator(function: Callable) -> Callable:
+            stage_name = name or f"{function.__module__.split('.')[-1]}.{function.__qualname__}"
+
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return function(*args, **kwargs)
+
+                with self.stage(stage_name, level) as stage:
+                    for argument in list(args) + list(kwargs.values()):
+                        rows, size = size_of(argument)
+                        if size is not None:
+                            stage.record(rows_in=rows, bytes_in=size)
+                            break
+
+                    result = function(*args, **kwargs)
+
+                    rows, size = size_of(result)
+                    stage.record(rows_out=rows, bytes_out=size)
+                return result
+
+            return wrapper
+
+        return decorator
+
+    def iterate(self, name: str, iterable: Iterable, level: int = logging.INFO) -> Iterator:
+        """
+        Measures every step of an iterator as a call of the stage, e.g. reading the next chunk of a file.
+        """
+        iterator = iter(iterable)
+        while True:
+            if not self.enabled:
+                yield from iterator
+                return
+
+            stage = self._start(name, level)
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self._finish(stage, discard=True)
+                return
+            except BaseException as error:
+                self._finish(stage, error)
+                raise
+
+            rows, size = size_of(item)
+            self._finish(stage.record(rows_out=rows, bytes_out=size))
+            yield item
+
+    def summary(self) -> List[dict]:
+        """
+        The measures summed per stage, in the order the stages first finished.
+        """
+        with self._lock:
+            return [dict(total) for total in self._totals.values()]
+
+    def reset(self):
+        with self._lock:
+            self._totals = {}
+
+    def table(self) -> Table:
+        """
+        The summary as a rich table.
+        """
+
+        def mib(value) -> str:
+            return '-' if value is None else f'{value / 2 ** 20:,.1f}'
+
+        def count(value) -> str:
+            return '-' if value is None else f'{value:,}'
+
+        table = Table(title='Stage profile')
+        for column in ['Stage', 'Calls', 'Wall s', 'CPU s', 'Peak RSS MiB', 'RSS growth MiB', 'Rows in', 'Rows out',
+                       'MiB in', 'MiB out']:
+            table.add_column(column, justify='left' if column == 'Stage' else 'right', no_wrap=column == 'Stage')
+
+        for total in self.summary():
+            calls = f"{total['calls']}" + (f" ([red]{total['errors']} failed[/red])" if total['errors'] else '')
+            table.add_row(total['stage'], calls, f"{total['wall_s']:.3f}", f"{total['cpu_s']:.3f}", mib(total['peak_rss']),
+                          mib(total['peak_rss_growth']), count(total.get('rows_in')), count(total.get('rows_out')),
+                          mib(total.get('bytes_in')), mib(total.get('bytes_out')))
+
+        return table
+
+    def report(self, console: Console = None):
+        """
+        Prints the summary table and logs the summary as one JSON record.
+        """
+        if not self.enabled:
+            return
+        logger.info(json.dumps({'pid': os.getpid(), 'summary': self.summary()}, default=str))
+        (console or Console()).print(self.table())
+
+
+# Profiler of the process, configured by the environment variables
+PROFILER = Profiler()
+
+
+def stage(name: str, level: int = logging.INFO, **counters):
+    """
+    Measures a block of code with the profiler of the process, see Profiler.stage.
+    """
+    return PROFILER.stage(name, level, **counters)
+
+
+def profile(name: str = None, level: int = logging.INFO) -> Callable:
+    """
+    Decorator measuring a function with the profiler of the process, see Profiler.profile.
+    """
+    return PROFILER.profile(name, level)
+
+
+def iterate(name: str, iterable: Iterable, level: int = logging.INFO) -> Iterator:
+    """
+    Measures every step of an iterator with the profiler of the process, see Profiler.iterate.
+    """
+    return PROFILER.iterate(name, iterable, level)
@@ -0,0 +1,180 @@
+"""
+This file contains the micro-batcher that groups concurrent scoring requests into vectorized calls.
+"""
+import asyncio
+import time
+from typing import Callable, List, Sequence
+import numpy as np
+
+# Number of latencies kept to compute the percentiles
+LATENCY_WINDOW = 100_000
+
+
+class LatencyStats:
+    """
+    Latencies of the last LATENCY_WINDOW requests and the throughput since the start.
+    """
+
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self.latencies = np.zeros(window)
+        self.requests = 0
+        self.records = 0
+        self.batches = 0
+        self.started = time.perf_counter()
+
+    def record_request(self, seconds: float):
+        self.latencies[self.requests % len(self.latencies)] = seconds
+        self.requests += 1
+
+    def record_batch(self, records: int):
+        self.batches += 1
+        self.records += records
+
+    def report(self) -> dict:
+        """
+        Returns the p50 and p99 latencies in milliseconds, the throughput and the mean batch size.
+        """
+        latencies = self.latencies[:min(self.requests, len(self.latencies))]
+        elapsed = time.perf_counter() - self.started
+
+        return {
+            'requests'       : self.requests,
+            'records'        : self.records,
+            'batches'        : self.batches,
+            'mean_batch_size': self.records / self.batches if self.batches else 0.0,
+            'p50_ms'         : float(np.percentile(latencies, 50) * 1000) if len(latencies) else None,
+            'p99_ms'         : float(np.percentile(latencies, 99) * 1000) if len(latencies) else None,
+            'requests_per_s' : self.requests / elapsed if elapsed > 0 else 0.0,
+            'records_per_s'  : self.records / elapsed if elapsed > 0 else 0.0
+        }
+
+
+class MicroBatcher:
+    """
+    Collects the records of concurrent requests and scores them together. A batch is scored as soon as it holds
+    max_batch_size records or max_wait seconds after its first request, whichever comes first. The scoring runs in a
+    thread so the event loop keeps accepting requests meanwhile.
+    """
+
+    def __init__(self, score: Callable[[List], Sequence], max_batch_size: int = 64, max_wait: float = 0.002,
+                 stats: LatencyStats = None):
+        """
+        Initialize the batcher.
+
+        Args:
+            score (Callable): Function scoring a list of records, returns one result per record.
+            max_batch_size (int): The maximum number of records of a batch.
+            max_wait (float): The maximum time in seconds a request waits for other requests.
+            stats (LatencyStats): The statistics the batches are recorded in.
+        """
+        assert max_batch_size > 0, 'The maximum batch size must be positive.'
+        assert max_wait >= 0, 'The maximum wait must not be negative.'
+        self.score = score
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.stats = stats or LatencyStats()
+        self.queue = None
+        self.task = None
+
+    async def start(self):
+        self.queue = asyncio.Queue()
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    async def submit(self, records: List) -> list:
+        """
+        Score the records of one request along with the records of the other pending requests.
+
+        Args:
+            records (List): The records of the request.
+
+        Returns:
+            The results of the records.
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((records, future))
+        return await future
+
+    async def _next_batch(self) -> list:
+        """
+        Waits for a request, then collects the following ones until the batch is full or the wait is over.
+        """
+        loop = asyncio.get_running_loop()
+        batch = [await self.queue.get()]
+        size = len(batch[0][0])
+        deadline = loop.time() + self.max_wait
+
+        while size < self.max_batch_size:
+            try:
+                item = self.queue.get_nowait()
+            except asyncio.QueueEmpty:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), remaining)
+                except asyncio.TimeoutError:
+                    break
+
+            batch.append(item)
+            size += len(item[0])
+
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+
+        while True:
+            batch = await self._next_batch()
+            records = [record for request, _ in batch for record in request]
+
+            try:
+                results = await loop.run_in_executor(None, self.score, records)
+            except Exception as error:
+                if len(batch) == 1:
+                    self._set_exception(batch, error)
+                else:
+                    # one bad request must not fail the others, the requests are scored again one by one
+                    await self._run_each(batch)
+                continue
+
+            self._set_results(batch, records, results)
+
+    async def _run_each(self, batch: list):
+        """
+        Scores the requests of a failed batch separately, only the requests that fail again get the error.
+        """
+        loop = asyncio.get_running_loop()
+
+        for request, future in batch:
+            if future.done():
+                continue
+            try:
+                results = await loop.run_in_executor(None, self.score, list(request))
+            except Exception as error:
+                self._set_exception([(request, future)], error)
+                continue
+            self._set_results([(request, future)], request, results)
+
+    def _set_results(self, batch: list, records: list, results: Sequence):
+        self.stats.record_batch(len(records))
+
+        start = 0
+        for request, future in batch:
+            if not future.done():
+                future.set_result(list(results[start:start + len(request)]))
+            start += len(request)
+
+    @staticmethod
+    def _set_exception(batch: list, error: Exception):
+        for _, future in batch:
+            if not future.done():
+                future.set_exception(error)
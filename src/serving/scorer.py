@@ -0,0 +1,127 @@
+"""
+This file contains the scorer that turns raw trip records into big tip probabilities.
+"""
+from typing import Callable, Dict, List
+import numpy as np
+import pandas as pd
+from src.dataset.create_dataset import YELLOW_TRIP_DATE_COLUMNS, YELLOW_TRIP_DTYPES
+from src.dataset.storage import Storage
+from src.feature import feature_selection
+from src.feature.executor import FeatureExecutor
+from src.feature.feature_selection import FeatureEngineer
+from src.feature.spatial import MonthlyZoneAggregates, ZoneFeature
+from src.model.classifiers import Model
+
+# The features a single trip record can be scored with, by feature name. As in feature_engineering.py, the zones of a
+# trip are encoded with the persisted aggregates of the months before its pickup month.
+SERVING_FEATURES: Dict[str, Callable[[Storage], FeatureEngineer]] = {
+    'trip'   : lambda storage: feature_selection.TripFeature(),
+    'pick_up': lambda storage: feature_selection.TimeFeature(),
+    'meter'  : lambda storage: feature_selection.MeterFeature(),
+    'tip'    : lambda storage: feature_selection.TipFeature(),
+    'zone'   : lambda storage: ZoneFeature(MonthlyZoneAggregates(storage=storage))
+}
+
+
+def serving_features(columns: List[str] = None, storage: Storage = None) -> List[FeatureEngineer]:
+    """
+    Build the features that generate the given columns of a model (e.g. the 'features' of its registry metadata).
+
+    Args:
+        columns (List[str]): The feature columns of the model, defaults to every column a trip record can be scored with.
+        storage (Storage): The storage of the state of the features, defaults to get_storage().
+
+    Returns:
+        The features that generate at least one of the columns.
+    """
+    features = [build(storage) for build in SERVING_FEATURES.values()]
+    if columns is None:
+        return features
+
+    features = [feature for feature in features if set(feature.feature_dtype()) & set(columns)]
+
+    generated = {column for feature in features for column in feature.feature_dtype()}
+    missing = [column for column in columns if column not in generated]
+    assert not missing, f'The features {missing} can not be generated from a trip record, serving features: {list(SERVING_FEATURES)}.'
+
+    return features
+
+
+class TripScorer:
+    """
+    Scores raw trip records (the columns of the yellow trip files) with the same features the model was trained on.
+    Only the features that generate a column of model.features are run.
+    """
+
+    def __init__(self, model: Model, features: List[FeatureEngineer], positive_class=True):
+        """
+        Initialize the scorer.
+
+        Args:
+            model (Model): The trained model.
+            features (List[FeatureEngineer]): The features of the training data.
+            positive_class: The class whose probability is returned.
+        """
+        self.model = model
+        features = [feature for feature in features if set(feature.feature_dtype()) & set(model.features)]
+
+        # batches are small, running the features in the calling thread is faster than a thread pool
+        self.executor = FeatureExecutor(features, max_workers=1)
+
+        missing = [column for column in model.features if column not in self.executor.output_dtypes]
+        assert not missing, f'The features {missing} of the model are not generated by the given features.'
+
+        self.positive_index = list(model.model.classes_).index(positive_class)
+
+    @property
+    def source_columns(self) -> List[str]:
+        """
+        The fields a trip record must have.
+        """
+        return self.executor.source_columns
+
+    def to_frame(self, records: List[dict]) -> pd.DataFrame:
+        """
+        Build a frame with the dtypes of the yellow trip files from raw records. Missing fields are null.
+
+        Args:
+            records (List[dict]): The trip records.
+
+        Returns:
+            The source columns of the records.
+        """
+        df = pd.DataFrame.from_records(records, columns=self.source_columns)
+
+        for column in self.source_columns:
+            if column in YELLOW_TRIP_DATE_COLUMNS:
+                df[column] = pd.to_datetime(df[column])
+            elif column in YELLOW_TRIP_DTYPES:
+                df[column] = df[column].astype(YELLOW_TRIP_DTYPES[column])
+
+        return df
+
+    def score(self, records: List[dict]) -> np.ndarray:
+        """
+        Score a batch of records in one vectorized call.
+
+        Args:
+            records (List[dict]): The trip records.
+
+        Returns:
+            The probability of the positive class of every record, NaN for records with missing fields.
+        """
+        df = self.to_frame(records)
+        valid = df.notna().all(axis=1).to_numpy()
+
+        probabilities = np.full(len(df), np.nan)
+        if not valid.any():
+            return probabilities
+
+        features = self.executor.run(df[valid] if not valid.all() else df)
+
+        X = np.empty((len(features), len(self.model.features)), dtype=np.float32)
+        for j, column in enumerate(self.model.features):
+            X[:, j] = features[column].to_numpy()
+
+        probabilities[valid] = self.model.predict_proba(X)[:, self.positive_index]
+        return probabilities
@@ -0,0 +1,148 @@
+"""
+This file contains the HTTP server that scores live trips for big tip likelihood.
+
+    POST /score   body: one trip record or a list of trip records (JSON)
+                  response: {"probability": p} or {"probabilities": [p, ...]}, null for records with missing fields
+    GET  /stats   p50/p99 latency, throughput and mean batch size
+    GET  /health
+"""
+import asyncio
+import json
+import math
+import time
+from typing import Tuple
+from src.serving.batcher import LatencyStats, MicroBatcher
+from src.serving.scorer import TripScorer
+
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 413: 'Payload Too Large',
+           500: 'Internal Server Error'}
+
+# Largest accepted request body
+MAX_BODY_BYTES = 16 * 2 ** 20
+
+
+class ScoringServer:
+    """
+    Minimal HTTP/1.1 server on asyncio streams with keep-alive connections. The records of concurrent requests are
+    scored together by a MicroBatcher.
+    """
+
+    def __init__(self, scorer: TripScorer, host: str = '127.0.0.1', port: int = 8080, max_batch_size: int = 64,
+                 max_wait: float = 0.002):
+        """
+        Initialize the server.
+
+        Args:
+            scorer (TripScorer): The scorer of the trip records.
+            host (str): The address to listen on.
+            port (int): The port to listen on, 0 for any free port.
+            max_batch_size (int): The maximum number of records scored together.
+            max_wait (float): The maximum time in seconds a request waits for other requests.
+        """
+        self.scorer = scorer
+        self.host = host
+        self.port = port
+        self.stats = LatencyStats()
+        self.batcher = MicroBatcher(scorer.score, max_batch_size, max_wait, self.stats)
+        self.server = None
+
+    async def start(self):
+        await self.batcher.start()
+        self.server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def serve_forever(self):
+        await self.start()
+        print(f'Scoring server listening on http://{self.host}:{self.port}')
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def stop(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        await self.batcher.stop()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """
+        Serve the requests of one connection until the client closes it.
+        """
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+
+                method, target, *_ = request_line.decode('latin-1').split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                length = int(headers.get('content-length', 0))
+                if length > MAX_BODY_BYTES:
+                    self._write(writer, 413, {'error': f'Request body larger than {MAX_BODY_BYTES} bytes.'}, close=True)
+                    await writer.drain()
+                    break
+                body = await reader.readexactly(length) if length else b''
+
+                start = time.perf_counter()
+                status, payload = await self._route(method, target, body)
+                close = headers.get('connection', '').lower() == 'close'
+                self._write(writer, status, payload, close)
+                await writer.drain()
+
+                if method == 'POST' and status == 200:
+                    self.stats.record_request(time.perf_counter() - start)
+                if close:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _route(self, method: str, target: str, body: bytes) -> Tuple[int, dict]:
+        path = target.split('?', 1)[0]
+
+        if path == '/health':
+            return (200, {'status': 'ok'}) if method == 'GET' else (405, {'error': 'Use GET.'})
+        if path == '/stats':
+            return (200, self.stats.report()) if method == 'GET' else (405, {'error': 'Use GET.'})
+        if path != '/score':
+            return 404, {'error': f'Unknown path {path}.'}
+        if method != 'POST':
+            return 405, {'error': 'Use POST.'}
+
+        try:
+            records = json.loads(body)
+        except json.JSONDecodeError as error:
+            return 400, {'error': f'Invalid JSON: {error}'}
+
+        single = isinstance(records, dict)
+        records = [records] if single else records
+        if not isinstance(records, list) or not all(isinstance(record, dict) for record in records):
+            return 400, {'error': 'The body must be a trip record or a list of trip records.'}
+        if not records:
+            return 200, {'probabilities': []}
+
+        try:
+            results = await self.batcher.submit(records)
+        except (ValueError, TypeError) as error:
+            return 400, {'error': str(error)}
+        except Exception as error:
+            return 500, {'error': str(error)}
+
+        probabilities = [None if math.isnan(result) else float(result) for result in results]
+        return 200, {'probability': probabilities[0]} if single else {'probabilities': probabilities}
+
+    @staticmethod
+    def _write(writer: asyncio.StreamWriter, status: int, payload: dict, close: bool = False):
+        body = json.dumps(payload).encode('utf-8')
+        head = (f'HTTP/1.1 {status} {REASONS[status]}\r\n'
+                f'Content-Type: application/json\r\n'
+                f'Content-Length: {len(body)}\r\n'
+                f'Connection: {"close" if close else "keep-alive"}\r\n\r\n')
+        writer.write(head.encode('latin-1') + body)
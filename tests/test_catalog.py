@@ -0,0 +1,81 @@
+import json
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from src.dataset.catalog import VersionCatalog, is_version
+from src.dataset.storage import LocalStorage
+
+
+class VersionCatalogTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.storage = LocalStorage(self.directory.name)
+        self.catalog = VersionCatalog(self.storage)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_register_keeps_the_latest_version_of_every_format(self):
+        self.catalog.register('clean', '20220821-101010', 'data/clean/20220821-101010.csv', 'csv')
+        self.catalog.register('clean', '20220820-101010', 'data/clean/20220820-101010.csv', 'csv')
+        self.catalog.register('clean', '20220819-101010', 'data/clean/20220819-101010.parquet', 'parquet', rows=3)
+
+        self.assertEqual(self.catalog.latest('clean', 'csv'), '20220821-101010')
+        self.assertEqual(self.catalog.latest('clean', 'parquet'), '20220819-101010')
+        self.assertIsNone(self.catalog.latest('clean', 'model'))
+        self.assertTrue(self.catalog.exists('clean', 'data/clean/20220820-101010.csv'))
+        self.assertEqual(self.catalog.load('clean')['files']['data/clean/20220819-101010.parquet']['rows'], 3)
+
+    def test_concurrent_registers_are_not_lost(self):
+        versions = [f'20220820-1010{second:02d}' for second in range(40)]
+
+        def register(version):
+            VersionCatalog(self.storage).register('clean', version, f'data/clean/{version}.csv', 'csv')
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(register, versions))
+
+        catalog = json.loads(self.storage.read_bytes(VersionCatalog.catalog_path('clean')))
+        self.assertEqual(len(catalog['files']), len(versions))
+        self.assertEqual(catalog['latest']['csv'], max(versions))
+
+    def test_rebuild_indexes_every_recorded_format(self):
+        for path in ['data/models/gaussian_nb/20220820-101010/meta.json',
+                     'data/models/gaussian_nb/20220820-101010/theta_.npy',
+                     'data/models/gaussian_nb/20220821-101010-1/meta.json',
+                     'data/models/gaussian_nb/20220822-101010/theta_.npy',
+                     'data/models/gaussian_nb/_versions.json',
+                     'data/models/gaussian_nb/20220823-101010.parquet',
+                     'data/models/gaussian_nb/notes.csv']:
+            self.storage.write_bytes(path, b'{}')
+
+        catalog = self.catalog.rebuild('models/gaussian_nb')
+
+        # the version without meta.json is incomplete and not indexed
+        self.assertEqual(catalog['latest'], {'model': '20220821-101010-1', 'parquet': '20220823-101010'})
+        self.assertEqual(len(catalog['files']), 3)
+        self.assertTrue(self.storage.exists(VersionCatalog.catalog_path('models/gaussian_nb')))
+
+    def test_load_rebuilds_a_missing_catalog(self):
+        self.storage.write_bytes('data/clean/20220820-101010.csv', b'a')
+
+        self.assertEqual(self.catalog.latest('clean', 'csv'), '20220820-101010')
+
+    def test_latest_sees_the_first_version_of_another_writer(self):
+        self.assertIsNone(self.catalog.latest('clean', 'csv'))
+
+        VersionCatalog(self.storage).register('clean', '20220820-101010', 'data/clean/20220820-101010.csv', 'csv')
+
+        self.assertEqual(self.catalog.latest('clean', 'csv'), '20220820-101010')
+
+    def test_is_version(self):
+        self.assertTrue(is_version('20220820-101010'))
+        self.assertTrue(is_version('20220820-101010-12'))
+        self.assertFalse(is_version('20220820-101010-'))
+        self.assertFalse(is_version('20220820-101010.csv'))
+        self.assertFalse(is_version('_catalog.json'))
+
+
+if __name__ == '__main__':
+    unittest.main()
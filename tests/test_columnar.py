@@ -0,0 +1,54 @@
+import io
+import unittest
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+from src.dataset.columnar import read_parquet, select_row_groups, to_parquet_bytes
+
+
+def get_trips(rows: int = 1000, seed: int = 42) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'tpep_pickup_datetime': pd.Timestamp('2020-01-01') + pd.to_timedelta(rng.integers(0, 10 * 86400, rows), unit='s'),
+        'fare_amount'         : rng.uniform(3, 60, rows)
+    })
+
+
+class ColumnarTestCase(unittest.TestCase):
+    def setUp(self):
+        self.trips = get_trips()
+        # sorted on the pickup time, the 10 row groups cover one day each
+        self.data, self.manifest = to_parquet_bytes(self.trips, row_group_size=100, sort_by='tpep_pickup_datetime')
+        self.metadata = pq.ParquetFile(io.BytesIO(self.data)).metadata
+
+    def test_sort_by_keeps_the_row_groups_disjoint(self):
+        self.assertEqual(self.metadata.num_row_groups, 10)
+        self.assertEqual(select_row_groups(self.metadata), list(range(10)))
+
+        groups = select_row_groups(self.metadata, pd.Timestamp('2020-01-04'), pd.Timestamp('2020-01-05'))
+        self.assertLessEqual(len(groups), 3)
+
+    def test_bounds(self):
+        last = pd.Timestamp(self.trips['tpep_pickup_datetime'].max())
+        first = pd.Timestamp(self.trips['tpep_pickup_datetime'].min())
+
+        # the end is exclusive, the start inclusive
+        self.assertEqual(select_row_groups(self.metadata, end=first), [])
+        self.assertEqual(select_row_groups(self.metadata, start=last), [9])
+        self.assertEqual(select_row_groups(self.metadata, start=last + pd.Timedelta(seconds=1)), [])
+
+    def test_read_parquet_matches_a_filter(self):
+        start, end = pd.Timestamp('2020-01-03 12:00'), pd.Timestamp('2020-01-06')
+        pickup = self.trips['tpep_pickup_datetime']
+        expected = self.trips[(pickup >= start) & (pickup < end)].sort_values('tpep_pickup_datetime', kind='stable')
+
+        df = read_parquet(io.BytesIO(self.data), columns=['fare_amount'], pickup_range=(start, end))
+
+        self.assertEqual(list(df.columns), ['fare_amount'])
+        np.testing.assert_array_equal(df['fare_amount'].to_numpy(), expected['fare_amount'].to_numpy())
+
+
+if __name__ == '__main__':
+    unittest.main()
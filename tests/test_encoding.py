@@ -0,0 +1,62 @@
+import tempfile
+import unittest
+
+import pandas as pd
+import pyarrow as pa
+
+from src.dataset.query import to_dataframe
+from src.dataset.storage import LocalStorage
+from src.feature.encoding import DICTIONARY_PATH, CategoryDictionary, encode_categories, get_dictionary, save_dictionary
+
+
+class EncodeCategoriesTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.storage = LocalStorage(self.directory.name)
+        self.trips = pd.DataFrame({'payment_type': ['1', '2', '7', None], 'PULocationID': [1, 265, 300, None],
+                                   'fare_amount': [1.0, 2.0, 3.0, 4.0]})
+
+    def tearDown(self):
+        get_dictionary.cache_clear()
+        self.directory.cleanup()
+
+    def test_reading_does_not_write_the_dictionary(self):
+        df = encode_categories(self.trips, self.storage)
+
+        self.assertEqual(df['payment_type'].astype(object).tolist()[:3], ['1', '2', '7'])
+        self.assertTrue(pd.isna(df['payment_type'].iloc[3]))
+        self.assertFalse(self.storage.exists(DICTIONARY_PATH))
+
+    def test_write_steps_persist_the_new_categories(self):
+        encode_categories(self.trips, self.storage)
+        save_dictionary(self.storage)
+
+        stored = CategoryDictionary.load(storage=self.storage)
+        self.assertEqual(stored.categories['payment_type'][-1], '7')
+        self.assertEqual(stored.categories['PULocationID'][-1], 300)
+
+        encode_categories(self.trips.assign(payment_type=['8'] * 4), self.storage, save=True)
+        self.assertEqual(CategoryDictionary.load(storage=self.storage).categories['payment_type'][-2:], ['7', '8'])
+
+    def test_codes_of_stored_categories_never_change(self):
+        other = CategoryDictionary()
+        other.encode(pd.DataFrame({'payment_type': ['9']}))
+        other.save(storage=self.storage)
+
+        encode_categories(self.trips, self.storage, save=True)
+
+        stored = CategoryDictionary.load(storage=self.storage)
+        self.assertEqual(stored.categories['payment_type'][6:], ['9', '7'])
+
+    def test_to_dataframe_without_storage_keeps_the_columns_as_read(self):
+        table = pa.Table.from_pandas(self.trips, preserve_index=False)
+
+        df = to_dataframe(table)
+
+        self.assertIsInstance(df['payment_type'].dtype, pd.CategoricalDtype)
+        self.assertEqual(df['payment_type'].cat.categories.tolist(), ['1', '2', '7'])
+        self.assertFalse(self.storage.exists(DICTIONARY_PATH))
+
+
+if __name__ == '__main__':
+    unittest.main()
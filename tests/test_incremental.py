@@ -0,0 +1,109 @@
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from src.dataset.storage import LocalStorage
+from src.feature.feature_selection import FeatureEngineer
+from src.feature.incremental import IncrementalFeatureStore
+
+
+class FareFeature(FeatureEngineer):
+    def __init__(self, version: str = None):
+        super().__init__('fare', ['fare_amount'])
+        self.version = version
+
+    def generate_feature(self, df: pd.DataFrame) -> pd.DataFrame:
+        return pd.DataFrame({'double_fare': df['fare_amount'] * 2}, index=df.index)
+
+    def feature_dtype(self):
+        return {'double_fare': np.float32}
+
+
+class PreviousMonthFeature(FareFeature):
+    """
+    A feature of a month that also depends on the source of the month before it.
+    """
+
+    def partition_version(self, partition: str, source_fingerprints: dict):
+        previous = str(pd.Period(partition, freq='M') - 1)
+        return source_fingerprints.get(previous)
+
+
+def get_trips(partition: str, rows: int = 4) -> pd.DataFrame:
+    return pd.DataFrame({
+        'tpep_pickup_datetime': pd.date_range(pd.Period(partition, freq='M').start_time, periods=rows, freq='H'),
+        'fare_amount'         : np.arange(rows, dtype=np.float64)
+    })
+
+
+class IncrementalFeatureStoreTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.storage = LocalStorage(self.directory.name)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def get_store(self, feature: FeatureEngineer = None) -> IncrementalFeatureStore:
+        return IncrementalFeatureStore([feature or FareFeature()], passthrough=['tpep_pickup_datetime'], storage=self.storage)
+
+    def refresh(self, store: IncrementalFeatureStore, fingerprints: dict) -> list:
+        return store.refresh(fingerprints, lambda partition, columns: get_trips(partition)[columns])
+
+    def test_only_new_and_changed_partitions_are_computed(self):
+        fingerprints = {'2020-01': 'a', '2020-02': 'b'}
+
+        self.assertEqual(self.refresh(self.get_store(), fingerprints), ['2020-01', '2020-02'])
+        self.assertEqual(self.refresh(self.get_store(), fingerprints), [])
+        self.assertEqual(self.refresh(self.get_store(), {**fingerprints, '2020-02': 'c', '2020-03': 'd'}), ['2020-02', '2020-03'])
+
+    def test_a_computed_partition_is_planned_until_it_is_committed(self):
+        store = self.get_store()
+        self.assertEqual(store.plan({'2020-01': 'a'}), ['2020-01'])
+
+        features, entry = store.compute('2020-01', get_trips('2020-01'), 'a')
+        self.assertEqual(list(features.columns), ['double_fare', 'tpep_pickup_datetime'])
+        self.assertEqual(self.get_store().plan({'2020-01': 'a'}), ['2020-01'])
+
+        store.commit('2020-01', entry)
+        self.assertEqual(self.get_store().plan({'2020-01': 'a'}), [])
+
+    def test_a_changed_feature_definition_computes_every_partition(self):
+        fingerprints = {'2020-01': 'a', '2020-02': 'b'}
+        self.refresh(self.get_store(FareFeature(version='1')), fingerprints)
+
+        self.assertEqual(self.get_store(FareFeature(version='1')).plan(fingerprints), [])
+        self.assertEqual(self.get_store(FareFeature(version='2')).plan(fingerprints), ['2020-01', '2020-02'])
+
+    def test_partition_version_follows_the_previous_month(self):
+        fingerprints = {'2020-01': 'a', '2020-02': 'b', '2020-03': 'c'}
+        self.refresh(self.get_store(PreviousMonthFeature()), fingerprints)
+
+        # the source of January changed: January and the month encoded with it are computed again
+        self.assertEqual(self.get_store(PreviousMonthFeature()).plan({**fingerprints, '2020-01': 'z'}), ['2020-01', '2020-02'])
+
+    def test_read_returns_the_stored_features(self):
+        self.refresh(self.get_store(), {'2020-01': 'a', '2020-02': 'b'})
+
+        features = self.get_store().read(columns=['double_fare'])
+        self.assertEqual(len(features), 8)
+        self.assertEqual(features['double_fare'].dtype, np.float32)
+        self.assertEqual(features['double_fare'].tolist(), [0, 2, 4, 6] * 2)
+
+    def test_concurrent_commits_are_not_lost(self):
+        partitions = [f'2020-{month:02d}' for month in range(1, 13)]
+
+        def materialize(partition):
+            self.get_store().materialize(partition, get_trips(partition), partition)
+
+        with ThreadPoolExecutor(max_workers=6) as executor:
+            list(executor.map(materialize, partitions))
+
+        self.assertEqual(sorted(self.get_store().load_state()), partitions)
+
+
+if __name__ == '__main__':
+    unittest.main()
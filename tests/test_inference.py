@@ -0,0 +1,66 @@
+import unittest
+
+import numpy as np
+from sklearn.naive_bayes import GaussianNB
+
+from src.model.inference import CompiledGaussianNB
+
+
+def get_data(rows: int, features: int = 6, classes: int = 2, seed: int = 42):
+    rng = np.random.default_rng(seed)
+    Y = rng.integers(0, classes, rows)
+    X = rng.normal(size=(rows, features)) + Y[:, None] * rng.uniform(0.1, 1.0, features)
+    return X, Y
+
+
+class CompiledGaussianNBTestCase(unittest.TestCase):
+    def setUp(self):
+        X, Y = get_data(5000)
+        self.estimator = GaussianNB().fit(X, Y == 1)
+        self.X, _ = get_data(3000, seed=7)
+
+    def test_predict_proba_matches_sklearn(self):
+        kernel = CompiledGaussianNB.from_model(self.estimator)
+
+        np.testing.assert_allclose(kernel.predict_proba(self.X), self.estimator.predict_proba(self.X), rtol=1e-9, atol=1e-12)
+        np.testing.assert_array_equal(kernel.predict(self.X), self.estimator.predict(self.X))
+
+    def test_chunks_do_not_change_the_result(self):
+        kernel = CompiledGaussianNB.from_model(self.estimator, chunk_size=128)
+
+        # 3000 rows are 23 full chunks and a partial one
+        np.testing.assert_allclose(kernel.predict_proba(self.X), self.estimator.predict_proba(self.X), rtol=1e-9, atol=1e-12)
+
+    def test_float32_input(self):
+        kernel = CompiledGaussianNB.from_model(self.estimator)
+        X = self.X.astype(np.float32)
+
+        np.testing.assert_allclose(kernel.predict_proba(X), self.estimator.predict_proba(X), rtol=1e-6, atol=1e-9)
+
+    def test_multiclass(self):
+        X, Y = get_data(5000, classes=3)
+        estimator = GaussianNB().fit(X, Y)
+        kernel = CompiledGaussianNB.from_model(estimator)
+
+        np.testing.assert_allclose(kernel.predict_proba(self.X), estimator.predict_proba(self.X), rtol=1e-9, atol=1e-12)
+        np.testing.assert_array_equal(kernel.predict(self.X), estimator.predict(self.X))
+
+    def test_predict_iter(self):
+        kernel = CompiledGaussianNB.from_model(self.estimator)
+        chunks = np.array_split(self.X, 5)
+
+        predictions = np.concatenate(list(kernel.predict_iter(chunks)))
+        probabilities = np.concatenate(list(kernel.predict_iter(chunks, proba=True)))
+
+        np.testing.assert_array_equal(predictions, self.estimator.predict(self.X))
+        np.testing.assert_allclose(probabilities, self.estimator.predict_proba(self.X), rtol=1e-9, atol=1e-12)
+
+    def test_wrong_number_of_features(self):
+        kernel = CompiledGaussianNB.from_model(self.estimator)
+
+        with self.assertRaises(AssertionError):
+            kernel.predict_proba(self.X[:, :3])
+
+
+if __name__ == '__main__':
+    unittest.main()
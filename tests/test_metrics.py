@@ -0,0 +1,61 @@
+import unittest
+
+import numpy as np
+from sklearn.metrics import accuracy_score, f1_score, log_loss, precision_score, recall_score
+
+from src.model.metrics import BinaryMetrics, evaluate_stream, split_chunks
+
+
+class BinaryMetricsTestCase(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(42)
+        self.probability = rng.uniform(0, 1, 10_000)
+        self.y_true = rng.uniform(0, 1, 10_000) < self.probability
+
+    def test_metrics_match_sklearn(self):
+        report = BinaryMetrics().update(self.y_true, self.probability).report()
+        y_pred = self.probability > 0.5
+
+        self.assertEqual(report['rows'], len(self.y_true))
+        self.assertAlmostEqual(report['accuracy'], accuracy_score(self.y_true, y_pred))
+        self.assertAlmostEqual(report['precision'], precision_score(self.y_true, y_pred))
+        self.assertAlmostEqual(report['recall'], recall_score(self.y_true, y_pred))
+        self.assertAlmostEqual(report['f1'], f1_score(self.y_true, y_pred))
+        self.assertAlmostEqual(report['log_loss'], log_loss(self.y_true, self.probability))
+
+    def test_merged_chunks_equal_one_pass(self):
+        whole = BinaryMetrics().update(self.y_true, self.probability)
+
+        merged = BinaryMetrics()
+        for start in range(0, len(self.y_true), 999):
+            merged.merge(BinaryMetrics().update(self.y_true[start:start + 999], self.probability[start:start + 999]))
+
+        np.testing.assert_array_equal(merged.confusion, whole.confusion)
+        np.testing.assert_array_equal(merged.bin_count, whole.bin_count)
+        np.testing.assert_array_equal(merged.bin_positive, whole.bin_positive)
+        self.assertAlmostEqual(merged.log_loss, whole.log_loss)
+
+        added = BinaryMetrics().update(self.y_true[:5000], self.probability[:5000]) + \
+            BinaryMetrics().update(self.y_true[5000:], self.probability[5000:])
+        np.testing.assert_array_equal(added.confusion, whole.confusion)
+
+    def test_accumulators_of_other_bins_do_not_merge(self):
+        with self.assertRaises(AssertionError):
+            BinaryMetrics(bins=10).merge(BinaryMetrics(bins=20))
+
+    def test_evaluate_stream_with_threads(self):
+        X = self.probability[:, None]
+        Y = self.y_true
+
+        def predict_proba(chunk):
+            return np.column_stack([1 - chunk[:, 0], chunk[:, 0]])
+
+        serial = evaluate_stream(predict_proba, split_chunks(X, Y, 1000))
+        threaded = evaluate_stream(predict_proba, split_chunks(X, Y, 1000), n_jobs=4)
+
+        np.testing.assert_array_equal(serial.confusion, threaded.confusion)
+        self.assertEqual(serial.rows, len(Y))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import os
+import tempfile
+import unittest
+
+from src.dataset.postgres import TripFileReader, parse_filename
+
+GREEN_2014 = ('VendorID,lpep_pickup_datetime,Lpep_dropoff_datetime,Store_and_fwd_flag,RateCodeID,Pickup_longitude,'
+              'Pickup_latitude,Dropoff_longitude,Dropoff_latitude,Passenger_count,Trip_distance,Fare_amount,Extra,MTA_tax,'
+              'Tip_amount,Tolls_amount,Ehail_fee,Total_amount,Payment_type,Trip_type \r\n'
+              '\r\n'
+              '2,2014-01-01 00:00:00,2014-01-01 00:10:00,N,1,0,0,-73.8,40.7,1,.00,2.5,0.5,0.5,0,0,,3.5,2,1.0,,\r\n')
+
+GREEN_2020 = ('VendorID,lpep_pickup_datetime,lpep_dropoff_datetime,store_and_fwd_flag,RatecodeID,PULocationID,DOLocationID,'
+              'passenger_count,trip_distance,fare_amount,extra,mta_tax,tip_amount,tolls_amount,ehail_fee,'
+              'improvement_surcharge,total_amount,payment_type,trip_type,congestion_surcharge\n'
+              '2,2020-01-01 00:00:00,2020-01-01 00:10:00,N,1,74,75,1,1.2,6.5,0.5,0.5,0,0,,0.3,7.8,2,1,0\n')
+
+YELLOW_2020 = ('VendorID,tpep_pickup_datetime,tpep_dropoff_datetime,passenger_count,trip_distance,RatecodeID,'
+               'store_and_fwd_flag,PULocationID,DOLocationID,payment_type,fare_amount,extra,mta_tax,tip_amount,'
+               'tolls_amount,improvement_surcharge,total_amount,congestion_surcharge\n'
+               '1,2020-01-01 00:28:15,2020-01-01 00:33:03,1.0,1.20,1.0,N,238,239,1,6,3,0.5,1.47,0,0.3,11.27,2.5\n')
+
+
+class TripFileReaderTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def read(self, name: str, content: str, cab_type_id: int):
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'w', newline='') as file:
+            file.write(content)
+        with TripFileReader(path, cab_type_id) as reader:
+            return reader, reader.read()
+
+    def test_green_columns_are_mapped_by_name(self):
+        reader, data = self.read('green_tripdata_2020-01.csv', GREEN_2020, 2)
+
+        self.assertIn('ehail_fee', reader.columns)
+        self.assertIn('trip_type', reader.columns)
+        self.assertEqual(reader.copy_sql().split('(')[1].split(',')[0], 'cab_type_id')
+        self.assertEqual(data, '2,2,2020-01-01 00:00:00,2020-01-01 00:10:00,N,1,74,75,1,1.2,6.5,0.5,0.5,0,0,,0.3,7.8,2,1,0\n')
+
+    def test_coordinates_blank_lines_and_trailing_fields_are_dropped(self):
+        reader, data = self.read('green_tripdata_2014-01.csv', GREEN_2014, 2)
+
+        self.assertNotIn('pickup_location', reader.columns)
+        self.assertEqual(reader.columns[-1], 'trip_type')
+        self.assertEqual(reader.blank_lines, 1)
+        self.assertEqual(reader.fixed_integers, 1)
+        self.assertEqual(data, '2,2,2014-01-01 00:00:00,2014-01-01 00:10:00,N,1,1,.00,2.5,0.5,0.5,0,0,,3.5,2,1\n')
+
+    def test_yellow_integers_written_as_floats_are_fixed(self):
+        reader, data = self.read('yellow_tripdata_2020-01.csv', YELLOW_2020, 1)
+
+        self.assertNotIn('trip_type', reader.columns)
+        self.assertEqual(data, '1,1,2020-01-01 00:28:15,2020-01-01 00:33:03,1,1.20,1,N,238,239,1,6,3,0.5,1.47,0,0.3,11.27,2.5\n')
+
+    def test_unknown_column_raises(self):
+        with self.assertRaises(ValueError):
+            self.read('yellow_tripdata_2020-02.csv', 'VendorID,unknown_column\n1,2\n', 1)
+
+    def test_parse_filename(self):
+        self.assertEqual(parse_filename('/data/2014/Green/green_tripdata_2014-01.csv'), ('green', '2014', '01'))
+
+
+if __name__ == '__main__':
+    unittest.main()
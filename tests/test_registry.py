@@ -0,0 +1,54 @@
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from src.dataset.catalog import is_version
+from src.dataset.storage import LocalStorage
+from src.model.classifiers import GaussianNBModel
+from src.model.registry import ModelRegistry
+
+
+def get_model() -> GaussianNBModel:
+    rng = np.random.default_rng(42)
+    X = rng.normal(size=(500, 3)).astype(np.float32)
+    model = GaussianNBModel(features=['a', 'b', 'c'], label='big_tip')
+    model.fit(X, X[:, 0] > 0)
+    return model
+
+
+class ModelRegistryTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.storage = LocalStorage(self.directory.name)
+        self.model = get_model()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_concurrent_saves_get_distinct_versions(self):
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            versions = list(executor.map(lambda _: ModelRegistry(self.storage).save(self.model), range(12)))
+
+        self.assertEqual(len(set(versions)), len(versions))
+        self.assertTrue(all(is_version(version) for version in versions))
+
+        registry = ModelRegistry(self.storage)
+        self.assertEqual(registry.latest(), max(versions))
+        self.assertEqual(sorted(registry.versions()), sorted(versions))
+
+    def test_load_returns_the_saved_parameters(self):
+        registry = ModelRegistry(self.storage)
+        version = registry.save(self.model, metrics={'f1': 0.5}, dtypes={'a': 'FLOAT64'})
+
+        model = ModelRegistry(self.storage).load(version)
+        X = np.random.default_rng(7).normal(size=(100, 3)).astype(np.float32)
+
+        self.assertEqual(model.features, ['a', 'b', 'c'])
+        np.testing.assert_allclose(model.predict_proba(X), self.model.predict_proba(X))
+        self.assertEqual(registry.metadata(version)['metrics'], {'f1': 0.5})
+
+
+if __name__ == '__main__':
+    unittest.main()
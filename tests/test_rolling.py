@@ -0,0 +1,148 @@
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from src.feature.rolling import RollingFeature, SlidingWindowEngine
+
+
+def get_trips(rows: int, seed: int = 42) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    fare = rng.uniform(3, 60, rows).round(2)
+
+    return pd.DataFrame({
+        'PULocationID'        : pd.array(rng.integers(1, 4, rows), dtype='Int32'),
+        'tpep_pickup_datetime': pd.Timestamp('2020-01-01') + pd.to_timedelta(np.sort(rng.integers(0, 6 * 3600, rows)), unit='s'),
+        'fare_amount'         : fare,
+        'tip_amount'          : (fare * rng.uniform(0, 0.4, rows)).round(2)
+    })
+
+
+def reference(trips: pd.DataFrame, window: int) -> pd.DataFrame:
+    """
+    The windows of every trip computed one trip at a time.
+    """
+    seconds = trips['tpep_pickup_datetime'].to_numpy(dtype='datetime64[s]').astype(np.int64)
+    zones = trips['PULocationID'].to_numpy()
+    big_tip = (trips['tip_amount'] / trips['fare_amount'] > 0.25).to_numpy()
+    fare = trips['fare_amount'].to_numpy()
+
+    rows = []
+    for i in range(len(trips)):
+        inside = (zones == zones[i]) & (seconds >= seconds[i] - window * 60) & (seconds < seconds[i])
+        rows.append({
+            f'zone_trips_{window}m'   : inside.sum(),
+            f'zone_fare_{window}m'    : fare[inside].mean() if inside.any() else 0.0,
+            f'zone_tip_rate_{window}m': big_tip[inside].mean() if inside.any() else 0.0
+        })
+    return pd.DataFrame(rows, index=trips.index)
+
+
+class SlidingWindowEngineTestCase(unittest.TestCase):
+    def run_engine(self, engine: SlidingWindowEngine, chunks: list) -> pd.DataFrame:
+        frames = [engine.process(chunk) for chunk in chunks] + [engine.flush()]
+        return pd.concat(frames).sort_index()
+
+    def assert_windows(self, features: pd.DataFrame, trips: pd.DataFrame, windows=(15, 60)):
+        for window in windows:
+            expected = reference(trips, window)
+            np.testing.assert_array_equal(features[f'zone_trips_{window}m'], expected[f'zone_trips_{window}m'])
+            np.testing.assert_allclose(features[f'zone_fare_{window}m'], expected[f'zone_fare_{window}m'], rtol=1e-5)
+            np.testing.assert_allclose(features[f'zone_tip_rate_{window}m'], expected[f'zone_tip_rate_{window}m'], rtol=1e-5)
+
+    def test_chunks_match_the_reference(self):
+        trips = get_trips(2000)
+        engine = SlidingWindowEngine()
+
+        features = self.run_engine(engine, np.array_split(trips, 7))
+
+        self.assertEqual(len(features), len(trips))
+        self.assertEqual(engine.late, 0)
+        self.assert_windows(features, trips)
+
+    def test_out_of_order_trips_within_the_lateness(self):
+        trips = get_trips(2000)
+        # every chunk is shuffled, the chunks span less than the lateness
+        chunks = [chunk.sample(frac=1, random_state=1) for chunk in np.array_split(trips, 40)]
+
+        engine = SlidingWindowEngine()
+        features = self.run_engine(engine, chunks)
+
+        self.assertEqual(engine.late, 0)
+        self.assert_windows(features, trips)
+
+    def test_trips_of_the_same_second_do_not_see_each_other(self):
+        pickup = pd.Timestamp('2020-01-01 10:00:00')
+        trips = pd.DataFrame({
+            'PULocationID'        : [1, 1, 1, 2],
+            'tpep_pickup_datetime': [pickup - pd.Timedelta(minutes=5), pickup, pickup, pickup],
+            'fare_amount'         : [10.0, 20.0, 30.0, 40.0],
+            'tip_amount'          : [5.0, 0.0, 0.0, 0.0]
+        })
+
+        features = self.run_engine(SlidingWindowEngine(), [trips])
+
+        self.assertEqual(features['zone_trips_15m'].tolist(), [0, 1, 1, 0])
+        self.assertEqual(features['zone_fare_15m'].tolist(), [0.0, 10.0, 10.0, 0.0])
+        self.assertEqual(features['zone_tip_rate_15m'].tolist(), [0.0, 1.0, 1.0, 0.0])
+
+    def test_late_trips_are_counted_and_seen_by_the_next_trips(self):
+        start = pd.Timestamp('2020-01-01 10:00:00')
+
+        def trip(minutes: int, label: int) -> pd.DataFrame:
+            return pd.DataFrame({'PULocationID': [1], 'tpep_pickup_datetime': [start + pd.Timedelta(minutes=minutes)],
+                                 'fare_amount': [10.0], 'tip_amount': [0.0]}, index=[label])
+
+        engine = SlidingWindowEngine(windows=(15,), lateness=pd.Timedelta(minutes=5))
+        engine.process(trip(0, 0))
+        engine.process(trip(20, 1))
+
+        # 10:08 is before the watermark 10:15
+        late = engine.process(trip(8, 2))
+        self.assertEqual(engine.late, 1)
+        self.assertEqual(late.index.tolist(), [2])
+        self.assertEqual(late['zone_trips_15m'].tolist(), [1])
+
+        features = self.run_engine(engine, [trip(21, 3)])
+        self.assertEqual(features.loc[3, 'zone_trips_15m'], 2)
+
+    def test_flush_emits_every_pending_trip(self):
+        trips = get_trips(100)
+        engine = SlidingWindowEngine()
+
+        emitted = engine.process(trips)
+        self.assertLess(len(emitted), len(trips))
+
+        flushed = engine.flush()
+        self.assertEqual(sorted(emitted.index.tolist() + flushed.index.tolist()), trips.index.tolist())
+        self.assertEqual(len(engine.flush()), 0)
+
+    def test_empty_chunk(self):
+        engine = SlidingWindowEngine()
+        features = engine.process(get_trips(10).iloc[:0])
+
+        self.assertEqual(len(features), 0)
+        self.assertEqual(dict(features.dtypes), {column: np.dtype(dtype) for column, dtype in engine.columns.items()})
+        self.assertIsNone(engine.watermark)
+
+
+class RollingFeatureTestCase(unittest.TestCase):
+    def test_lookback_matches_the_whole_stream(self):
+        trips = get_trips(2000)
+        split = trips['tpep_pickup_datetime'] >= pd.Timestamp('2020-01-01 03:00:00')
+        before, after = trips[~split], trips[split]
+
+        def lookback(start, end):
+            pickup = trips['tpep_pickup_datetime']
+            return trips[(pickup >= start) & (pickup < end)]
+
+        feature = RollingFeature(lookback=lookback)
+        features = feature.transform(after.set_axis(np.zeros(len(after), dtype=int), axis=0))
+
+        expected = RollingFeature().transform(trips)[split.to_numpy()]
+        np.testing.assert_array_equal(features.to_numpy(), expected.to_numpy())
+        self.assertGreater(len(before), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
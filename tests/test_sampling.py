@@ -0,0 +1,46 @@
+import unittest
+
+import numpy as np
+
+from src.model.sampling import ReservoirSampler
+
+
+class ReservoirSamplerTestCase(unittest.TestCase):
+    def stream(self, sampler: ReservoirSampler, rows: int, batch_size: int):
+        out = []
+        for start in range(0, rows, batch_size):
+            X = np.arange(start, min(start + batch_size, rows), dtype=np.int64)[:, None]
+            x_out, y_out = sampler.add(X, X[:, 0])
+            np.testing.assert_array_equal(x_out[:, 0], y_out)
+            out.append(y_out)
+        return np.concatenate(out)
+
+    def test_every_row_is_either_sampled_or_returned(self):
+        sampler = ReservoirSampler(100, random_state=42)
+        out = self.stream(sampler, 10_000, 333)
+
+        _, sample = sampler.sample
+        self.assertEqual(len(sample), 100)
+        self.assertEqual(len(out) + len(sample), 10_000)
+        np.testing.assert_array_equal(np.sort(np.concatenate([out, sample])), np.arange(10_000))
+
+    def test_short_stream_fills_the_reservoir(self):
+        sampler = ReservoirSampler(100, random_state=42)
+        out = self.stream(sampler, 60, 25)
+
+        self.assertEqual(len(out), 0)
+        np.testing.assert_array_equal(sampler.sample[1], np.arange(60))
+
+    def test_sample_is_uniform(self):
+        counts = np.zeros(10, dtype=np.int64)
+        for seed in range(400):
+            sampler = ReservoirSampler(10, random_state=seed)
+            self.stream(sampler, 100, 7)
+            counts += np.bincount(sampler.sample[1] // 10, minlength=10)
+
+        # every tenth of the stream holds a tenth of the 4000 sampled rows
+        self.assertTrue(np.all(np.abs(counts - 400) < 80), counts)
+
+
+if __name__ == '__main__':
+    unittest.main()
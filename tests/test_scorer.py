@@ -0,0 +1,94 @@
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from src.dataset.storage import LocalStorage
+from src.feature.executor import FeatureExecutor
+from src.feature.rolling import RollingFeature
+from src.feature.spatial import MonthlyZoneAggregates
+from src.model.classifiers import GaussianNBModel
+from src.serving.scorer import TripScorer, serving_features
+
+
+def get_trips(rows: int, month: str, seed: int = 42) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    pickup = pd.Period(month, freq='M').start_time + pd.to_timedelta(rng.integers(0, 28 * 86400, rows), unit='s')
+    fare = rng.uniform(3, 60, rows).round(2)
+
+    return pd.DataFrame({
+        'tpep_pickup_datetime' : pickup,
+        'tpep_dropoff_datetime': pickup + pd.to_timedelta(rng.integers(60, 3600, rows), unit='s'),
+        'trip_distance'        : rng.uniform(0.1, 20, rows).round(2),
+        'tolls_amount'         : np.where(rng.random(rows) < 0.05, 6.12, 0.0),
+        'PULocationID'         : pd.array(rng.integers(1, 266, rows), dtype='Int32'),
+        'DOLocationID'         : pd.array(rng.integers(1, 266, rows), dtype='Int32'),
+        'fare_amount'          : fare,
+        'tip_amount'           : (fare * rng.uniform(0, 0.4, rows)).round(2)
+    })
+
+
+def to_records(df: pd.DataFrame) -> list:
+    records = df.astype(object).where(df.notna(), None).to_dict(orient='records')
+    for record in records:
+        for column in ['tpep_pickup_datetime', 'tpep_dropoff_datetime']:
+            record[column] = record[column].isoformat()
+    return records
+
+
+class TripScorerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.storage = LocalStorage(self.directory.name)
+
+        # the zones of February are encoded with the aggregates of January
+        january = get_trips(5000, '2020-01')
+        MonthlyZoneAggregates(storage=self.storage).refresh({'2020-01': 'a'}, lambda partition, columns: january[columns])
+
+        self.trips = get_trips(2000, '2020-02', seed=7)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def train(self, features: list) -> GaussianNBModel:
+        df = FeatureExecutor(features).run(self.trips)
+        model = GaussianNBModel(features=[column for column in df.columns if column != 'big_tip'], label='big_tip')
+        model.fit(*model.preprocess(df))
+        return model
+
+    def test_scores_match_the_training_features(self):
+        model = self.train(serving_features(storage=self.storage))
+        self.assertIn('od_big_tip', model.features)
+
+        scorer = TripScorer(model, serving_features(model.features, self.storage))
+        probabilities = scorer.score(to_records(self.trips.head(50)))
+
+        X, _ = model.preprocess(FeatureExecutor(serving_features(storage=self.storage)).run(self.trips.head(50)))
+        np.testing.assert_allclose(probabilities, model.predict_proba(X)[:, 1], rtol=1e-5)
+
+    def test_only_the_features_of_the_model_are_built(self):
+        features = serving_features(['trip_speed', 'pu_big_tip'], self.storage)
+
+        self.assertEqual([feature.feature_name for feature in features], ['trip', 'zone'])
+
+    def test_features_without_a_serving_feature_fail(self):
+        columns = list(RollingFeature().feature_dtype())
+
+        with self.assertRaises(AssertionError):
+            serving_features(['trip_speed'] + columns, self.storage)
+
+    def test_missing_fields_score_nan(self):
+        model = self.train(serving_features(storage=self.storage))
+        scorer = TripScorer(model, serving_features(model.features, self.storage))
+
+        records = to_records(self.trips.head(2))
+        del records[1]['fare_amount']
+
+        probabilities = scorer.score(records)
+        self.assertFalse(np.isnan(probabilities[0]))
+        self.assertTrue(np.isnan(probabilities[1]))
+
+
+if __name__ == '__main__':
+    unittest.main()
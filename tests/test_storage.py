@@ -0,0 +1,73 @@
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from src.dataset.storage import LocalStorage, PreconditionFailed
+
+
+class LocalStorageTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.storage = LocalStorage(self.directory.name)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_read_versioned_missing_path(self):
+        self.assertEqual(self.storage.read_versioned('data/missing.json'), (None, 0))
+
+    def test_write_if_generation_creates_only_once(self):
+        self.storage.write_if_generation('data/state.json', b'first', 0)
+
+        with self.assertRaises(PreconditionFailed):
+            self.storage.write_if_generation('data/state.json', b'second', 0)
+        self.assertEqual(self.storage.read_bytes('data/state.json'), b'first')
+
+    def test_write_if_generation_rejects_stale_generation(self):
+        self.storage.write_if_generation('data/state.json', b'first', 0)
+        _, generation = self.storage.read_versioned('data/state.json')
+
+        self.storage.write_if_generation('data/state.json', b'second', generation)
+        data, current = self.storage.read_versioned('data/state.json')
+        self.assertEqual(data, b'second')
+        self.assertNotEqual(current, generation)
+
+        with self.assertRaises(PreconditionFailed):
+            self.storage.write_if_generation('data/state.json', b'third', generation)
+        self.assertEqual(self.storage.read_bytes('data/state.json'), b'second')
+
+    def test_write_bytes_changes_the_generation(self):
+        self.storage.write_bytes('data/state.json', b'first')
+        _, generation = self.storage.read_versioned('data/state.json')
+        self.storage.write_bytes('data/state.json', b'first')
+
+        with self.assertRaises(PreconditionFailed):
+            self.storage.write_if_generation('data/state.json', b'second', generation)
+
+    def test_concurrent_increments_are_not_lost(self):
+        self.storage.write_bytes('data/counter', b'0')
+
+        def increment(_):
+            while True:
+                data, generation = self.storage.read_versioned('data/counter')
+                try:
+                    self.storage.write_if_generation('data/counter', str(int(data) + 1).encode('utf-8'), generation)
+                    return
+                except PreconditionFailed:
+                    continue
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(increment, range(50)))
+
+        self.assertEqual(self.storage.read_bytes('data/counter'), b'50')
+
+    def test_list_files_hides_temporary_and_lock_files(self):
+        self.storage.write_bytes('data/clean/20220820-101010.csv', b'a')
+        self.storage.write_if_generation('data/clean/_catalog.json', b'{}', 0)
+
+        self.assertEqual(self.storage.list_files('data/clean/'), ['data/clean/20220820-101010.csv', 'data/clean/_catalog.json'])
+        self.assertEqual(self.storage.list_files('data/clean/2022'), ['data/clean/20220820-101010.csv'])
+
+
+if __name__ == '__main__':
+    unittest.main()